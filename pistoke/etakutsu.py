@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+'''
+JSON-RPC 2.0 -muotoiset etäkutsut Websocket-yhteyden kautta.
+
+Metodit rekisteröidään `Etakutsu`-näkymälle, joka ohjaa saapuvat
+kutsut niille nimen perusteella ja vastaa kutsun tunnuksella (`id`):
+```python
+# views.py
+from pistoke.etakutsu import Etakutsu, EtakutsuVirhe
+
+rpc = Etakutsu(rinnakkain=4)
+
+@rpc.metodi
+async def summa(request, a, b):
+  return a + b
+
+@rpc.metodi(nimi='kayttaja.hae')
+def hae_kayttaja(request, tunnus):
+  ...
+
+# urls.py
+urlpatterns = [path('rpc/', rpc), ...]
+```
+
+Kutsut suoritetaan kukin omassa tehtävässään, joten hidas kutsu ei
+viivästytä saman yhteyden muita kutsuja. Samanaikaisesti suoritettavien
+kutsujen määrää rajoitetaan yhteyskohtaisesti (`rinnakkain`).
+
+Keskeneräinen kutsu perutaan ilmoituksella
+`{"jsonrpc": "2.0", "method": "$/cancelRequest", "params": {"id": 1}}`;
+perutusta kutsusta vastataan virheellä -32800.
+'''
+
+import asyncio
+import functools
+import inspect
+import logging
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from . import mittarit
+from .koodain import json_koodain, muodosta_koodain
+from .protokolla import WebsocketProtokolla
+
+
+loki = logging.getLogger('django.' + __name__)
+
+
+class EtakutsuVirhe(Exception):
+  '''
+  Metodin nostama virhe, joka palautetaan kutsujalle JSON-RPC-virheenä.
+  '''
+
+  def __init__(self, koodi, viesti, data=None):
+    super().__init__(koodi, viesti)
+    self.koodi = koodi
+    self.viesti = viesti
+    self.data = data
+    # def __init__
+
+  def virhe(self):
+    ''' Muodosta vastaussanoman `error`-osa. '''
+    virhe = {'code': self.koodi, 'message': self.viesti}
+    if self.data is not None:
+      virhe['data'] = self.data
+    return virhe
+    # def virhe
+
+  # class EtakutsuVirhe
+
+
+# JSON-RPC 2.0 -määrittelyn mukaiset virhekoodit.
+JASENNYSVIRHE = -32700
+VIRHEELLINEN_KUTSU = -32600
+TUNTEMATON_METODI = -32601
+VIRHEELLISET_PARAMETRIT = -32602
+SISAINEN_VIRHE = -32603
+RUUHKA = -32000
+PERUTTU = -32800
+
+PERUUTUS = '$/cancelRequest'
+
+# Kutsun tunnuksen sallitut tyypit.
+_TUNNUS = (str, int, float, type(None))
+
+
+class Etakutsu:
+  '''
+  Etäkutsunäkymä: ohjaa JSON-RPC-kutsut rekisteröidyille metodeille.
+
+  Metodit rekisteröidään koristeella `@metodi` tai `@metodi(nimi=...)`;
+  nimet ja suoritettavat funktiot tallennetaan valmiiksi sanakirjaan
+  `metodit`, joten kutsun ohjaus on yksi haku. Synkroniset metodit
+  suoritetaan `sync_to_async`-kääreen kautta.
+
+  Sanomat koodataan `koodain`-parametrin (oletuksena projektiasetuksen
+  `PISTOKE_JSON_KOODAIN`) mukaisesti ja lähetetään tekstisanomina.
+
+  Yhteyttä kohti suoritetaan enintään `rinnakkain` kutsua kerrallaan;
+  muut odottavat vuoroaan. Mikäli keskeneräisiä (suoritettavia ja
+  odottavia) kutsuja on `kesken_enintaan`, uusi kutsu hylätään
+  virheellä -32000 (laskuri `etakutsu.hylatty`).
+  '''
+
+  rinnakkain: int = 8
+  kesken_enintaan: int = 100
+
+  def __init__(self, *, koodain=None, rinnakkain=None, kesken_enintaan=None):
+    self._koodain = koodain
+    if rinnakkain is not None:
+      self.rinnakkain = rinnakkain
+    if kesken_enintaan is not None:
+      self.kesken_enintaan = kesken_enintaan
+    self.metodit = {}
+    self._allekirjoitukset = {}
+    self._nakyma = WebsocketProtokolla(self._palvele)
+    # def __init__
+
+  @functools.cached_property
+  def koodain(self):
+    if self._koodain is not None:
+      return muodosta_koodain(self._koodain)
+    return json_koodain()
+    # def koodain
+
+  def metodi(self, f=None, *, nimi=None):
+    '''
+    Rekisteröi metodi funktion nimellä tai annetulla nimellä.
+
+    Metodi saa parametreinä pyynnön sekä kutsun parametrit
+    (`params`: lista tai sanakirja).
+    '''
+    if f is None:
+      return functools.partial(self.metodi, nimi=nimi)
+    nimi = nimi or f.__name__
+    self.metodit[nimi] = (
+      f if iscoroutinefunction(f)
+      else sync_to_async(f, thread_sensitive=True)
+    )
+    self._allekirjoitukset[nimi] = inspect.signature(f)
+    return f
+    # def metodi
+
+  async def __call__(self, request, *args, **kwargs):
+    return await self._nakyma(request, *args, **kwargs)
+
+  def _parametrivirhe(self, nimi, params):
+    ''' Onko `TypeError` seurausta kutsuun sopimattomista parametreistä? '''
+    try:
+      if isinstance(params, dict):
+        self._allekirjoitukset[nimi].bind(None, **params)
+      else:
+        self._allekirjoitukset[nimi].bind(None, *params)
+    except TypeError:
+      return True
+    return False
+    # def _parametrivirhe
+
+  async def _palvele(self, request, *args, **kwargs):
+    # pylint: disable=unused-argument, too-many-branches
+    # pylint: disable=too-many-statements
+    loads, dumps = self.koodain.loads, self.koodain.dumps
+    metodit = self.metodit
+    semafori = asyncio.Semaphore(self.rinnakkain)
+    kesken_enintaan = self.kesken_enintaan
+    kesken = {}
+    tehtavat = set()
+
+    async def vastaa(tunnus, **vastaus):
+      data = dumps({'jsonrpc': '2.0', 'id': tunnus, **vastaus})
+      await request.send(
+        data if isinstance(data, str) else str(data, 'utf-8')
+      )
+      # async def vastaa
+
+    async def suorita(tunnus, nimi, metodi, params):
+      try:
+        async with semafori:
+          if isinstance(params, dict):
+            tulos = await metodi(request, **params)
+          else:
+            tulos = await metodi(request, *params)
+      except EtakutsuVirhe as virhe:
+        vastaus = {'error': virhe.virhe()}
+      except TypeError:
+        if self._parametrivirhe(nimi, params):
+          vastaus = {'error': {
+            'code': VIRHEELLISET_PARAMETRIT,
+            'message': 'Virheelliset parametrit.',
+          }}
+        else:
+          loki.exception('Etäkutsu %r päättyi poikkeukseen.', nimi)
+          vastaus = {'error': {
+            'code': SISAINEN_VIRHE, 'message': 'Sisäinen virhe.',
+          }}
+      except Exception:  # pylint: disable=broad-except
+        loki.exception('Etäkutsu %r päättyi poikkeukseen.', nimi)
+        vastaus = {'error': {
+          'code': SISAINEN_VIRHE, 'message': 'Sisäinen virhe.',
+        }}
+      else:
+        vastaus = {'result': tulos}
+      finally:
+        tehtavat.discard(asyncio.current_task())
+        if tunnus is not None \
+        and kesken.get(tunnus) is asyncio.current_task():
+          del kesken[tunnus]
+      if tunnus is not None:
+        await vastaa(tunnus, **vastaus)
+      # async def suorita
+
+    try:
+      async for data in request:
+        try:
+          kutsu = loads(data)
+        except ValueError:
+          await vastaa(None, error={
+            'code': JASENNYSVIRHE, 'message': 'Jäsennysvirhe.',
+          })
+          continue
+        if not isinstance(kutsu, dict) \
+        or not isinstance(kutsu.get('method'), str) \
+        or not isinstance(kutsu.get('params', ()), (list, dict)) \
+        or not isinstance(kutsu.get('id'), _TUNNUS):
+          await vastaa(
+            kutsu.get('id') if isinstance(kutsu, dict) else None,
+            error={
+              'code': VIRHEELLINEN_KUTSU,
+              'message': 'Virheellinen kutsu.',
+            },
+          )
+          continue
+        nimi, tunnus = kutsu['method'], kutsu.get('id')
+        params = kutsu.get('params', ())
+
+        if nimi == PERUUTUS:
+          perutut = params.get('id') if isinstance(params, dict) else None
+          tehtava = (
+            kesken.pop(perutut, None)
+            if isinstance(perutut, _TUNNUS) else None
+          )
+          if tehtava is not None:
+            tehtavat.discard(tehtava)
+            tehtava.cancel()
+            mittarit.kasvata('etakutsu.peruttu')
+            await vastaa(perutut, error={
+              'code': PERUTTU, 'message': 'Kutsu peruttu.',
+            })
+          continue
+
+        metodi = metodit.get(nimi)
+        if metodi is None:
+          if tunnus is not None:
+            await vastaa(tunnus, error={
+              'code': TUNTEMATON_METODI,
+              'message': f'Tuntematon metodi: {nimi}',
+            })
+          continue
+        if tunnus is not None and tunnus in kesken:
+          await vastaa(tunnus, error={
+            'code': VIRHEELLINEN_KUTSU,
+            'message': 'Tunnus on jo käytössä.',
+          })
+          continue
+        if len(tehtavat) >= kesken_enintaan:
+          mittarit.kasvata('etakutsu.hylatty')
+          if tunnus is not None:
+            await vastaa(tunnus, error={
+              'code': RUUHKA,
+              'message': 'Liian monta keskeneräistä kutsua.',
+            })
+          continue
+
+        tehtava = asyncio.create_task(
+          suorita(tunnus, nimi, metodi, params)
+        )
+        tehtavat.add(tehtava)
+        if tunnus is not None:
+          kesken[tunnus] = tehtava
+        # async for data in request
+    finally:
+      # Yhteys päättyy: perutaan keskeneräiset kutsut.
+      for tehtava in tehtavat:
+        tehtava.cancel()
+      if tehtavat:
+        await asyncio.gather(*tehtavat, return_exceptions=True)
+      # finally
+    # async def _palvele
+
+  # class Etakutsu
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+'''
+Usean loogisen Websocket-virran kanavointi yhden yhteyden kautta.
+
+Asiakas avaa yhden Websocket-yhteyden kanavointinäkymään ja sen kautta
+virtoja olemassa oleviin Websocket-näkymiin. Kukin virta käsitellään
+omana `WebsocketPyynto`-pyyntönään, mutta ohjainketju (middleware),
+istunnon haku ja kättely tehdään vain kerran fyysistä yhteyttä kohti.
+Ohjainten `process_view`-vaihe ja näkymäkohtainen yhteysraja
+(`Yhteysraja`) sovelletaan kuitenkin kuhunkin virtaan erikseen.
+
+Sanomat:
+- tekstisanoma `<virta>:<data>` (esim. `3:{"viesti": "hei"}`);
+- binäärisanoma: virran numero (uint32, big-endian) + data;
+- ohjaussanomat virralla 0 (JSON):
+  - asiakas: `{"avaa": 1, "polku": "/keskustelu/?huone=a"}`,
+    `{"sulje": 1}`;
+  - palvelin: `{"avattu": 1}`, `{"suljettu": 1, "koodi": 1000}`,
+    `{"hylatty": 1, "koodi": 1008}` (virran numero on jo käytössä
+    tai se ei ole välillä 1..2**32-1).
+
+Virheellinen kehys (esim. tunnistamaton virran numero tai JSON)
+sulkee fyysisen yhteyden koodilla 1007, virheellinen ohjaussanoma
+koodilla 1008.
+
+Käyttöönotto:
+```python
+# urls.py
+from pistoke.kanavointi import Kanavointi
+urlpatterns = [path('kanavointi/', Kanavointi()), ...]
+```
+'''
+
+import asyncio
+import contextlib
+import inspect
+import json
+import logging
+import struct
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.urls import Resolver404
+
+from pistoke import mittarit
+from pistoke.kasittelija import nykyinen_kasittelija, ratkaise_reitti
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.pyynto import WebsocketPyynto
+
+
+loki = logging.getLogger('django.' + __name__)
+
+_VIRTA = struct.Struct('>I')
+_VIRTOJA_ENINTAAN = 1 << (8 * _VIRTA.size)
+
+# Fyysisen yhteyden protokollaan liittyvät pyynnön määreet, joita ei
+# kopioida virtakohtaisille pyynnöille.
+_YHTEYSKOHTAISET_MAAREET = frozenset((
+  'scope', 'receive', 'send', 'path', 'path_info', 'script_name',
+  'META', 'GET', 'resolver_match', 'protokolla', 'mittarit',
+  'receive_nowait', 'receive_many', 'send_raw',
+  '_kanava', '_vastaanotto', '_katkaisukoodi',
+  '_katkaistu_vastapaasta', '_katkaistu_tasta_paasta',
+))
+
+
+class _Virta:
+  ''' Yksittäisen loogisen virran ASGI-kanava. '''
+
+  __slots__ = ('tunnus', 'syote', 'laheta', 'tehtava', 'suljettu')
+
+  def __init__(self, tunnus, laheta):
+    self.tunnus = tunnus
+    self.syote = asyncio.Queue()
+    self.syote.put_nowait({'type': 'websocket.connect'})
+    self.laheta = laheta
+    self.tehtava = None
+    self.suljettu = False
+    # def __init__
+
+  async def receive(self):
+    return await self.syote.get()
+
+  async def send(self, sanoma):
+    tyyppi = sanoma['type']
+    if tyyppi == 'websocket.send':
+      if sanoma.get('text') is not None:
+        return await self.laheta(f'{self.tunnus}:{sanoma["text"]}')
+      return await self.laheta(
+        _VIRTA.pack(self.tunnus) + bytes(sanoma['bytes'])
+      )
+    elif tyyppi == 'websocket.accept':
+      return await self.laheta(f'0:{json.dumps({"avattu": self.tunnus})}')
+    elif tyyppi == 'websocket.close':
+      await self.sulje(sanoma.get('code', 1000))
+    else:
+      raise TypeError(repr(sanoma))
+    # async def send
+
+  async def sulje(self, koodi):
+    ''' Ilmoita asiakkaalle virran sulkemisesta ja päätä virta. '''
+    if self.suljettu:
+      return
+    self.suljettu = True
+    self.syote.put_nowait({'type': 'websocket.disconnect', 'code': koodi})
+    await self.laheta(
+      f'0:{json.dumps({"suljettu": self.tunnus, "koodi": koodi})}'
+    )
+    # async def sulje
+
+  async def hylkaa(self):
+    ''' Hylkää lukematon syöte ja sulje virta koodilla 1008. '''
+    syote = self.syote
+    while not syote.empty():
+      syote.get_nowait()
+    await self.sulje(1008)
+    # async def hylkaa
+
+  # class _Virta
+
+
+class _Kehysvirhe(Exception):
+  ''' Virheellinen saapuva kehys; yhteys suljetaan annetulla koodilla. '''
+
+  def __init__(self, koodi):
+    super().__init__(koodi)
+    self.koodi = koodi
+    # def __init__
+
+  # class _Kehysvirhe
+
+
+def _ohjaus(data):
+  '''
+  Tulkitse virran 0 ohjaussanoma.
+
+  Palauttaa parin (`'avaa'`, (virta, polku)), (`'sulje'`, virta)
+  tai `None` tuntemattomalle ohjaukselle.
+  '''
+  try:
+    ohjaus = json.loads(data)
+  except ValueError:
+    raise _Kehysvirhe(1007) from None
+  if not isinstance(ohjaus, dict):
+    raise _Kehysvirhe(1008)
+  try:
+    if 'avaa' in ohjaus:
+      polku = ohjaus['polku']
+      if not isinstance(polku, str):
+        raise TypeError(polku)
+      return 'avaa', (int(ohjaus['avaa']), polku)
+    elif 'sulje' in ohjaus:
+      return 'sulje', int(ohjaus['sulje'])
+  except (KeyError, TypeError, ValueError):
+    raise _Kehysvirhe(1008) from None
+  return None
+  # def _ohjaus
+
+
+def _tulkitse(data):
+  '''
+  Tulkitse saapuva kehys.
+
+  Palauttaa virran numeron sekä ASGI-sanoman (virralla 0 tulkitun
+  ohjaussanoman). Virheellinen kehys nostaa `_Kehysvirhe`-poikkeuksen.
+  '''
+  if isinstance(data, str):
+    tunnus, __, data = data.partition(':')
+    try:
+      tunnus = int(tunnus)
+    except ValueError:
+      raise _Kehysvirhe(1007) from None
+    if tunnus == 0:
+      return 0, _ohjaus(data)
+    return tunnus, {'type': 'websocket.receive', 'text': data}
+  if len(data) < _VIRTA.size:
+    raise _Kehysvirhe(1007)
+  tunnus, = _VIRTA.unpack_from(data)
+  if tunnus == 0:
+    # Ohjaussanomat ovat aina tekstimuotoisia.
+    raise _Kehysvirhe(1008)
+  return tunnus, {'type': 'websocket.receive', 'bytes': data[_VIRTA.size:]}
+  # def _tulkitse
+
+
+def _virtapyynto(request, polku, virta):
+  '''
+  Muodosta virtakohtainen pyyntö fyysisen yhteyden pyynnön pohjalta.
+
+  Ohjainketjun asettamat määreet (esim. `user`, `session`) ja
+  `META`-tiedot kopioidaan; polku ja kyselyparametrit vaihdetaan.
+  '''
+  polku, __, kysely = polku.partition('?')
+  lapsi = WebsocketPyynto(
+    {
+      **request.scope,
+      'path': request.script_name + polku,
+      'query_string': kysely.encode(),
+      'subprotocols': [],
+    },
+    virta.receive,
+    virta.send,
+  )
+  lapsi.META = {**request.META, **lapsi.META}
+  for avain, arvo in vars(request).items():
+    if avain not in _YHTEYSKOHTAISET_MAAREET:
+      vars(lapsi).setdefault(avain, arvo)
+  return lapsi
+  # def _virtapyynto
+
+
+async def _suorita(callback, request, args, kwargs):
+  '''
+  Suorita virran näkymä (vrt. `WebsocketKasittelija._get_response_async`).
+
+  Palauttaa `False`, mikäli näkymä ei tuottanut alirutiinia.
+  '''
+  if iscoroutinefunction(callback) \
+  or iscoroutinefunction(getattr(callback, '__call__', callback)):
+    await callback(request, *args, **kwargs)
+    return True
+  nakyma = await sync_to_async(callback, thread_sensitive=True)(
+    request, *args, **kwargs
+  )
+  if asyncio.iscoroutine(nakyma):
+    await nakyma
+    return True
+  return False
+  # async def _suorita
+
+
+class Kanavointi:
+  '''
+  Kanavointinäkymä: välitä loogiset virrat URL-taulun mukaisille
+  Websocket-näkymille.
+
+  Samanaikaisten virtojen enimmäismäärä annetaan parametrinä
+  `virtoja_enintaan`; tämän ylittävä avauspyyntö hylätään
+  (koodi 1013).
+
+  Kunkin virran lukemattomien sanomien enimmäismäärä annetaan
+  parametrinä `virran_syote_enintaan`; tämän ylittävä virta
+  suljetaan (koodi 1008) ja sen lukematon syöte hylätään.
+  '''
+
+  virtoja_enintaan: int = 32
+
+  virran_syote_enintaan: int = 100
+
+  # Aika (s), jonka päättyvät virrat saavat sulkeutua yhteyden
+  # katketessa.
+  sulkemisen_aikakatkaisu: float = 1.0
+
+  def __init__(self, *, virtoja_enintaan=None, virran_syote_enintaan=None):
+    if virtoja_enintaan is not None:
+      self.virtoja_enintaan = virtoja_enintaan
+    if virran_syote_enintaan is not None:
+      self.virran_syote_enintaan = virran_syote_enintaan
+    self._nakyma = WebsocketProtokolla(self._kanavoi)
+    # def __init__
+
+  async def __call__(self, request, *args, **kwargs):
+    return await self._nakyma(request, *args, **kwargs)
+
+  async def _avaa(self, request, virrat, tunnus, polku):
+    laheta = request.send
+    if not 0 < tunnus < _VIRTOJA_ENINTAAN or tunnus in virrat:
+      # Virran numero on virheellinen tai jo käytössä: hylätään
+      # avauspyyntö ilmoittamatta olemassa olevan virran sulkeutuneen.
+      return await laheta(
+        f'0:{json.dumps({"hylatty": tunnus, "koodi": 1008})}'
+      )
+    virta = _Virta(tunnus, laheta)
+    if len(virrat) >= self.virtoja_enintaan:
+      await virta.sulje(1013)
+      return
+    try:
+      lapsi = _virtapyynto(request, polku, virta)
+      match = ratkaise_reitti(
+        getattr(request, 'urlconf', settings.ROOT_URLCONF),
+        lapsi.path_info,
+      )
+    except Resolver404:
+      await virta.sulje(1008)
+      return
+    if isinstance(inspect.unwrap(
+      match.func, stop=lambda f: isinstance(f, Kanavointi)
+    ), Kanavointi):
+      # Sisäkkäinen kanavointi ohittaisi virtojen enimmäismäärän.
+      await virta.sulje(1008)
+      return
+    lapsi.resolver_match = match
+    kasittelija = nykyinen_kasittelija.get()
+    if kasittelija is not None:
+      # Ajetaan ohjainten `process_view`-vaihe (esim. Origin- ja
+      # CSRF-tarkistus) kuten fyysisen yhteyden näkymälle.
+      vastaus = await kasittelija.nakymaohjaimet(
+        lapsi, match.func, match.args, match.kwargs
+      )
+      if vastaus is not None:
+        loki.debug(
+          'Ohjainketju palautti virralle %d HTTP-vastauksen %r.',
+          tunnus, vastaus,
+        )
+        await virta.sulje(1008)
+        return
+      varaus = kasittelija.varaa_nakyma(match.func)
+    else:
+      varaus = contextlib.nullcontext(True)
+
+    async def _aja():
+      try:
+        with varaus as varattu:
+          if not varattu:
+            # Näkymäkohtainen yhteysraja on täynnä.
+            await virta.sulje(1013)
+          elif not await _suorita(
+            match.func, lapsi, match.args, match.kwargs
+          ):
+            await virta.sulje(1008)
+      except asyncio.CancelledError:
+        raise
+      except WebsocketProtokolla.SyotettaEiLuettu:
+        pass
+      except Exception:  # pylint: disable=broad-except
+        loki.exception('Virran %d näkymä päättyi poikkeukseen.', tunnus)
+        await virta.sulje(1011)
+      else:
+        # Näkymä päättyi sulkematta virtaa.
+        await virta.sulje(1000)
+      finally:
+        virrat.pop(tunnus, None)
+      # async def _aja
+    virrat[tunnus] = virta
+    virta.tehtava = asyncio.create_task(_aja())
+    # async def _avaa
+
+  async def _kanavoi(self, request, *args, **kwargs):
+    # pylint: disable=unused-argument
+    virrat = {}
+    try:
+      async for data in request:
+        try:
+          tunnus, sanoma = _tulkitse(data)
+        except _Kehysvirhe as virhe:
+          # Suljetaan fyysinen yhteys virheellisen kehyksen vuoksi.
+          # pylint: disable=protected-access
+          request._katkaisukoodi = virhe.koodi
+          break
+        if tunnus == 0:
+          if sanoma is None:
+            continue
+          ohjaus, parametrit = sanoma
+          if ohjaus == 'avaa':
+            await self._avaa(request, virrat, *parametrit)
+          else:
+            virta = virrat.get(parametrit)
+            if virta is not None:
+              virta.suljettu = True
+              virta.syote.put_nowait(
+                {'type': 'websocket.disconnect', 'code': 1000}
+              )
+          continue
+        virta = virrat.get(tunnus)
+        if virta is None or virta.suljettu:
+          continue
+        if virta.syote.qsize() >= self.virran_syote_enintaan:
+          # Virran näkymä ei ehdi lukea syötettään: hylätään syöte
+          # ja suljetaan virta.
+          mittarit.kasvata('kanavointi.ylivuoto')
+          await virta.hylkaa()
+          continue
+        virta.syote.put_nowait(sanoma)
+        # async for data in request
+    finally:
+      # Fyysinen yhteys päättyy: katkaistaan kaikki virrat.
+      tehtavat = []
+      for virta in list(virrat.values()):
+        virta.suljettu = True
+        virta.syote.put_nowait(
+          {'type': 'websocket.disconnect', 'code': 1001}
+        )
+        tehtavat.append(virta.tehtava)
+      if tehtavat:
+        __, kesken = await asyncio.wait(
+          tehtavat, timeout=self.sulkemisen_aikakatkaisu
+        )
+        for tehtava in kesken:
+          tehtava.cancel()
+      # finally
+    # async def _kanavoi
+
+  # class Kanavointi
@@ -1,36 +1,198 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
-from contextlib import asynccontextmanager
+import collections
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+import functools
 import logging
+import random
 
 from asgiref.sync import sync_to_async, iscoroutinefunction
 
 import django
 from django.conf import settings
+from django.core.cache import close_caches
 from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import reset_urlconf
 from django.core import signals
+from django.db import close_old_connections, connections, reset_queries
+from django.dispatch import receiver
 from django.test.utils import override_settings
-from django.urls import set_script_prefix, set_urlconf
+from django.urls import (
+  get_resolver, set_script_prefix, set_urlconf, Resolver404,
+)
 
+from pistoke import mittarit
 from pistoke.protokolla import _WebsocketProtokolla
 from pistoke.pyynto import WebsocketPyynto
 
 
 loki = logging.getLogger('django.' + __name__)
 
+# Yhteyttä käsittelevä `WebsocketKasittelija` (ks. `pistoke.kanavointi`).
+nykyinen_kasittelija = contextvars.ContextVar(
+  'nykyinen_kasittelija', default=None
+)
+
 
 class WebsocketVirhe(RuntimeError):
   ''' Virheellinen konteksti Websocket-pyynnön käsittelyssä (WSGI). '''
 
 
+# Djangon omat ylläpitorutiinit, jotka koskevat vain kutsuvaa kontekstia
+# eivätkä tee estäviä kutsuja; nämä suoritetaan suoraan
+# tapahtumasilmukassa ilman säikeenvaihtoa.
+SUORAAN_AJETTAVAT_VASTAANOTTAJAT = (
+  close_caches,
+  reset_urlconf,
+)
+
+# Djangon omat, pääsäikeen tietokantayhteyksiä koskevat ylläpitorutiinit,
+# jotka voidaan suorittaa kerran kaikkien samanaikaisesti odottavien
+# pyyntöjen puolesta.
+KOOTTAVAT_VASTAANOTTAJAT = (
+  close_old_connections,
+  reset_queries,
+)
+
+# Kesken olevat, kootut säikeenvaihdot: vastaanottajat -> Future.
+_kootut_kutsut = {}
+
+
+async def _kokoa(vastaanottajat, signaali, **kwargs):
+  '''
+  Suorita annetut, koottavat vastaanottajat pääsäikeessä.
+
+  Mikäli samojen vastaanottajien suoritus on jo jonossa tai käynnissä
+  samassa tapahtumasilmukassa, odotetaan sen valmistumista uuden
+  säikeenvaihdon sijaan.
+  '''
+  kesken = _kootut_kutsut.get(vastaanottajat)
+  if kesken is None \
+  or kesken.done() \
+  or kesken.get_loop() is not asyncio.get_running_loop():
+    @sync_to_async(thread_sensitive=True)
+    def _suorita():
+      for vastaanottaja in vastaanottajat:
+        vastaanottaja(signal=signaali, **kwargs)
+    kesken = _kootut_kutsut[vastaanottajat] = asyncio.ensure_future(
+      _suorita()
+    )
+  await asyncio.shield(kesken)
+  # async def _kokoa
+
+
+async def _laheta_signaali(signaali, sender, **kwargs):
+  '''
+  Lähetä Django-signaali asynkronisesti, vrt. `Signal.asend` (Django 5.0+).
+
+  Asynkroniset ja erikseen luetellut synkroniset vastaanottajat
+  suoritetaan suoraan tapahtumasilmukassa. Koottavat vastaanottajat
+  suoritetaan `_kokoa`-funktion avulla ja muut synkroniset vastaanottajat
+  yhdellä säikeenvaihdolla pääsäikeessä.
+  '''
+  # pylint: disable=protected-access
+  if not signaali.receivers:
+    return
+  vastaanottajat = signaali._live_receivers(sender)
+  if django.VERSION >= (5, 0):
+    synkroniset, asynkroniset = vastaanottajat
+  else:
+    # Django <5 palauttaa yhden listan: erotellaan asynkroniset
+    # vastaanottajat, joita ei voi kutsua säikeessä.
+    synkroniset, asynkroniset = [], []
+    for vastaanottaja in vastaanottajat:
+      (
+        asynkroniset if asyncio.iscoroutinefunction(vastaanottaja)
+        else synkroniset
+      ).append(vastaanottaja)
+
+  koottavat = []
+  muut = []
+  for vastaanottaja in synkroniset:
+    if vastaanottaja in SUORAAN_AJETTAVAT_VASTAANOTTAJAT:
+      vastaanottaja(signal=signaali, sender=sender, **kwargs)
+    elif vastaanottaja in KOOTTAVAT_VASTAANOTTAJAT:
+      koottavat.append(vastaanottaja)
+    else:
+      muut.append(vastaanottaja)
+
+  async def _synkroniset():
+    await sync_to_async(
+      lambda: [
+        vastaanottaja(signal=signaali, sender=sender, **kwargs)
+        for vastaanottaja in muut
+      ],
+      thread_sensitive=True
+    )()
+
+  await asyncio.gather(
+    *(
+      (_kokoa(tuple(koottavat), signaali, sender=sender), )
+      if koottavat else ()
+    ),
+    *((_synkroniset(), ) if muut else ()),
+    *(
+      vastaanottaja(signal=signaali, sender=sender, **kwargs)
+      for vastaanottaja in asynkroniset
+    ),
+  )
+  # async def _laheta_signaali
+
+
+# Reitityksen välimuistiin tallennettavien polkujen enimmäismäärä.
+REITTIVALIMUISTIN_KOKO = 1024
+
+
+@functools.lru_cache(maxsize=REITTIVALIMUISTIN_KOKO)
+def ratkaise_reitti(urlconf, path_info):
+  '''
+  Ratkaise ja tallenna välimuistiin annettua polkua vastaava näkymä
+  (`ResolverMatch`) annetussa URL-taulussa.
+
+  Välimuisti tyhjennetään automaattisesti `ROOT_URLCONF`-asetuksen
+  muuttuessa; muulloin (esim. URL-taulun uudelleenlatauksen jälkeen)
+  kutsumalla `ratkaise_reitti.cache_clear()`.
+  Osumat ja ohitukset: `ratkaise_reitti.cache_info()`.
+
+  Huomaa, että samaa `ResolverMatch`-oliota käytetään kaikilla
+  saman polun pyynnöillä.
+  '''
+  return get_resolver(urlconf).resolve(path_info)
+  # def ratkaise_reitti
+
+
+@receiver(signals.setting_changed)
+def _tyhjenna_reittivalimuisti(*, setting, **kwargs):
+  # pylint: disable=unused-argument
+  if setting == 'ROOT_URLCONF':
+    ratkaise_reitti.cache_clear()
+  # def _tyhjenna_reittivalimuisti
+
+
 class WebsocketKasittelija(ASGIHandler):
   '''
   Saapuvien Websocket-pyyntöjen (istuntojen) käsittelyrutiini.
+
+  Samanaikaisten yhteyksien enimmäismäärä voidaan rajata
+  käsittelijäkohtaisesti (`yhteyksia_enintaan` tai projektiasetus
+  `PISTOKE_YHTEYKSIA_ENINTAAN`) ja näkymäkohtaisesti
+  (`pistoke.tyokalut.Yhteysraja`).
+
+  ASGI-elinkaaren (`elinkaari`) alkaessa käsittelijä esilämmitetään
+  (`lammita`); sen päättyessä avoimet yhteydet suljetaan hallitusti
+  (`tyhjenna`).
   '''
 
   nosta_syotetta_ei_luettu: bool = False
 
+  yhteyksia_enintaan: int = None
+
+  # Hallitun sulkemisen oletusarvot (sekuntia).
+  tyhjennyksen_aikakatkaisu: float = 10.0
+  tyhjennyksen_hajonta: float = 5.0
+
   def __new__(cls, *args, **kwargs):
     '''
     Alusta Django ennen käsittelyrutiinin luontia.
@@ -41,23 +203,206 @@ class WebsocketKasittelija(ASGIHandler):
     return super().__new__(cls)
     # def __new__
 
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.yhteyksia_enintaan = getattr(
+      settings, 'PISTOKE_YHTEYKSIA_ENINTAAN', self.yhteyksia_enintaan
+    )
+    self.yhteyksia = 0
+    self._nakymakohtaiset_yhteydet = collections.Counter()
+    self._istunnot = {}
+    # def __init__
+
+  @staticmethod
+  def _yhteysraja(callback):
+    '''
+    Poimi näkymän mahdollinen yhteysraja
+    (ks. `pistoke.tyokalut.Yhteysraja`).
+    '''
+    raja = getattr(callback, 'yhteysraja', None)
+    if raja is None:
+      # Luokkapohjaisen näkymän `websocket`-metodi.
+      raja = getattr(getattr(
+        getattr(callback, 'view_class', None), 'websocket', None
+      ), 'yhteysraja', None)
+    return raja
+    # def _yhteysraja
+
+  @contextmanager
+  def varaa_nakyma(self, callback):
+    '''
+    Varaa paikka näkymäkohtaisen yhteysrajan puitteissa.
+
+    Tuottaa arvon `False`, mikäli näkymän enimmäismäärä on täynnä.
+    Käytetään myös kanavoitujen virtojen osalta (`pistoke.kanavointi`).
+    '''
+    raja = self._yhteysraja(callback) if callback is not None else None
+    if raja is None:
+      yield True
+      return
+    if self._nakymakohtaiset_yhteydet[callback] >= raja:
+      yield False
+      return
+    self._nakymakohtaiset_yhteydet[callback] += 1
+    try:
+      yield True
+    finally:
+      self._nakymakohtaiset_yhteydet[callback] -= 1
+      if not self._nakymakohtaiset_yhteydet[callback]:
+        del self._nakymakohtaiset_yhteydet[callback]
+    # def varaa_nakyma
+
+  @contextmanager
+  def _varaa_yhteys(self, request):
+    '''
+    Varaa paikka uudelle yhteydelle ennen ohjainketjun ajoa.
+
+    Tuottaa arvon `False`, mikäli käsittelijä- tai näkymäkohtainen
+    enimmäismäärä on täynnä.
+    '''
+    if self.yhteyksia_enintaan is not None \
+    and self.yhteyksia >= self.yhteyksia_enintaan:
+      mittarit.kasvata('yhteys.hylatty')
+      yield False
+      return
+    try:
+      callback = ratkaise_reitti(
+        settings.ROOT_URLCONF, request.path_info
+      ).func
+    except Resolver404:
+      callback = None
+    with self.varaa_nakyma(callback) as varattu:
+      if not varattu:
+        mittarit.kasvata('yhteys.hylatty')
+        yield False
+        return
+      mittarit.kasvata('yhteys.hyvaksytty')
+      self.yhteyksia += 1
+      tehtava = asyncio.current_task()
+      self._istunnot[tehtava] = request
+      try:
+        yield True
+      finally:
+        self._istunnot.pop(tehtava, None)
+        self.yhteyksia -= 1
+    # def _varaa_yhteys
+
+  async def tyhjenna(self, aikakatkaisu=None, hajonta=None):
+    '''
+    Sulje kaikki avoimet yhteydet hallitusti (Websocket-koodi 1001).
+
+    Kunkin yhteyden sulkeminen aloitetaan satunnaisen, enintään
+    `hajonta` sekuntia kestävän viiveen jälkeen, jotta asiakkaat eivät
+    yhdistä uudelleen samanaikaisesti. Mikäli yhteys ei ole päättynyt
+    `aikakatkaisu` sekunnin kuluessa tyhjennyksen alusta,
+    se keskeytetään.
+    '''
+    if aikakatkaisu is None:
+      aikakatkaisu = self.tyhjennyksen_aikakatkaisu
+    if hajonta is None:
+      hajonta = self.tyhjennyksen_hajonta
+    istunnot = list(self._istunnot.items())
+    if not istunnot:
+      return
+
+    async def _sulje(tehtava, request):
+      # pylint: disable=protected-access
+      await asyncio.sleep(random.uniform(0, hajonta))
+      request._katkaisukoodi = 1001
+      tehtava.cancel()
+      # async def _sulje
+
+    sulkijat = [
+      asyncio.ensure_future(_sulje(tehtava, request))
+      for tehtava, request in istunnot
+    ]
+    try:
+      __, kesken = await asyncio.wait(
+        [tehtava for tehtava, __ in istunnot],
+        timeout=aikakatkaisu,
+      )
+      for tehtava in kesken:
+        tehtava.cancel()
+    finally:
+      for sulkija in sulkijat:
+        sulkija.cancel()
+    # async def tyhjenna
+
+  @staticmethod
+  def _avaa_tietokantayhteydet():
+    ''' Avaa tietokantayhteydet kutsuvassa säikeessä. '''
+    for yhteys in connections.all():
+      if yhteys.settings_dict['ENGINE'] == 'django.db.backends.dummy':
+        continue
+      try:
+        yhteys.ensure_connection()
+      except Exception:  # pylint: disable=broad-except
+        loki.warning(
+          'Tietokantayhteyden %r avaus epäonnistui.',
+          yhteys.alias,
+          exc_info=True,
+        )
+      # for yhteys in connections.all
+    # def _avaa_tietokantayhteydet
+
+  async def lammita(self):
+    '''
+    Esilämmitä käsittelijä ennen ensimmäistä yhteyttä.
+
+    - Tuo URL-taulun näkymät ja muodosta reititystaulut.
+    - Avaa tietokantayhteydet pääsäikeessä; tämä on hyödyllistä silloin,
+      kun yhteydet ovat pysyviä (`CONN_MAX_AGE`).
+
+    Aliluokka voi laajentaa tätä metodia omilla toimillaan.
+    '''
+    # pylint: disable=protected-access
+    get_resolver(settings.ROOT_URLCONF)._populate()
+    await sync_to_async(
+      self._avaa_tietokantayhteydet,
+      thread_sensitive=True
+    )()
+    # async def lammita
+
+  async def elinkaari(self, scope, receive, send):
+    '''
+    ASGI-elinkaaren (lifespan) käsittely.
+
+    Esilämmittää käsittelijän palvelimen käynnistyessä ja sulkee
+    avoimet yhteydet hallitusti palvelimen sammuessa.
+    '''
+    assert scope['type'] == 'lifespan'
+    while True:
+      sanoma = await receive()
+      if sanoma['type'] == 'lifespan.startup':
+        try:
+          await self.lammita()
+        except Exception as exc:  # pylint: disable=broad-except
+          loki.exception('Websocket-käsittelijän esilämmitys epäonnistui.')
+          await send({
+            'type': 'lifespan.startup.failed',
+            'message': str(exc),
+          })
+          return
+        await send({'type': 'lifespan.startup.complete'})
+      elif sanoma['type'] == 'lifespan.shutdown':
+        await self.tyhjenna()
+        await send({'type': 'lifespan.shutdown.complete'})
+        return
+    # async def elinkaari
+
   @asynccontextmanager
   async def _django_pyynto(self, scope):
     # Tehdään Django-rutiinitoimet per saapuva pyyntö.
-    await sync_to_async(
-      signals.request_started.send,
-      thread_sensitive=True
-    )(
+    await _laheta_signaali(
+      signals.request_started,
       sender=self.__class__, scope=scope
     )
     try:
       yield
     finally:
       try:
-        await asyncio.shield(sync_to_async(
-          signals.request_finished.send,
-          thread_sensitive=True
-        )(
+        await asyncio.shield(_laheta_signaali(
+          signals.request_finished,
           sender=self.__class__
         ))
       except asyncio.CancelledError:
@@ -78,29 +423,40 @@ class WebsocketKasittelija(ASGIHandler):
       from django.core.handlers.asgi import get_script_prefix
       set_script_prefix(get_script_prefix(scope))
 
-    # Tehdään Django-rutiinitoimet per saapuva pyyntö.
-    async with self._django_pyynto(scope):
-      # Muodostetaan WS-pyyntöolio.
-      request = WebsocketPyynto(scope, receive, send)
-
-      # Hae käsittelevä näkymärutiini tai mahdollinen virheviesti.
-      # Tämä kutsuu mahdollisten avaavien välikkeiden (middleware) ketjua
-      # ja lopuksi alla määriteltyä `_get_response_async`-metodia.
-      # Metodi suorittaa ensin Websocket-kättelyn loppuun ja sen jälkeen
-      # URL-taulun mukaisen näkymäfunktion (async def websocket(...): ...).
-      nakyma = await self.get_response_async(request)
-
-      if asyncio.iscoroutine(nakyma):
-        await nakyma
+    # Muodostetaan WS-pyyntöolio.
+    request = WebsocketPyynto(scope, receive, send)
+    nykyinen_kasittelija.set(self)
 
-      else:
-        # Ota yhteyspyyntö vastaan ja evää se.
-        # Tällöin asiakaspäähän palautuu HTTP 403 Forbidden.
+    with self._varaa_yhteys(request) as hyvaksytty:
+      if not hyvaksytty:
+        # Evätään yhteyspyyntö ennen ohjainketjua.
         avaus = await request.receive()
         assert avaus.get('type') == 'websocket.connect'
         await request.send({'type': 'websocket.close'})
-        # if not asyncio.iscoroutine
-      # async with self._django_pyynto
+        return
+
+      # Tehdään Django-rutiinitoimet per saapuva pyyntö.
+      async with self._django_pyynto(scope):
+        # Hae käsittelevä näkymärutiini tai mahdollinen virheviesti.
+        # Tämä kutsuu mahdollisten avaavien välikkeiden (middleware)
+        # ketjua ja lopuksi alla määriteltyä `_get_response_async`-metodia.
+        # Metodi suorittaa ensin Websocket-kättelyn loppuun ja sen jälkeen
+        # URL-taulun mukaisen näkymäfunktion
+        # (async def websocket(...): ...).
+        nakyma = await self.get_response_async(request)
+
+        if asyncio.iscoroutine(nakyma):
+          await nakyma
+
+        else:
+          # Ota yhteyspyyntö vastaan ja evää se.
+          # Tällöin asiakaspäähän palautuu HTTP 403 Forbidden.
+          avaus = await request.receive()
+          assert avaus.get('type') == 'websocket.connect'
+          await request.send({'type': 'websocket.close'})
+          # if not asyncio.iscoroutine
+        # async with self._django_pyynto
+      # with self._varaa_yhteys
     # async def __call__
 
   def load_middleware(self, is_async=False):
@@ -125,6 +481,39 @@ class WebsocketKasittelija(ASGIHandler):
     return await self._middleware_chain(request)
     # async def get_response_async
 
+  def resolve_request(self, request):
+    '''
+    Ratkaistaan näkymä polun mukaan välimuistia käyttäen.
+
+    Vrt. django.core.handlers.base:BaseHandler.resolve_request.
+    '''
+    if hasattr(request, 'urlconf'):
+      urlconf = request.urlconf
+      set_urlconf(urlconf)
+    else:
+      urlconf = settings.ROOT_URLCONF
+    resolver_match = ratkaise_reitti(urlconf, request.path_info)
+    request.resolver_match = resolver_match
+    return resolver_match
+    # def resolve_request
+
+  async def nakymaohjaimet(
+    self, request, callback, callback_args, callback_kwargs
+  ):
+    '''
+    Aja ohjainten `process_view`-vaihe; palauta ensimmäinen
+    ohjaimen palauttama HTTP-vastaus tai `None`.
+    '''
+    for middleware_method in self._view_middleware:
+      vastaus = await middleware_method(
+        request, callback, callback_args, callback_kwargs
+      )
+      if vastaus is not None:
+        return vastaus
+      # for middleware_method in self._view_middleware
+    return None
+    # async def nakymaohjaimet
+
   async def _get_response_async(self, request):
     ''' Ohitetaan paluusanoman käsittelyyn liittyvät funktiokutsut. '''
     # pylint: disable=not-callable, protected-access
@@ -133,17 +522,15 @@ class WebsocketKasittelija(ASGIHandler):
     async def evatty(*args, **kwargs): pass
 
     callback, callback_args, callback_kwargs = self.resolve_request(request)
-    for middleware_method in self._view_middleware:
-      vastaus = await middleware_method(
-        request, callback, callback_args, callback_kwargs
+    vastaus = await self.nakymaohjaimet(
+      request, callback, callback_args, callback_kwargs
+    )
+    if vastaus is not None:
+      loki.debug(
+        'Ohjainketju palautti HTTP-vastauksen %r.',
+        vastaus,
       )
-      if vastaus is not None:
-        loki.debug(
-          'Ohjainketju palautti HTTP-vastauksen %r.',
-          vastaus,
-        )
-        return evatty
-      # for middleware_method in self._view_middleware
+      return evatty
 
     # Mikäli `callback` on asynkroninen funktio (tai kääre),
     # palautetaan sen tuottama alirutiini.
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+'''
+Websocket-sanomien koodaimet.
+
+Koodain muuntaa näkymän lähettämän Python-olion Websocket-sanomaksi
+(`dumps`) ja saapuvan sanoman takaisin Python-olioksi (`loads`).
+`dumps` voi palauttaa joko merkkijonon tai tavujonon.
+
+Koodain valitaan näkymäkohtaisesti (esim. `JsonLiikenne(koodain=...)`)
+tai projektiasetuksella `PISTOKE_JSON_KOODAIN`, joka on joko
+koodainolio tai -luokka taikka polku (merkkijono) jompaankumpaan.
+
+Koodaimet rekisteröidään nimellä sanakirjaan `koodaimet`
+(`@rekisteroi('nimi')`); nimen perusteella koodain voidaan valita
+esim. neuvotellun aliprotokollan mukaan (ks. `BinaariLiikenne`).
+'''
+
+import json
+import struct
+import sys
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class Koodain:
+  ''' Sanomien koodauksen ja purun rajapinta. '''
+
+  def loads(self, data):
+    ''' Pura saapuva sanoma (str tai bytes) Python-olioksi. '''
+    raise NotImplementedError
+
+  def dumps(self, olio):
+    ''' Koodaa Python-olio lähteväksi sanomaksi (str tai bytes). '''
+    raise NotImplementedError
+
+  # class Koodain
+
+
+koodaimet = {}
+_koodainoliot = {}
+
+
+def rekisteroi(nimi):
+  ''' Rekisteröi koodainluokka annetulla nimellä. '''
+  def _rekisteroi(luokka):
+    koodaimet[nimi] = luokka
+    return luokka
+  return _rekisteroi
+  # def rekisteroi
+
+
+def nimetty_koodain(nimi):
+  '''
+  Palauta nimellä rekisteröity koodain.
+
+  Koodainolio muodostetaan luokkaa kohti ensimmäisellä kutsulla ja
+  jaetaan myöhempien kutsujen kesken. Tuntematon nimi aiheuttaa
+  poikkeuksen `LookupError`.
+  '''
+  try:
+    luokka = koodaimet[nimi]
+  except KeyError:
+    raise LookupError(f'Tuntematon koodain: {nimi!r}') from None
+  try:
+    return _koodainoliot[luokka]
+  except KeyError:
+    koodain = _koodainoliot[luokka] = luokka()
+    return koodain
+  # def nimetty_koodain
+
+
+@rekisteroi('json')
+class JsonKoodain(Koodain):
+  '''
+  Python-vakiokirjaston `json`-moduuliin perustuva koodain.
+
+  Parametrit `loads` ja `dumps` annetaan sellaisenaan (**kwargs)
+  funktioille `json.loads` ja `json.dumps`.
+  '''
+
+  def __init__(self, *, loads=None, dumps=None):
+    super().__init__()
+    self._loads = loads or {}
+    self._dumps = dumps or {}
+    # def __init__
+
+  def loads(self, data):
+    return json.loads(data, **self._loads)
+
+  def dumps(self, olio):
+    return json.dumps(olio, **self._dumps)
+
+  # class JsonKoodain
+
+
+class OrjsonKoodain(Koodain):
+  '''
+  `orjson`-kirjastoon perustuva koodain.
+
+  `dumps` palauttaa tavujonon. Parametri `option` annetaan sellaisenaan
+  funktiolle `orjson.dumps`.
+
+  Vaatii paketin `orjson` (`pip install django-pistoke[orjson]`).
+  '''
+
+  def __init__(self, *, option=None, default=None):
+    super().__init__()
+    # pylint: disable=import-outside-toplevel
+    import orjson
+    self._orjson = orjson
+    self._option = option
+    self._default = default
+    # def __init__
+
+  def loads(self, data):
+    return self._orjson.loads(data)
+
+  def dumps(self, olio):
+    return self._orjson.dumps(
+      olio, default=self._default, option=self._option
+    )
+
+  # class OrjsonKoodain
+
+
+@rekisteroi('msgpack')
+class MsgpackKoodain(Koodain):
+  '''
+  MessagePack-koodain (`msgpack`-kirjasto).
+
+  `dumps` palauttaa tavujonon. Parametrit `loads` ja `dumps` annetaan
+  sellaisenaan (**kwargs) funktioille `msgpack.unpackb` ja
+  `msgpack.packb`.
+
+  Vaatii paketin `msgpack` (`pip install django-pistoke[msgpack]`).
+  '''
+
+  def __init__(self, *, loads=None, dumps=None):
+    super().__init__()
+    # pylint: disable=import-outside-toplevel
+    import msgpack
+    self._msgpack = msgpack
+    self._loads = loads or {}
+    self._dumps = dumps or {}
+    # def __init__
+
+  def loads(self, data):
+    return self._msgpack.unpackb(data, **self._loads)
+
+  def dumps(self, olio):
+    return self._msgpack.packb(olio, **self._dumps)
+
+  # class MsgpackKoodain
+
+
+@rekisteroi('cbor')
+class CborKoodain(Koodain):
+  '''
+  CBOR-koodain (`cbor2`-kirjasto).
+
+  `dumps` palauttaa tavujonon. Parametrit `loads` ja `dumps` annetaan
+  sellaisenaan (**kwargs) funktioille `cbor2.loads` ja `cbor2.dumps`.
+
+  Vaatii paketin `cbor2` (`pip install django-pistoke[cbor]`).
+  '''
+
+  def __init__(self, *, loads=None, dumps=None):
+    super().__init__()
+    # pylint: disable=import-outside-toplevel
+    import cbor2
+    self._cbor2 = cbor2
+    self._loads = loads or {}
+    self._dumps = dumps or {}
+    # def __init__
+
+  def loads(self, data):
+    return self._cbor2.loads(data, **self._loads)
+
+  def dumps(self, olio):
+    return self._cbor2.dumps(olio, **self._dumps)
+
+  # class CborKoodain
+
+
+def muodosta_koodain(arvo):
+  '''
+  Muodosta koodain annetun olion, luokan tai polun mukaan.
+  '''
+  if isinstance(arvo, str):
+    arvo = import_string(arvo)
+  if isinstance(arvo, type):
+    arvo = arvo()
+  return arvo
+  # def muodosta_koodain
+
+
+def json_koodain():
+  '''
+  Palauta projektiasetuksen `PISTOKE_JSON_KOODAIN` mukainen koodain
+  tai oletuksena `JsonKoodain`.
+  '''
+  return muodosta_koodain(
+    getattr(settings, 'PISTOKE_JSON_KOODAIN', JsonKoodain)
+  )
+  # def json_koodain
+
+
+@rekisteroi('taulukko')
+class TaulukkoKoodain(Koodain):
+  '''
+  Numeeristen taulukoiden binäärikoodain.
+
+  `dumps` ottaa vastaan puskuriprotokollaa tukevan olion (esim.
+  `array.array`, `memoryview` tai `numpy.ndarray`) ja palauttaa
+  tavujonon, jossa taulukon raakadataa edeltää otsake: otsakkeen
+  pituus, tavujärjestys (`<` tai `>`), `struct`-moduulin mukainen
+  alkiotyyppi, ulottuvuuksien määrä ja kunkin ulottuvuuden koko
+  (uint32, little-endian). Otsake täytetään 8 tavun monikerraksi,
+  jotta vastaanottaja voi lukea datan suoraan (esim. `Float64Array`).
+
+  Alkiotyyppi kirjataan otsakkeeseen `struct`-moduulin vakiokokoisena
+  tyyppinä: alustakohtaisen kokoinen kokonaislukutyyppi (esim. `l`,
+  joka on 64-bittisessä Linuxissa 8 tavua) korvataan samankokoisella
+  vakiokokoisella tyypillä (`q`).
+
+  `loads` palauttaa vastaanotetun sanoman päälle muodostetun,
+  tyypitetyn ja muotoillun `memoryview`-näkymän. Kumpikaan suunta ei
+  käsittele alkioita yksitellen.
+  '''
+
+  tasaus = 8
+  jarjestys = b'<' if sys.byteorder == 'little' else b'>'
+
+  # Vakiokokoiset kokonaislukutyypit koon mukaan (etumerkillinen,
+  # etumerkitön).
+  _kokonaisluvut = {1: 'bB', 2: 'hH', 4: 'iI', 8: 'qQ'}
+
+  @staticmethod
+  def _vakiokoko(tyyppi):
+    ''' Palauta alkiotyypin vakiokoko tai `None`. '''
+    try:
+      return struct.calcsize('<' + tyyppi)
+    except struct.error:
+      return None
+    # def _vakiokoko
+
+  def dumps(self, olio):
+    nakyma = memoryview(olio)
+    tyyppi = nakyma.format
+    if tyyppi[:1] in ('@', '=', self.jarjestys.decode('ascii')):
+      tyyppi = tyyppi[1:]
+    if len(tyyppi) != 1:
+      raise ValueError(f'Tukematon alkiotyyppi: {nakyma.format!r}')
+    if self._vakiokoko(tyyppi) != nakyma.itemsize:
+      if tyyppi not in 'lLnNP' \
+      or nakyma.itemsize not in self._kokonaisluvut:
+        raise ValueError(f'Tukematon alkiotyyppi: {nakyma.format!r}')
+      tyyppi = self._kokonaisluvut[nakyma.itemsize][tyyppi not in 'ln']
+    muoto = f'<Bcc B {nakyma.ndim}I'
+    pituus = -(-struct.calcsize(muoto) // self.tasaus) * self.tasaus
+    otsake = struct.pack(
+      muoto,
+      pituus,
+      self.jarjestys,
+      tyyppi.encode('ascii'),
+      nakyma.ndim,
+      *nakyma.shape,
+    ).ljust(pituus, b'\0')
+    return b''.join((
+      otsake,
+      nakyma if nakyma.c_contiguous else nakyma.tobytes(),
+    ))
+    # def dumps
+
+  def loads(self, data):
+    nakyma = memoryview(data)
+    if nakyma.ndim != 1 or nakyma.format != 'B':
+      nakyma = nakyma.cast('B')
+    pituus, jarjestys, tyyppi, ulottuvuuksia = struct.unpack_from(
+      '<Bcc B', nakyma
+    )
+    if jarjestys != self.jarjestys:
+      raise ValueError('Tukematon tavujärjestys.')
+    tyyppi = tyyppi.decode('ascii')
+    if self._vakiokoko(tyyppi) != struct.calcsize(tyyppi):
+      # Alkion koko tässä prosessissa poikkeaisi otsakkeen mukaisesta.
+      raise ValueError(f'Tukematon alkiotyyppi: {tyyppi!r}')
+    muoto = struct.unpack_from(
+      f'<{ulottuvuuksia}I', nakyma, struct.calcsize('<Bcc B')
+    )
+    return nakyma[pituus:].cast(tyyppi, muoto)
+    # def loads
+
+  # class TaulukkoKoodain
@@ -3,6 +3,9 @@
 # pylint: disable=invalid-name
 # pylint: disable=ungrouped-imports
 
+import asyncio
+import os
+import sys
 from urllib.parse import urlparse
 
 from django.conf import settings
@@ -12,6 +15,7 @@ from django.core.management import CommandError
 
 try:
   import uvicorn
+  from uvicorn.main import STARTUP_FAILURE
 except ImportError:
   uvicorn = None
 
@@ -75,6 +79,8 @@ class Kasittelija:
         return await self.django(scope, receive, send)
     elif scope['type'] == 'websocket':
       return await self.websocket(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+      return await self.websocket.elinkaari(scope, receive, send)
     else:
       raise ValueError(f'tuntematon pyyntö: {scope["type"]}')
     # async def __call__
@@ -95,6 +101,32 @@ uvicorn_application_static = Kasittelija(
 )
 
 
+if uvicorn is not None:
+  class Palvelin(uvicorn.Server):
+    '''
+    Uvicorn-palvelin, joka sulkee avoimet Websocket-yhteydet hallitusti
+    ennen sammumista.
+
+    Uvicorn katkaisee avoimet Websocket-yhteydet koodilla 1012 ennen
+    kuin se lähettää elinkaaren `lifespan.shutdown`-sanoman, jolloin
+    `WebsocketKasittelija.tyhjenna` ei ehtisi sulkea niitä.
+    '''
+    async def shutdown(self, sockets=None):
+      # Lopetetaan uusien yhteyksien vastaanotto ja tyhjennetään
+      # käsittelijät ennen Uvicornin omaa sammutusta.
+      for palvelin in getattr(self, 'servers', ()):
+        palvelin.close()
+      await asyncio.gather(
+        uvicorn_application.websocket.tyhjenna(),
+        uvicorn_application_static.websocket.tyhjenna(),
+      )
+      await super().shutdown(sockets=sockets)
+      # async def shutdown
+    # class Palvelin
+else:
+  Palvelin = None
+
+
 class Command(_Command):
 
   def add_arguments(self, parser):
@@ -154,7 +186,7 @@ class Command(_Command):
         'ASGI-palvelimen ajaminen edellyttää `uvicorn`-paketin käyttöä.'
         ' Asenna se komennolla `pip install uvicorn`.'
       )
-    uvicorn.run(
+    config = uvicorn.Config(
       asgi_handler,
       host=addr,
       port=port,
@@ -180,7 +212,28 @@ class Command(_Command):
       } if options['ssl_keyfile'] and options['ssl_certfile'] else {}),
       workers=options['workers'],
     )
-    # def run
+    # Vrt. `uvicorn.run`; käytetään omaa palvelinluokkaa.
+    palvelin = Palvelin(config=config)
+    try:
+      if config.should_reload:
+        uvicorn.supervisors.ChangeReload(
+          config, target=palvelin.run, sockets=[config.bind_socket()]
+        ).run()
+      elif config.workers > 1:
+        uvicorn.supervisors.Multiprocess(
+          config, target=palvelin.run, sockets=[config.bind_socket()]
+        ).run()
+      else:
+        palvelin.run()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      if config.uds and os.path.exists(config.uds):
+        os.remove(config.uds)
+    if not palvelin.started \
+    and not config.should_reload and config.workers == 1:
+      sys.exit(STARTUP_FAILURE)
+    # def asgi_run
 
   def run(self, **options):
     if options.get('asgi', False) and options['use_reloader']:
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+'''
+Prosessikohtaiset Websocket-laskurit.
+
+Pistoke kasvattaa näitä laskureita mm. yhteyksien hyväksymisen ja
+hylkäämisen yhteydessä. Laskureiden tila on luettavissa `tilasto`-
+funktiolla esim. valvontanäkymää tai -komentoa varten.
+'''
+
+import collections
+
+
+laskurit = collections.Counter()
+
+
+def kasvata(nimi, maara=1):
+  ''' Kasvata annettua laskuria. '''
+  laskurit[nimi] += maara
+  # def kasvata
+
+
+def tilasto():
+  '''
+  Palauta laskureiden nykytila sanakirjana.
+
+  Mikäli sanomia on pakattu (`pistoke.tyokalut.Pakkaus`), tilastoon
+  lisätään saavutettu pakkaussuhde `pakkaus.suhde` (pakattu / raaka).
+  '''
+  tulos = dict(laskurit)
+  if laskurit['pakkaus.raaka']:
+    tulos['pakkaus.suhde'] = (
+      laskurit['pakkaus.pakattu'] / laskurit['pakkaus.raaka']
+    )
+  return tulos
+  # def tilasto
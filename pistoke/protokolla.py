@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import asyncio
+import collections
 from contextlib import asynccontextmanager
 import functools
+import time
 
-from asgiref.sync import markcoroutinefunction
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
 
-from .tyokalut import Koriste
+from . import mittarit
+from .tyokalut import Koriste, odota_enintaan
 
 
 class Kattelyvirhe(asyncio.CancelledError):
@@ -19,8 +23,11 @@ class YhteysKatkaistiin(asyncio.CancelledError):
 
 class _WebsocketKoriste(Koriste):
 
-  def __new__(cls, websocket, **kwargs):
+  def __new__(cls, websocket=None, **kwargs):
     # pylint: disable=signature-differs
+    if websocket is None:
+      # Parametrisoitu koriste: `@WebsocketProtokolla(...)`.
+      return super().__new__(cls, **kwargs)
     _websocket = websocket
     while _websocket is not None:
       if isinstance(_websocket, __class__):
@@ -43,6 +50,64 @@ class _WebsocketKoriste(Koriste):
   # class _WebsocketKoriste
 
 
+def tavunakyma(data):
+  '''
+  Palauta puskuriprotokollaa tukeva olio yksiulotteisena tavunäkymänä.
+
+  Yhtenäinen puskuri palautetaan kopioimatta; muu kuin yhtenäinen
+  (esim. askeleella viipaloitu) puskuri joudutaan kopioimaan.
+  '''
+  if isinstance(data, memoryview):
+    nakyma = data
+  else:
+    try:
+      nakyma = memoryview(data)
+    except TypeError:
+      raise TypeError(repr(data)) from None
+  if not nakyma.c_contiguous:
+    return memoryview(bytes(nakyma))
+  if nakyma.ndim == 1 and nakyma.format == 'B':
+    return nakyma
+  return nakyma.cast('B')
+  # def tavunakyma
+
+
+def katkaise(request, katkaisukoodi=None):
+  '''
+  Keskeytä `WebsocketProtokolla`-näkymän suoritus ja sulje yhteys
+  annetulla koodilla (esim. toisesta tehtävästä käsin).
+  '''
+  # pylint: disable=protected-access
+  kanava = getattr(request, '_kanava', None)
+  if kanava is not None:
+    kanava.katkaise(katkaisukoodi)
+  # def katkaise
+
+
+class _Lippu:
+  '''
+  Kevyt tilalippu `asyncio.Event`-olion sijaan.
+
+  Lippua ei voi jäädä odottamaan; se tarjoaa ainoastaan metodit
+  `set`, `clear` ja `is_set`.
+  '''
+  __slots__ = ('_arvo', )
+
+  def __init__(self):
+    self._arvo = False
+
+  def set(self):
+    self._arvo = True
+
+  def clear(self):
+    self._arvo = False
+
+  def is_set(self):
+    return self._arvo
+
+  # class _Lippu
+
+
 class _WebsocketYhteys:
 
   saapuva_kattely = {'type': 'websocket.connect'}
@@ -50,9 +115,29 @@ class _WebsocketYhteys:
   saapuva_katkaisu = {'type': 'websocket.disconnect'}
   lahteva_katkaisu = {'type': 'websocket.close'}
 
+  # Aika (s), jonka sulkeva kättely odottaa vastapään katkaisua.
+  sulkemisen_aikakatkaisu: float = 1.0
+
+  # Aika (s), jonka avaava kättely odottaa yhteyspyyntöä
+  # (None: rajoittamaton).
+  avaamisen_aikakatkaisu: float = None
+
+  async def _vastaanota_kattely(self, request):
+    ''' Odota avaavaa kättelyä enintään `avaamisen_aikakatkaisu` s. '''
+    if self.avaamisen_aikakatkaisu is None:
+      return await request.receive()
+    try:
+      return await odota_enintaan(
+        request.receive(), self.avaamisen_aikakatkaisu
+      )
+    except asyncio.TimeoutError:
+      mittarit.kasvata('kattely.aikakatkaisu')
+      raise Kattelyvirhe('Avaava kättely aikakatkaistiin.') from None
+    # async def _vastaanota_kattely
+
   async def _avaa_yhteys(self, request):
     # pylint: disable=protected-access
-    saapuva_kattely = await request.receive()
+    saapuva_kattely = await self._vastaanota_kattely(request)
     if saapuva_kattely != self.saapuva_kattely:
       request._katkaistu_vastapaasta.set()
       raise Kattelyvirhe(
@@ -61,41 +146,61 @@ class _WebsocketYhteys:
     await request.send(self.lahteva_kattely)
     # async def _avaa_yhteys
 
+  async def _avaa_tai_palauta_virhe(self, request):
+    '''
+    Avaa yhteys; palauta mahdollinen `Kattelyvirhe` nostamatta sitä.
+
+    `asyncio.shield` muuntaisi suojatun tehtävän nostaman
+    `Kattelyvirhe`-poikkeuksen (CancelledError) tavalliseksi
+    keskeytykseksi.
+    '''
+    try:
+      await self._avaa_yhteys(request)
+    except Kattelyvirhe as virhe:
+      return virhe
+    return None
+    # async def _avaa_tai_palauta_virhe
+
   async def _sulje_yhteys(self, request):
-    if not request._katkaistu_vastapaasta.is_set():
-      request._katkaistu_tasta_paasta.set()
-      await request.send(self.lahteva_katkaisu)
-      try:
-        saapuva_katkaisu = await asyncio.wait_for(
-          request.receive(),
-          timeout=0.01
-        )
-        if saapuva_katkaisu != self.saapuva_katkaisu:
-          raise Kattelyvirhe(
-            'Sulkeva kättely epäonnistui: %r' % saapuva_katkaisu
-          )
-      except (asyncio.CancelledError, asyncio.TimeoutError):
-        pass
+    # pylint: disable=protected-access
+    if request._katkaistu_vastapaasta.is_set() \
+    or request._katkaistu_tasta_paasta.is_set():
+      return
+    request._katkaistu_tasta_paasta.set()
+    katkaisukoodi = getattr(request, '_katkaisukoodi', None)
+    await request.send(
+      self.lahteva_katkaisu if katkaisukoodi is None
+      else {**self.lahteva_katkaisu, 'code': katkaisukoodi}
+    )
+    # Vastapään katkaisun (websocket.disconnect) lukee syötettä
+    # käsittelevä tehtävä; odotetaan sen päättymistä.
+    vastaanotto = getattr(request, '_vastaanotto', None)
+    if vastaanotto is not None and not vastaanotto.done():
+      await asyncio.wait(
+        (vastaanotto, ),
+        timeout=self.sulkemisen_aikakatkaisu,
+      )
     # async def _sulje_yhteys
 
   @asynccontextmanager
   async def __call__(
     self, request, *args, **kwargs
   ):
-    request._katkaistu_vastapaasta = asyncio.Event()
-    request._katkaistu_tasta_paasta = asyncio.Event()
+    request._katkaistu_vastapaasta = _Lippu()
+    request._katkaistu_tasta_paasta = _Lippu()
 
     # pylint: disable=invalid-name
     try:
-      await asyncio.shield(self._avaa_yhteys(request))
-
-    except Kattelyvirhe:
-      await asyncio.shield(self._sulje_yhteys(request))
-      raise
+      virhe = await asyncio.shield(self._avaa_tai_palauta_virhe(request))
 
     except asyncio.CancelledError:
       asyncio.tasks.current_task().cancel()
 
+    else:
+      if virhe is not None:
+        await asyncio.shield(self._sulje_yhteys(request))
+        raise virhe
+
     try:
       yield request
 
@@ -109,11 +214,311 @@ class _WebsocketYhteys:
   # class _WebsocketYhteys
 
 
+class _Kiintio:
+  '''
+  Saapuvien sanomien kiintiö (token bucket).
+
+  Kiintiö täyttyy nopeudella `sanomia` sanomaa ja `tavuja` tavua
+  sekunnissa enintään arvoihin `sanomia_kerralla` ja `tavuja_kerralla`
+  (oletuksena sekunnin kiintiö). Rajoittamaton suure annetaan
+  arvona `None`. Merkkijonon koko lasketaan merkkeinä.
+
+  Kiintiö voi olla usean yhteyden yhteinen (ks.
+  `WebsocketProtokolla.saapuvien_rajoitus`); `kayttajia` laskee sitä
+  käyttävät yhteydet.
+  '''
+
+  __slots__ = (
+    'sanomia', 'tavuja', 'sanomia_kerralla', 'tavuja_kerralla',
+    'sanomavara', 'tavuvara', 'aika', 'kayttajia',
+  )
+
+  def __init__(
+    self, *,
+    sanomia=None, tavuja=None, sanomia_kerralla=None, tavuja_kerralla=None,
+  ):
+    inf = float('inf')
+    self.sanomia = sanomia or inf
+    self.tavuja = tavuja or inf
+    self.sanomia_kerralla = sanomia_kerralla or max(self.sanomia, 1)
+    self.tavuja_kerralla = tavuja_kerralla or self.tavuja
+    self.sanomavara = self.sanomia_kerralla
+    self.tavuvara = self.tavuja_kerralla
+    self.aika = time.monotonic()
+    self.kayttajia = 0
+    # def __init__
+
+  def ota(self, koko, velaksi):
+    '''
+    Ota kiintiöstä yksi `koko`-kokoinen sanoma.
+
+    Mikäli kiintiö ei riitä, palautetaan `None` tai, mikäli `velaksi`
+    on tosi, sanoma otetaan velaksi ja palautetaan aika (s), jonka
+    kuluttua velka on maksettu. Muutoin palautetaan nolla.
+    '''
+    nyt = time.monotonic()
+    kulunut, self.aika = nyt - self.aika, nyt
+    sanomavara = min(
+      self.sanomia_kerralla, self.sanomavara + kulunut * self.sanomia
+    ) - 1
+    tavuvara = min(
+      self.tavuja_kerralla, self.tavuvara + kulunut * self.tavuja
+    ) - koko
+    if sanomavara >= 0 and tavuvara >= 0:
+      self.sanomavara, self.tavuvara = sanomavara, tavuvara
+      return 0
+    if not velaksi:
+      self.sanomavara, self.tavuvara = sanomavara + 1, tavuvara + koko
+      return None
+    self.sanomavara, self.tavuvara = sanomavara, tavuvara
+    return max(0, -sanomavara / self.sanomia, -tavuvara / self.tavuja)
+    # def ota
+
+  # class _Kiintio
+
+
+class _Kanava:
+  '''
+  Yksittäisen Websocket-yhteyden syöte- ja tulostekanava.
+
+  Kanavan `receive`- ja `send`-metodit korvaavat pyynnön vastaavat
+  metodit näkymän suorituksen ajaksi. `pumppaa` siirtää ASGI-palvelimelta
+  saapuvat sanomat syötejonoon ja keskeyttää näkymän (`nakyma`),
+  kun yhteys katkeaa.
+
+  Määre `tavuja` kertoo syötejonossa olevien sanomien yhteenlasketun
+  koon (merkkiä tai tavuja).
+  '''
+
+  __slots__ = (
+    'protokolla', 'request', 'syote', 'mittarit',
+    'asgi_receive', 'asgi_send', 'nakyma', 'lahteva_tyyppi', 'kiintio',
+    'koko_enintaan', 'tavuja_enintaan', 'tavuja', 'nollakopio',
+  )
+
+  def __init__(self, protokolla, request):
+    self.protokolla = protokolla
+    self.request = request
+    self.lahteva_tyyppi = protokolla.lahteva_sanoma['type']
+    self.syote = asyncio.Queue(maxsize=protokolla.syotejono_enintaan)
+    self.mittarit = request.mittarit = collections.Counter()
+    self.asgi_receive = request.receive
+    self.asgi_send = request.send
+    self.nakyma = None
+    self.kiintio = None
+    self.koko_enintaan = protokolla.saapuvan_koko_enintaan
+    self.tavuja_enintaan = protokolla.syotejono_tavuja_enintaan
+    self.tavuja = 0
+    self.nollakopio = protokolla.nollakopio
+    # def __init__
+
+  def katkaise(self, katkaisukoodi=None):
+    ''' Keskeytä näkymä; sulje yhteys annetulla koodilla. '''
+    # pylint: disable=protected-access
+    if katkaisukoodi is not None:
+      self.request._katkaisukoodi = katkaisukoodi
+    if self.nakyma is not None:
+      self.nakyma.cancel()
+    # def katkaise
+
+  def _hylkaa_syote(self, katkaisukoodi):
+    ''' Hylkää lukematon syöte; sulje yhteys annetulla koodilla. '''
+    # pylint: disable=protected-access
+    syote = self.syote
+    while not syote.empty():
+      syote.get_nowait()
+    self.tavuja = 0
+    self.request._katkaisukoodi = katkaisukoodi
+    # def _hylkaa_syote
+
+  async def pumppaa(self):
+    ''' Lue saapuvia sanomia, kunnes vastapää katkaisee yhteyden. '''
+    # pylint: disable=protected-access
+    protokolla, request = self.protokolla, self.request
+    syote, _mittarit = self.syote, self.mittarit
+    ylivuoto = protokolla.syotejonon_ylivuoto
+    kiintio = self.kiintio
+    ylitys = protokolla.saapuvien_ylitys
+    koko_enintaan = self.koko_enintaan
+    tavuja_enintaan = self.tavuja_enintaan
+    saapuva_sanoma = protokolla.saapuva_sanoma['type']
+    saapuva_katkaisu = protokolla.saapuva_katkaisu['type']
+    try:
+      while not request._katkaistu_vastapaasta.is_set():
+        sanoma = await self.asgi_receive()
+        if sanoma['type'] == saapuva_sanoma:
+          # ASGI-palvelin voi antaa molemmat avaimet, toisen arvona None.
+          data = sanoma.get('text')
+          if data is None:
+            data = sanoma.get('bytes')
+          koko = len(data)
+          if request._katkaistu_tasta_paasta.is_set():
+            # Sulkevan kättelyn aikana saapuva data hylätään; sitä ei
+            # kirjata lukemattomaksi syötteeksi.
+            continue
+          if koko_enintaan is not None and koko > koko_enintaan:
+            # Ylisuuri sanoma: suljetaan yhteys koodilla 1009.
+            self._hylkaa_syote(1009)
+            mittarit.kasvata('syote.liian_suuri')
+            break
+          if tavuja_enintaan is not None \
+          and self.tavuja + koko > tavuja_enintaan:
+            self._hylkaa_syote(1009)
+            mittarit.kasvata('syote.tavuylivuoto')
+            break
+          if kiintio is not None:
+            viive = kiintio.ota(koko, ylitys == 'odota')
+            if viive is None and ylitys == 'pudota':
+              _mittarit['rajoitus.pudotettu'] += 1
+              mittarit.kasvata('rajoitus.pudotettu')
+              continue
+            elif viive is None:
+              # Hylätään lukematon syöte ja suljetaan yhteys.
+              self._hylkaa_syote(1008)
+              mittarit.kasvata('rajoitus.suljettu')
+              break
+            elif viive > 0:
+              # Viivästetään sanomaa (ja seuraavien lukemista),
+              # kunnes kiintiö riittää.
+              _mittarit['rajoitus.viivastetty'] += 1
+              mittarit.kasvata('rajoitus.viivastetty')
+              await asyncio.sleep(viive)
+          if ylivuoto == 'odota' or not syote.full():
+            await syote.put(data)
+            self.tavuja += koko
+          elif ylivuoto == 'pudota':
+            self.tavuja += koko - len(syote.get_nowait())
+            syote.put_nowait(data)
+            _mittarit['syote.pudotettu'] += 1
+            mittarit.kasvata('syote.pudotettu')
+          else:
+            # Hylätään lukematon syöte ja suljetaan yhteys.
+            self._hylkaa_syote(1008)
+            mittarit.kasvata('syote.ylivuoto')
+            break
+          jonossa = syote.qsize()
+          _mittarit['syote.jonossa'] = jonossa
+          if jonossa > _mittarit['syote.enimmillaan']:
+            _mittarit['syote.enimmillaan'] = jonossa
+        elif sanoma['type'] == saapuva_katkaisu:
+          request._katkaistu_vastapaasta.set()
+          break
+        else:
+          raise TypeError(repr(sanoma))
+        # while not request._katkaistu_vastapaasta.is_set
+    finally:
+      self.katkaise()
+    # async def pumppaa
+
+  async def receive(self):
+    data = await self.syote.get()
+    self.tavuja -= len(data)
+    self.mittarit['syote.jonossa'] = self.syote.qsize()
+    return data
+    # async def receive
+
+  def receive_nowait(self):
+    '''
+    Palauta seuraava jonossa oleva sanoma odottamatta.
+
+    Nostaa poikkeuksen `asyncio.QueueEmpty`, mikäli jono on tyhjä.
+    '''
+    data = self.syote.get_nowait()
+    self.tavuja -= len(data)
+    self.mittarit['syote.jonossa'] = self.syote.qsize()
+    return data
+    # def receive_nowait
+
+  async def receive_many(self, max_n=None, timeout=None):
+    '''
+    Odota vähintään yhtä sanomaa ja palauta kaikki jonossa olevat
+    sanomat (enintään `max_n` kpl) listana.
+
+    Mikäli yhtään sanomaa ei saavu `timeout` sekunnin kuluessa,
+    palautetaan tyhjä lista.
+    '''
+    syote = self.syote
+    if syote.empty():
+      if timeout is None:
+        sanomat = [await syote.get()]
+      else:
+        try:
+          sanomat = [await asyncio.wait_for(syote.get(), timeout)]
+        except asyncio.TimeoutError:
+          return []
+    else:
+      sanomat = [syote.get_nowait()]
+    while not syote.empty() and (max_n is None or len(sanomat) < max_n):
+      sanomat.append(syote.get_nowait())
+    self.tavuja -= sum(map(len, sanomat))
+    self.mittarit['syote.jonossa'] = syote.qsize()
+    return sanomat
+    # async def receive_many
+
+  async def send(self, data, avain=None, kiireellinen=False):
+    '''
+    Lähetetään annettu data joko tekstinä tai tavujonona.
+
+    Tavujono voi olla mikä tahansa puskuriprotokollaa tukeva olio
+    (bytes, bytearray, memoryview, array, mmap jne.). ASGI-määritys
+    edellyttää `bytes`-arvoa, joten muut oliot kopioidaan, ellei
+    kopioimaton lähetys (`nollakopio`) ole käytössä.
+
+    Avain ja kiireellisyys (ks. `_Lahetin.laheta`) ohitetaan:
+    puskuroimaton sanoma kirjoitetaan aina ja välittömästi.
+    '''
+    # pylint: disable=unused-argument
+    if isinstance(data, str):
+      return await self.asgi_send(
+        {'type': self.lahteva_tyyppi, 'text': data}
+      )
+    if isinstance(data, bytes):
+      pass
+    elif not self.nollakopio:
+      data = bytes(tavunakyma(data))
+    elif not isinstance(data, bytearray):
+      data = tavunakyma(data)
+    return await self.asgi_send(
+      {'type': self.lahteva_tyyppi, 'bytes': data}
+    )
+    # async def send
+
+  # class _Kanava
+
+
 class _WebsocketProtokolla(_WebsocketYhteys):
 
   saapuva_sanoma = {'type': 'websocket.receive'}
   lahteva_sanoma = {'type': 'websocket.send'}
 
+  # Saapuvien, lukemattomien sanomien enimmäismäärä (0: rajoittamaton).
+  syotejono_enintaan: int = 0
+
+  # Toiminta syötejonon täyttyessä:
+  # - `odota`: keskeytetään lukeminen ASGI-palvelimelta, kunnes näkymä
+  #   lukee jonosta (TCP-vastapaine);
+  # - `pudota`: hylätään jonon vanhin sanoma;
+  # - `sulje`: suljetaan yhteys koodilla 1008.
+  syotejonon_ylivuoto: str = 'odota'
+
+  # Saapuvan sanoman sekä syötejonon yhteenlaskettu enimmäiskoko
+  # (merkkiä tai tavuja; None: rajoittamaton). Ylitys sulkee yhteyden
+  # koodilla 1009.
+  saapuvan_koko_enintaan: int = None
+  syotejono_tavuja_enintaan: int = None
+
+  # Välitetäänkö muut tavuoliot kuin `bytes` ASGI-palvelimelle
+  # kopioimatta (None: projektiasetus `PISTOKE_NOLLAKOPIO`, oletus
+  # False). Edellyttää, että palvelin hyväksyy minkä tahansa
+  # puskuriprotokollaa tukevan olion (esim. Uvicorn).
+  nollakopio: bool = None
+
+  # Toiminta saapuvien sanomien kiintiön ylittyessä (ks. `_Kiintio`):
+  # - `odota`: sanomaa ja seuraavien lukemista viivästetään;
+  # - `pudota`: sanoma hylätään;
+  # - `sulje`: yhteys suljetaan koodilla 1008.
+  saapuvien_ylitys: str = 'odota'
+
   class SyotettaEiLuettu(Exception):
     ''' Näkymä ei lukenut kaikkea sille annettua syötettä. '''
 
@@ -121,113 +526,494 @@ class _WebsocketProtokolla(_WebsocketYhteys):
   async def __call__(
     self, request, *args, **kwargs
   ):
-    # pylint: disable=invalid-name
+    # pylint: disable=invalid-name, protected-access
     async with super().__call__(request):
 
-      syote = asyncio.Queue()
-
-      @functools.wraps(request.receive)
-      async def _receive():
-        while not request._katkaistu_tasta_paasta.is_set() \
-        and not request._katkaistu_vastapaasta.is_set():
-          sanoma = await _receive.__wrapped__()
-          if sanoma['type'] == self.saapuva_sanoma['type']:
-            await syote.put(
-              sanoma.get('text', sanoma.get('bytes', None))
-            )
-          elif sanoma['type'] == self.saapuva_katkaisu['type']:
-            request._katkaistu_vastapaasta.set()
-            break
-          else:
-            raise TypeError(repr(sanoma))
-        # async def _receive
-
-      @functools.wraps(request.receive)
-      async def receive():
-        data = await syote.get()
-        syote.task_done()
-        return data
-        # async def receive
-
-      @functools.wraps(request.send)
-      async def send(data):
-        '''
-        Lähetetään annettu data joko tekstinä tai tavujonona.
-        '''
-        if isinstance(data, str):
-          data = {**self.lahteva_sanoma, 'text': data}
-        elif isinstance(data, bytearray):
-          data = {**self.lahteva_sanoma, 'bytes': bytes(data)}
-        elif isinstance(data, bytes):
-          data = {**self.lahteva_sanoma, 'bytes': data}
-        else:
-          raise TypeError(repr(data))
-        return await send.__wrapped__(data)
-        # async def send
-
-      request.receive = receive
-      request.send = send
+      kanava = _Kanava(self, request)
+      request.receive = kanava.receive
+      request.receive_nowait = kanava.receive_nowait
+      request.receive_many = kanava.receive_many
+      request.send = kanava.send
+      request._kanava = kanava
 
       try:
-        yield request, _receive
+        yield request, kanava
 
       except (YhteysKatkaistiin, asyncio.CancelledError):
         pass
 
       finally:
-        request.receive = receive.__wrapped__
-        request.send = send.__wrapped__
-
-        # Varmistetaan, että näkymä luki kaiken syötteen.
-        if not syote.empty() and self.SyotettaEiLuettu is not None:
-          _s = []
-          while not syote.empty():
-            _s.append(await syote.get())
-          raise self.SyotettaEiLuettu(_s)
+        request.receive = kanava.asgi_receive
+        request.send = kanava.asgi_send
+        del request.receive_nowait, request.receive_many
+        del request._kanava
         # finally
 
       # async with super
 
+    # Varmistetaan sulkevan kättelyn jälkeen, että näkymä luki kaiken
+    # vastapään ennen katkaisua lähettämän syötteen.
+    syote = kanava.syote
+    if not syote.empty() and self.SyotettaEiLuettu is not None:
+      _s = []
+      while not syote.empty():
+        _s.append(syote.get_nowait())
+      raise self.SyotettaEiLuettu(_s)
     # async def __call__
 
   # class _WebsocketProtokolla
 
 
+class _Lahetin:
+  '''
+  Yhteyskohtainen lähtevien sanomien puskuri ja kirjoitustehtävä.
+
+  `laheta` palaa välittömästi, kunnes puskuroitujen sanomien määrä tai
+  koko saavuttaa ylärajan; tämän jälkeen se odottaa, kunnes
+  kirjoitustehtävä on purkanut puskuria. Mikäli puskuri pysyy täytenä
+  yli `aikaraja`-sekunnin, kutsutaan `katkaise`-takaisinkutsua.
+
+  Avaimella lähetetty sanoma korvaa puskurissa odottavan, saman
+  avaimen sanoman (sen paikalla jonossa); avaimellisten sanomien
+  osalta puskuri kasvaa siten enintään avainten määrän mittaiseksi.
+  Puskurin alkiot ovat muotoa `[data, koko, avain]`.
+
+  Kiireelliset sanomat (`kiireellinen=True`) puskuroidaan omaan
+  jonoonsa (enintään `kiireellisia` kpl), joka kirjoitetaan ennen
+  tavallista puskuria. Avainta ei käytetä kiireellisille sanomille.
+  '''
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(
+    self, send, mittarit_, *,
+    sanomia=None, tavuja=None, aikaraja=None, katkaise=None,
+    kiireellisia=None,
+  ):
+    # pylint: disable=too-many-arguments
+    self._send = send
+    self._mittarit = mittarit_
+    self.sanomia_enintaan = sanomia
+    self.tavuja_enintaan = tavuja
+    self.aikaraja = aikaraja
+    self._katkaise = katkaise
+    self.puskuri = collections.deque()
+    self.kiireelliset = collections.deque()
+    self.kiireellisia_enintaan = kiireellisia
+    self.avaimet = {}
+    self.tavuja = 0
+    self.suljettu = False
+    self._saatavilla = asyncio.Event()
+    self._tilaa = asyncio.Event()
+    self._tilaa.set()
+    self._kiiretilaa = asyncio.Event()
+    self._kiiretilaa.set()
+    self._tyhja = asyncio.Event()
+    self._tyhja.set()
+    self._ajastin = None
+    self._tehtava = asyncio.create_task(self._kirjoita())
+    # def __init__
+
+  def _taynna(self):
+    return (
+      self.sanomia_enintaan is not None
+      and len(self.puskuri) >= self.sanomia_enintaan
+    ) or (
+      self.tavuja_enintaan is not None
+      and self.tavuja >= self.tavuja_enintaan
+    )
+    # def _taynna
+
+  def _aikaraja_ylittyi(self):
+    self._ajastin = None
+    mittarit.kasvata('lahete.hidas')
+    self.sulje()
+    if self._katkaise is not None:
+      self._katkaise()
+    # def _aikaraja_ylittyi
+
+  def sulje(self):
+    ''' Hylkää puskuri ja vapauta odottavat lähettäjät. '''
+    self.suljettu = True
+    if self._ajastin is not None:
+      self._ajastin.cancel()
+      self._ajastin = None
+    self.puskuri.clear()
+    self.kiireelliset.clear()
+    self.avaimet.clear()
+    self.tavuja = 0
+    self._tilaa.set()
+    self._kiiretilaa.set()
+    self._tyhja.set()
+    self._tehtava.cancel()
+    # def sulje
+
+  async def laheta(self, data, avain=None, kiireellinen=False):
+    '''
+    Puskuroi sanoma. Mikäli `avain` on annettu ja puskurissa odottaa
+    saman avaimen sanoma, se korvataan tällä (laskuri
+    `lahete.yhdistetty`). Kiireellinen sanoma ohittaa puskurissa
+    odottavat tavalliset sanomat.
+    '''
+    if isinstance(data, (str, bytes)):
+      koko = len(data)
+    else:
+      data = tavunakyma(data)
+      if not data.readonly:
+        # Kopioidaan muuttuva puskuri ennen jonoon asettamista.
+        data = bytes(data)
+      koko = len(data)
+    if kiireellinen:
+      return await self._laheta_kiireellinen(data, koko)
+    while True:
+      if avain is not None:
+        alkio = self.avaimet.get(avain)
+        if alkio is not None:
+          # Korvataan lähettämätön sanoma; tilaa ei tarvita.
+          self.tavuja += koko - alkio[1]
+          alkio[0], alkio[1] = data, koko
+          self._mittarit['lahete.yhdistetty'] += 1
+          break
+      if self._tilaa.is_set():
+        if self.suljettu:
+          self._mittarit['lahete.pudotettu'] += 1
+          return
+        alkio = [data, koko, avain]
+        self.puskuri.append(alkio)
+        if avain is not None:
+          self.avaimet[avain] = alkio
+        self.tavuja += koko
+        self._tyhja.clear()
+        self._saatavilla.set()
+        jonossa = len(self.puskuri)
+        if jonossa > self._mittarit['lahete.enimmillaan']:
+          self._mittarit['lahete.enimmillaan'] = jonossa
+        break
+      await self._tilaa.wait()
+      # while True
+    if self._tilaa.is_set() and self._taynna():
+      self._tilaa.clear()
+      if self.aikaraja is not None:
+        self._ajastin = asyncio.get_running_loop().call_later(
+          self.aikaraja, self._aikaraja_ylittyi
+        )
+    # async def laheta
+
+  async def _laheta_kiireellinen(self, data, koko):
+    kiireelliset = self.kiireelliset
+    while not self._kiiretilaa.is_set():
+      await self._kiiretilaa.wait()
+    if self.suljettu:
+      self._mittarit['lahete.pudotettu'] += 1
+      return
+    kiireelliset.append((data, koko))
+    self._mittarit['lahete.kiireellinen'] += 1
+    self._tyhja.clear()
+    self._saatavilla.set()
+    if self.kiireellisia_enintaan is not None \
+    and len(kiireelliset) >= self.kiireellisia_enintaan:
+      self._kiiretilaa.clear()
+    # async def _laheta_kiireellinen
+
+  async def _kirjoita(self):
+    kiireelliset = self.kiireelliset
+    try:
+      while True:
+        if kiireelliset:
+          await self._send(kiireelliset[0][0])
+          kiireelliset.popleft()
+          self._kiiretilaa.set()
+          continue
+        if not self.puskuri:
+          self._saatavilla.clear()
+          self._tyhja.set()
+          await self._saatavilla.wait()
+          continue
+        alkio = self.puskuri[0]
+        data, koko, avain = alkio
+        if avain is not None and self.avaimet.get(avain) is alkio:
+          # Kirjoitettavaa sanomaa ei enää korvata.
+          del self.avaimet[avain]
+        await self._send(data)
+        self.puskuri.popleft()
+        self.tavuja -= koko
+        if not self._tilaa.is_set() and not self._taynna():
+          if self._ajastin is not None:
+            self._ajastin.cancel()
+            self._ajastin = None
+          self._tilaa.set()
+        # while True
+    finally:
+      # Vapautetaan odottavat lähettäjät myös virhetilanteessa.
+      self.suljettu = True
+      self._tilaa.set()
+      self._kiiretilaa.set()
+      self._tyhja.set()
+    # async def _kirjoita
+
+  async def tyhjenna(self, aikakatkaisu=None):
+    ''' Odota puskurin purkautumista ja päätä kirjoitustehtävä. '''
+    try:
+      if not self.suljettu:
+        await asyncio.wait_for(self._tyhja.wait(), timeout=aikakatkaisu)
+    except asyncio.TimeoutError:
+      pass
+    finally:
+      self.sulje()
+      try:
+        await self._tehtava
+      except asyncio.CancelledError:
+        pass
+    # async def tyhjenna
+
+  # class _Lahetin
+
+
 class WebsocketProtokolla(_WebsocketProtokolla, _WebsocketKoriste):
   '''
   Sallitaan vain yksi protokolla per metodi.
+
+  Syötejonon koko ja ylivuototoiminta voidaan antaa näkymäkohtaisesti:
+  `@WebsocketProtokolla(syotejono_enintaan=100, syotejonon_ylivuoto=...)`.
+
+  Saapuvan sanoman enimmäiskoko (`saapuvan_koko_enintaan`) ja syötejonon
+  yhteenlaskettu enimmäiskoko (`syotejono_tavuja_enintaan`) tarkistetaan
+  ennen jonoon asettamista; ylitys sulkee yhteyden koodilla 1009.
+  Oletusarvot luetaan projektiasetuksista
+  `PISTOKE_SAAPUVAN_KOKO_ENINTAAN` ja `PISTOKE_SYOTEJONO_TAVUJA_ENINTAAN`.
+
+  Mikäli lähtevien sanomien ylärajaksi annetaan `lahtevia_enintaan`
+  (kpl) tai `lahtevia_tavuja_enintaan`, lähetykset puskuroidaan ja
+  kirjoitetaan erillisessä tehtävässä. Vastaanottaja, jonka puskuri
+  pysyy täytenä yli `hidas_vastaanottaja` sekuntia, katkaistaan
+  koodilla 1008. Kiireelliset sanomat
+  (`request.send(..., kiireellinen=True)`) ohittavat puskuroidut
+  sanomat; niitä puskuroidaan enintään `kiireellisia_enintaan`.
+
+  Saapuvien sanomien määrää rajoitetaan antamalla nopeus
+  `saapuvia_sekunnissa` ja/tai `saapuvia_tavuja_sekunnissa` sekä
+  tarvittaessa hetkellinen enimmäismäärä (`saapuvia_kerralla`,
+  `saapuvia_tavuja_kerralla`). Ylityksen toiminta annetaan parametrinä
+  `saapuvien_ylitys`. Kiintiö on oletuksena yhteyskohtainen;
+  `saapuvien_rajoitus` (`osoite`, `kayttaja` tai funktio, joka
+  palauttaa pyynnölle avaimen) jakaa sen saman avaimen yhteyksien
+  kesken tämän prosessin sisällä.
+
+  Avaava kättely odottaa yhteyspyyntöä (`websocket.connect`)
+  enintään `avaamisen_aikakatkaisu` sekuntia (oletuksena
+  rajoittamatta) ja sulkeva kättely vastapään katkaisua enintään
+  `sulkemisen_aikakatkaisu` sekuntia.
+
+  Muut binäärisanomat kuin `bytes` kopioidaan ennen ASGI-palvelimelle
+  välittämistä, ellei `nollakopio` (tai projektiasetus
+  `PISTOKE_NOLLAKOPIO`) ole asetettu.
   '''
+
+  # Lähtevien sanomien puskurin ylärajat (None: ei puskuroida).
+  lahtevia_enintaan: int = None
+  lahtevia_tavuja_enintaan: int = None
+
+  # Aika (s), jonka puskuri saa pysyä täytenä (None: rajoittamaton).
+  hidas_vastaanottaja: float = None
+
+  # Kiireellisten sanomien jonon yläraja (None: rajoittamaton).
+  kiireellisia_enintaan: int = 100
+
+  # Saapuvien sanomien kiintiö (None: rajoittamaton).
+  saapuvia_sekunnissa: float = None
+  saapuvia_tavuja_sekunnissa: float = None
+  saapuvia_kerralla: int = None
+  saapuvia_tavuja_kerralla: int = None
+
+  # Kiintiön jakoperuste: None (yhteys), `osoite`, `kayttaja` tai funktio.
+  saapuvien_rajoitus = None
+
+  # Näkymäkohtaisesti annettavat asetukset (None: luokan oletus).
+  _asetukset = frozenset((
+    'syotejono_enintaan',
+    'syotejonon_ylivuoto',
+    'lahtevia_enintaan',
+    'lahtevia_tavuja_enintaan',
+    'hidas_vastaanottaja',
+    'sulkemisen_aikakatkaisu',
+    'saapuvia_sekunnissa',
+    'saapuvia_tavuja_sekunnissa',
+    'saapuvia_kerralla',
+    'saapuvia_tavuja_kerralla',
+    'saapuvien_ylitys',
+    'saapuvien_rajoitus',
+    'kiireellisia_enintaan',
+    'avaamisen_aikakatkaisu',
+    'saapuvan_koko_enintaan',
+    'syotejono_tavuja_enintaan',
+    'nollakopio',
+  ))
+
+  def __init__(self, websocket, **kwargs):
+    super().__init__(websocket)
+    for nimi, arvo in kwargs.items():
+      if nimi not in self._asetukset:
+        raise TypeError(f'Tuntematon parametri: {nimi!r}')
+      if arvo is not None:
+        setattr(self, nimi, arvo)
+    if self.syotejonon_ylivuoto not in ('odota', 'pudota', 'sulje'):
+      raise ValueError(
+        f'Tuntematon ylivuototoiminta: {self.syotejonon_ylivuoto!r}'
+      )
+    if self.saapuvien_ylitys not in ('odota', 'pudota', 'sulje'):
+      raise ValueError(
+        f'Tuntematon ylitystoiminta: {self.saapuvien_ylitys!r}'
+      )
+    if self.saapuvien_rajoitus is not None \
+    and not callable(self.saapuvien_rajoitus) \
+    and self.saapuvien_rajoitus not in ('osoite', 'kayttaja'):
+      raise ValueError(
+        f'Tuntematon rajoitusperuste: {self.saapuvien_rajoitus!r}'
+      )
+    self._kiintiot = {}
+    # def __init__
+
+  @staticmethod
+  def _kayttajan_tunnus(request):
+    ''' Palauta kirjautuneen käyttäjän tunnus (synkroninen). '''
+    kayttaja = getattr(request, 'user', None)
+    if kayttaja is not None and kayttaja.is_authenticated:
+      return kayttaja.pk
+    return None
+    # def _kayttajan_tunnus
+
+  async def _kiintion_avain(self, request):
+    '''
+    Palauta jaetun kiintiön avain (None: yhteyskohtainen).
+
+    Käyttäjä ratkaistaan asynkronisesti (`request.auser`, Django 5+),
+    sillä laiska `request.user` lukee istunnon ja tietokannan
+    synkronisesti.
+    '''
+    rajoitus = self.saapuvien_rajoitus
+    if rajoitus is None:
+      return None
+    if callable(rajoitus):
+      return rajoitus(request)
+    if rajoitus == 'kayttaja':
+      auser = getattr(request, 'auser', None)
+      if auser is not None:
+        kayttaja = await auser()
+        tunnus = kayttaja.pk if kayttaja.is_authenticated else None
+      else:
+        tunnus = await sync_to_async(
+          self._kayttajan_tunnus, thread_sensitive=True
+        )(request)
+      if tunnus is not None:
+        return ('kayttaja', tunnus)
+    return ('osoite', (request.scope.get('client') or (None, ))[0])
+    # async def _kiintion_avain
+
+  async def _varaa_kiintio(self, request):
+    ''' Palauta yhteydellä käytettävä kiintiö tai `None`. '''
+    if self.saapuvia_sekunnissa is None \
+    and self.saapuvia_tavuja_sekunnissa is None:
+      return None, None
+    avain = await self._kiintion_avain(request)
+    kiintio = self._kiintiot.get(avain) if avain is not None else None
+    if kiintio is None:
+      kiintio = _Kiintio(
+        sanomia=self.saapuvia_sekunnissa,
+        tavuja=self.saapuvia_tavuja_sekunnissa,
+        sanomia_kerralla=self.saapuvia_kerralla,
+        tavuja_kerralla=self.saapuvia_tavuja_kerralla,
+      )
+      if avain is not None:
+        self._kiintiot[avain] = kiintio
+    kiintio.kayttajia += 1
+    return avain, kiintio
+    # async def _varaa_kiintio
+
+  def _vapauta_kiintio(self, avain, kiintio):
+    kiintio.kayttajia -= 1
+    if avain is not None and not kiintio.kayttajia:
+      self._kiintiot.pop(avain, None)
+    # def _vapauta_kiintio
+
   async def __call__(
     self, request, *args, **kwargs
   ):
-    # pylint: disable=invalid-name
+    # pylint: disable=invalid-name, protected-access
     if request.method != 'Websocket':
       # pylint: disable=no-member
       return await self.__wrapped__(
         request, *args, **kwargs
       )
 
-    async with super().__call__(
-      request, *args, **kwargs
-    ) as (request, _receive):
-      kaaritty = asyncio.create_task(
-        self.__wrapped__(request, *args, **kwargs)
-      )
-      receive = asyncio.create_task(_receive())
+    receive = None
+    avain = kiintio = None
+    try:
+      async with super().__call__(
+        request, *args, **kwargs
+      ) as (request, kanava):
+        avain, kiintio = await self._varaa_kiintio(request)
+        kanava.kiintio = kiintio
+        if kanava.koko_enintaan is None:
+          kanava.koko_enintaan = getattr(
+            settings, 'PISTOKE_SAAPUVAN_KOKO_ENINTAAN', None
+          )
+        if kanava.tavuja_enintaan is None:
+          kanava.tavuja_enintaan = getattr(
+            settings, 'PISTOKE_SYOTEJONO_TAVUJA_ENINTAAN', None
+          )
+        if kanava.nollakopio is None:
+          kanava.nollakopio = getattr(settings, 'PISTOKE_NOLLAKOPIO', False)
+        if self.lahtevia_enintaan is not None \
+        or self.lahtevia_tavuja_enintaan is not None:
+          send = request.send
+          lahetin = _Lahetin(
+            send,
+            request.mittarit,
+            sanomia=self.lahtevia_enintaan,
+            tavuja=self.lahtevia_tavuja_enintaan,
+            aikaraja=self.hidas_vastaanottaja,
+            katkaise=functools.partial(kanava.katkaise, 1008),
+            kiireellisia=self.kiireellisia_enintaan,
+          )
+          request.send = lahetin.laheta
+        else:
+          lahetin = None
 
-      @receive.add_done_callback
-      def vastaanotto_valmis(__):
-        kaaritty.cancel()
+        receive = request._vastaanotto = asyncio.create_task(
+          kanava.pumppaa()
+        )
 
-      try:
-        await kaaritty
-      finally:
+        # Suoritetaan näkymä tässä tehtävässä. Syötteen luku keskeyttää
+        # sen (`kanava.katkaise`), kun yhteys katkeaa.
+        kanava.nakyma = asyncio.current_task()
         try:
-          await asyncio.wait_for(receive, timeout=0.01)
-        except (asyncio.CancelledError, asyncio.TimeoutError):
+          await self.__wrapped__(request, *args, **kwargs)
+        finally:
+          kanava.nakyma = None
+          if lahetin is not None:
+            request.send = send
+            await asyncio.shield(
+              lahetin.tyhjenna(self.hidas_vastaanottaja)
+            )
+          # finally
+        # async with super.__call__
+
+    except Kattelyvirhe:
+      # Yhteys hylättiin avaavassa kättelyssä; näkymää ei suoriteta.
+      pass
+
+    finally:
+      # Syötteen luku päättyy tavallisesti vastapään katkaisuun
+      # sulkevan kättelyn aikana. Muutoin se keskeytetään tässä.
+      if receive is not None:
+        if not receive.done():
+          receive.cancel()
+        try:
+          await receive
+        except asyncio.CancelledError:
           pass
-        # finally
-      # async with super.__call__
+      if kiintio is not None:
+        self._vapauta_kiintio(avain, kiintio)
+      # finally
 
     # async def __call__
 
@@ -252,7 +1038,11 @@ class WebsocketAliprotokolla(WebsocketProtokolla):
     # def __init__
 
   async def _avaa_yhteys(self, request):
-    saapuva_kattely = await request.receive()
+    try:
+      saapuva_kattely = await self._vastaanota_kattely(request)
+    except Kattelyvirhe:
+      request.protokolla = None
+      raise
     if saapuva_kattely != self.saapuva_kattely:
       request._katkaistu_vastapaasta.set()
       request.protokolla = None
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+
+'''
+Prosessinsisäiset ryhmälähetykset.
+
+Näkymä liittää Websocket-yhteyden nimettyihin ryhmiin:
+```python
+from pistoke.ryhma import keskitin
+
+@WebsocketProtokolla
+@JsonLiikenne
+async def huone(request, nimi):
+  with keskitin.liity(request, f'huone-{nimi}'):
+    async for sanoma in request:
+      keskitin.julkaise(f'huone-{nimi}', sanoma)
+```
+
+`julkaise` koodaa sanoman kerran ja jonottaa sen kullekin jäsenelle.
+Kunkin jäsenen jono kirjoitetaan jäsenkohtaisessa tehtävässä yhteyden
+omaa lähetysreittiä pitkin (`request.send_raw` tai `request.send`),
+joten ryhmäsanomat kulkevat mm. lähetepuskurin ja `Pakkaus`-koristeen
+kautta samassa järjestyksessä näkymän omien sanomien kanssa. Hitaan
+jäsenen kirjoitus ei viivästytä muita jäseniä.
+'''
+
+import asyncio
+import collections
+import functools
+import sys
+
+from django.conf import settings
+
+from . import mittarit
+from .koodain import json_koodain, muodosta_koodain
+from .protokolla import katkaise
+from .valitys import muodosta_valitys
+
+
+if sys.version_info >= (3, 12):
+  def _tehtava(korutiini):
+    '''
+    Suorita korutiinia välittömästi ensimmäiseen keskeytykseen asti
+    (`eager_start`); keskeytynyttä suoritusta jatketaan tehtävänä.
+    '''
+    return asyncio.Task(
+      korutiini, loop=asyncio.get_running_loop(), eager_start=True
+    )
+else:
+  def _tehtava(korutiini):
+    return asyncio.get_running_loop().create_task(korutiini)
+
+
+class _Jasen:
+  '''
+  Ryhmiin liitetty yhteys.
+
+  Ryhmäsanomat jonotetaan ja kirjoitetaan yhteyden lähetysmetodilla
+  (`send`) jäsenkohtaisessa tehtävässä, joka päättyy jonon
+  tyhjennyttyä.
+  Python 3.12+:ssa tehtävä käynnistyy välittömästi, joten keskeytyksettä
+  valmistuva kirjoitus ei odota tapahtumasilmukan seuraavaa kierrosta.
+  '''
+
+  __slots__ = ('request', 'send', 'jono', 'tehtava', 'ryhmat')
+
+  def __init__(self, request):
+    self.request = request
+    # Valmiiksi koodattu sanoma lähetetään sellaisenaan
+    # (vrt. `JsonLiikenne`).
+    self.send = getattr(request, 'send_raw', request.send)
+    self.jono = collections.deque()
+    self.tehtava = None
+    self.ryhmat = set()
+    # def __init__
+
+  def laheta(self, sanoma):
+    ''' Jonota sanoma; käynnistä tarvittaessa kirjoitustehtävä. '''
+    self.jono.append(sanoma)
+    if self.tehtava is None or self.tehtava.done():
+      self.tehtava = _tehtava(self.kirjoita())
+    # def laheta
+
+  async def kirjoita(self):
+    '''
+    Kirjoita jonotetut sanomat. Kirjoitettavana oleva sanoma poistetaan
+    jonosta, joten jonon pituus kertoo odottavien sanomien määrän.
+    '''
+    jono, send = self.jono, self.send
+    try:
+      while jono:
+        await send(jono.popleft())
+    except OSError:
+      # Yhteys on katkennut; jäsen poistuu näkymän päättyessä.
+      jono.clear()
+    # async def kirjoita
+
+  # class _Jasen
+
+
+class Keskitin:
+  '''
+  Ryhmälähetysten keskitin.
+
+  Lähtevät sanomat koodataan `koodain`-parametrin (oletuksena
+  projektiasetuksen `PISTOKE_JSON_KOODAIN`) mukaisesti: merkkijono
+  lähetetään tekstisanomana ja tavujono binäärisanomana.
+
+  Mikäli jäsenen jonossa on `jono_enintaan` kirjoittamatonta
+  sanomaa, hidas jäsen poistetaan ryhmistä ja sen yhteys katkaistaan
+  koodilla 1008 (laskuri `ryhma.hidas`).
+
+  Sanomat välitetään muiden prosessien keskittimille parametrin
+  `valitys` (oletuksena projektiasetuksen `PISTOKE_RYHMAVALITYS`)
+  mukaisesti, ks. `pistoke.valitys`.
+  '''
+
+  jono_enintaan: int = 1000
+
+  def __init__(self, *, koodain=None, jono_enintaan=None, valitys=None):
+    self._koodain = koodain
+    self._valitys = valitys
+    if jono_enintaan is not None:
+      self.jono_enintaan = jono_enintaan
+    self._ryhmat = collections.defaultdict(set)
+    # def __init__
+
+  @functools.cached_property
+  def koodain(self):
+    if self._koodain is not None:
+      return muodosta_koodain(self._koodain)
+    return json_koodain()
+    # def koodain
+
+  @functools.cached_property
+  def valitys(self):
+    ''' Muiden prosessien keskittimiin johtava liitos tai `None`. '''
+    valitys = muodosta_valitys(
+      self._valitys if self._valitys is not None
+      else getattr(settings, 'PISTOKE_RYHMAVALITYS', None)
+    )
+    return valitys.liita(self._jaa) if valitys is not None else None
+    # def valitys
+
+  def jasenia(self, ryhma):
+    ''' Palauta ryhmän jäsenten määrä. '''
+    return len(self._ryhmat.get(ryhma, ()))
+    # def jasenia
+
+  def liity(self, request, *ryhmat):
+    '''
+    Liitä `WebsocketProtokolla`-yhteys annettuihin ryhmiin.
+
+    Palauttaa kontekstin, jonka päättyessä yhteys poistuu ryhmistä
+    ja sen lähettämättömät ryhmäsanomat hylätään.
+    '''
+    # Avataan tarvittaessa välitys, jotta muiden prosessien
+    # julkaisemat sanomat saapuvat.
+    self.valitys  # pylint: disable=pointless-statement
+    jasen = _Jasen(request)
+    for ryhma in ryhmat:
+      self._ryhmat[ryhma].add(jasen)
+      jasen.ryhmat.add(ryhma)
+    return _Jasenyys(self, jasen)
+    # def liity
+
+  def _poista(self, jasen):
+    for ryhma in jasen.ryhmat:
+      jasenet = self._ryhmat.get(ryhma)
+      if jasenet is not None:
+        jasenet.discard(jasen)
+        if not jasenet:
+          del self._ryhmat[ryhma]
+    jasen.ryhmat.clear()
+    jasen.jono.clear()
+    if jasen.tehtava is not None:
+      jasen.tehtava.cancel()
+    # def _poista
+
+  def julkaise(self, ryhma, sanoma):
+    '''
+    Koodaa sanoma kerran ja lähetä se ryhmän kaikille jäsenille.
+
+    Palauttaa vastaanottajien määrän.
+    '''
+    return self.julkaise_raaka(ryhma, self.koodain.dumps(sanoma))
+    # def julkaise
+
+  def julkaise_raaka(self, ryhma, data):
+    '''
+    Lähetä valmiiksi koodattu sanoma (str tai bytes) ryhmän kaikille
+    jäsenille.
+
+    Palauttaa tämän prosessin vastaanottajien määrän.
+    '''
+    valitys = self.valitys
+    if valitys is not None:
+      valitys.julkaise(ryhma, data)
+    return self._jaa(ryhma, data)
+    # def julkaise_raaka
+
+  def _jaa(self, ryhma, data):
+    ''' Lähetä sanoma tämän prosessin jäsenille. '''
+    jasenet = self._ryhmat.get(ryhma)
+    if not jasenet:
+      return 0
+    enintaan = self.jono_enintaan
+    hitaat = []
+    for jasen in jasenet:
+      if enintaan is not None and len(jasen.jono) >= enintaan:
+        hitaat.append(jasen)
+      else:
+        jasen.laheta(data)
+    vastaanottajia = len(jasenet) - len(hitaat)
+    for jasen in hitaat:
+      mittarit.kasvata('ryhma.hidas')
+      self._poista(jasen)
+      katkaise(jasen.request, 1008)
+    return vastaanottajia
+    # def _jaa
+
+  # class Keskitin
+
+
+class _Jasenyys:
+  ''' `Keskitin.liity`-kutsun palauttama konteksti. '''
+
+  __slots__ = ('keskitin', 'jasen')
+
+  def __init__(self, keskitin_, jasen):
+    self.keskitin = keskitin_
+    self.jasen = jasen
+    # def __init__
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    # pylint: disable=protected-access
+    self.keskitin._poista(self.jasen)
+    # def __exit__
+
+  # class _Jasenyys
+
+
+keskitin = Keskitin()
@@ -102,7 +102,9 @@ class WebsocketPaateprotokolla(_WebsocketProtokolla):
         'Virheellinen kättely: %r' % kattely
       )
     if kattely == self.saapuva_katkaisu:
+      # Kuitataan katkaisu ASGI-palvelimen tapaan.
       request._katkaistu_vastapaasta.set()
+      await request.send(self.lahteva_katkaisu)
       raise WebsocketPoikkeus.Http403(
         'Palvelin sulki yhteyden.'
       )
@@ -127,9 +129,9 @@ class WebsocketPaateprotokolla(_WebsocketProtokolla):
   async def __call__(self, scope, receive, send):
     async with super().__call__(
       WebsocketPyynto(scope, receive, send),
-    ) as (request, _receive):
+    ) as (request, kanava):
       _task = asyncio.tasks.current_task()
-      _receive = asyncio.create_task(_receive())
+      _receive = asyncio.create_task(kanava.pumppaa())
       _receive.add_done_callback(
         lambda __receive: _task.cancel()
       )
@@ -155,6 +157,10 @@ class WebsocketPaateyhteys(WebsocketPaateprotokolla):
   raise_request_exception: bool
   aikakatkaisu: float
 
+  # Enimmäisaika (s), jonka pääte odottaa näkymän alkavan lukea
+  # syötettään ennen avaavaa kättelyä.
+  kattelyn_odotus = 0.01
+
   def __post_init__(self):
     super().__init__()
 
@@ -165,10 +171,17 @@ class WebsocketPaateyhteys(WebsocketPaateprotokolla):
     )
     syote, tuloste = asyncio.Queue(), asyncio.Queue()
 
+    # Merkitään, kun näkymä lukee syötettään ensimmäisen kerran.
+    luku_alkanut = asyncio.get_running_loop().create_future()
+    async def receive():
+      if not luku_alkanut.done():
+        luku_alkanut.set_result(None)
+      return await syote.get()
+
     nakyma = asyncio.create_task(
       kasittelija(
         self.scope,
-        syote.get,
+        receive,
         tuloste.put,
       )
     )
@@ -198,10 +211,11 @@ class WebsocketPaateyhteys(WebsocketPaateprotokolla):
       ''' Keskeytä pääteistunto, jos näkymä päättyy. '''
       paate.cancel()
 
-    # Anna näkymälle hetki aikaa ennen pääteyhteyden avaamista.
+    # Odotetaan, kunnes näkymä lukee kättelyä (tai enintään
+    # `kattelyn_odotus`-ajan) ennen pääteyhteyden avaamista.
     # Mikäli näkymä ehti päättyä, nostetaan poikkeus.
     try:
-      await asyncio.sleep(0.01)
+      await asyncio.wait((luku_alkanut, ), timeout=self.kattelyn_odotus)
     except asyncio.CancelledError:
       try:
         if poikkeus := aikakatkaistu_nakyma.exception():
@@ -224,9 +238,12 @@ class WebsocketPaateyhteys(WebsocketPaateprotokolla):
       paatteen_nostama_poikkeus = exc
 
     finally:
-      # Annetaan näkymälle hetki aikaa päättyä.
+      # Annetaan näkymälle aikaa päättyä sulkevan kättelyn mukaisesti.
       try:
-        await asyncio.sleep(0.01)
+        await asyncio.wait(
+          (aikakatkaistu_nakyma, ),
+          timeout=self.sulkemisen_aikakatkaisu,
+        )
       except asyncio.CancelledError:
         pass
 
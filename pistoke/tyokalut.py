@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import functools
-import json
+import zlib
+
+from django.conf import settings
+
+from . import mittarit
+from .koodain import (
+  JsonKoodain,
+  json_koodain,
+  koodaimet,
+  muodosta_koodain,
+  nimetty_koodain,
+)
 
 # pylint: disable=unused-import
 from .poistuvat import (
@@ -44,39 +56,541 @@ class Koriste:
   # class Koriste
 
 
+async def odota_enintaan(alirutiini, aikaraja):
+  '''
+  Odota alirutiinia enintään `aikaraja` sekuntia; ylitys nostaa
+  poikkeuksen `asyncio.TimeoutError`.
+
+  Toisin kuin `asyncio.wait_for`, alirutiinia ei kääritä erilliseen
+  tehtävään: aikaraja toteutetaan `call_later`-ajastimella, joka
+  keskeyttää kutsuvan tehtävän.
+  '''
+  tehtava = asyncio.current_task()
+  ylitetty = False
+  def ylitys():
+    nonlocal ylitetty
+    ylitetty = True
+    tehtava.cancel()
+  ajastin = asyncio.get_running_loop().call_later(aikaraja, ylitys)
+  try:
+    return await alirutiini
+  except asyncio.CancelledError:
+    if not ylitetty:
+      raise
+    # Python 3.11+: kumotaan ajastimen pyytämä keskeytys.
+    if hasattr(tehtava, 'uncancel'):
+      tehtava.uncancel()
+    raise asyncio.TimeoutError from None
+  finally:
+    ajastin.cancel()
+  # async def odota_enintaan
+
+
 class OriginPoikkeus(Koriste):
   ''' Ohita Origin-otsakkeen tarkistus Websocket-pyynnön yhteydessä. '''
   origin_poikkeus = True
   # def origin_poikkeus
 
 
-class JsonLiikenne(Koriste):
+class Yhteysraja(Koriste):
+  '''
+  Rajoita näkymään samanaikaisesti avattujen Websocket-yhteyksien määrää.
+
+  Käyttö: `@Yhteysraja(100)`. Rajan ylittävät yhteyspyynnöt evätään
+  Websocket-käsittelijässä ennen ohjainketjun (middleware) ajoa.
+  '''
+
+  def __new__(cls, *args, **kwargs):
+    if args and not callable(args[0]):
+      return functools.partial(cls, enintaan=args[0], **kwargs)
+    return super().__new__(cls, *args, **kwargs)
+    # def __new__
+
+  def __init__(self, websocket, *, enintaan):
+    super().__init__(websocket)
+    self.yhteysraja = enintaan
+    # def __init__
+
+  # class Yhteysraja
+
+
+def _lahetysmaareet(avain, kiireellinen):
+  '''
+  Palauta oletusarvoista poikkeavat lähetysmääreet.
+
+  Avain ja kiireellisyys välitetään alemman tason `send`-metodille vain
+  annettuina, jotta se voi olla myös ilman niitä (esim. ASGI-kanava tai
+  muu koriste).
+  '''
+  maareet = {}
+  if avain is not None:
+    maareet['avain'] = avain
+  if kiireellinen:
+    maareet['kiireellinen'] = True
+  return maareet
+  # def _lahetysmaareet
+
+
+class _Kooste:
+  '''
+  Lähtevien sanomien kooste: `send` kerää sanomat listaan, joka
+  koodataan ja lähetetään yhtenä sanomana (`flush`), kun listassa on
+  `enintaan` sanomaa tai kun ensimmäisen sanoman lisäämisestä on
+  kulunut `aika` sekuntia.
+
+  Avaimella lisätty sanoma korvaa koosteessa odottavan saman avaimen
+  sanoman. Valmiiksi koodattu sanoma (`send_raw`) lähetetään
+  sellaisenaan koosteen jälkeen.
+  '''
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, laheta, koodaa, *, aika, enintaan):
+    self._laheta = laheta
+    self._koodaa = koodaa
+    self.aika = aika
+    self.enintaan = enintaan
+    self.sanomat = []
+    self.avaimet = {}
+    self._lukko = asyncio.Lock()
+    self._ajastin = None
+    self._tehtava = None
+    # def __init__
+
+  async def send(self, s, avain=None, kiireellinen=False):
+    if kiireellinen:
+      # Kiireellinen sanoma lähetetään välittömästi koosteen ohi.
+      return await self._laheta(self._koodaa([s]), kiireellinen=True)
+    sanomat = self.sanomat
+    if avain is not None:
+      indeksi = self.avaimet.get(avain)
+      if indeksi is not None:
+        sanomat[indeksi] = s
+        return
+      self.avaimet[avain] = len(sanomat)
+    sanomat.append(s)
+    if len(sanomat) >= self.enintaan:
+      await self.flush()
+    elif self._ajastin is None and self._tehtava is None:
+      self._ajasta()
+    # async def send
+
+  async def send_raw(self, data, avain=None, kiireellinen=False):
+    if kiireellinen:
+      return await self._laheta(data, kiireellinen=True)
+    async with self._lukko:
+      await self._tyhjenna()
+      if avain is None:
+        return await self._laheta(data)
+      return await self._laheta(data, avain=avain)
+    # async def send_raw
+
+  async def flush(self):
+    ''' Lähetä koosteeseen kerätyt sanomat välittömästi. '''
+    async with self._lukko:
+      await self._tyhjenna()
+    # async def flush
+
+  async def _tyhjenna(self):
+    if self._ajastin is not None:
+      self._ajastin.cancel()
+      self._ajastin = None
+    if self.sanomat:
+      sanomat, self.sanomat, self.avaimet = self.sanomat, [], {}
+      await self._laheta(self._koodaa(sanomat))
+    # async def _tyhjenna
+
+  def _ajasta(self):
+    self._ajastin = asyncio.get_running_loop().call_later(
+      self.aika, self._aika_kulunut
+    )
+    # def _ajasta
+
+  def _aika_kulunut(self):
+    self._ajastin = None
+    self._tehtava = asyncio.get_running_loop().create_task(self._ajastettu())
+    # def _aika_kulunut
+
+  async def _ajastettu(self):
+    try:
+      await self.flush()
+    finally:
+      self._tehtava = None
+    # Ajastetun lähetyksen aikana lisätyt sanomat ajastetaan uudelleen.
+    if self.sanomat and self._ajastin is None:
+      self._ajasta()
+    # async def _ajastettu
+
+  def sulje(self):
+    ''' Hylkää lähettämättömät sanomat ja peruuta ajastus. '''
+    if self._ajastin is not None:
+      self._ajastin.cancel()
+      self._ajastin = None
+    if self._tehtava is not None:
+      self._tehtava.cancel()
+    self.sanomat, self.avaimet = [], {}
+    # def sulje
+
+  # class _Kooste
+
+
+class _Sanomaliikenne(Koriste):
+  '''
+  Koodattu viestinvaihto: `request.receive` purkaa ja `request.send`
+  koodaa sanomat pyyntökohtaisen koodaimen avulla.
+
+  Mikäli `koonti` (s) on annettu, lähtevät sanomat kootaan listaksi,
+  joka lähetetään yhtenä sanomana `koonti` sekunnin kuluttua
+  ensimmäisestä sanomasta, kun listassa on `koonti_enintaan` sanomaa
+  tai kun näkymä kutsuu metodia `request.flush()`.
+  '''
+
+  koonti: float = None
+  koonti_enintaan: int = 100
+
+  def _aseta_koonti(self, koonti, koonti_enintaan):
+    if koonti is not None:
+      self.koonti = koonti
+    if koonti_enintaan is not None:
+      self.koonti_enintaan = koonti_enintaan
+    # def _aseta_koonti
+
+  def pyynnon_koodain(self, request):
+    ''' Palauta pyynnöllä käytettävä koodain. '''
+    raise NotImplementedError
+
+  def muunna(self, data):
+    ''' Muunna koodattu sanoma ennen lähetystä. '''
+    return data
+
+  async def __call__(self, request, *args, **kwargs):
+    koodain = self.pyynnon_koodain(request)
+    loads, dumps = koodain.loads, koodain.dumps
+    muunna = self.muunna
+    @functools.wraps(request.receive)
+    async def receive():
+      return loads(await receive.__wrapped__())
+    @functools.wraps(request.send)
+    async def send_raw(data, avain=None, kiireellinen=False):
+      if avain is None and not kiireellinen:
+        return await send_raw.__wrapped__(muunna(data))
+      return await send_raw.__wrapped__(
+        muunna(data), **_lahetysmaareet(avain, kiireellinen)
+      )
+    @functools.wraps(request.send)
+    async def send(s, avain=None, kiireellinen=False):
+      return await send_raw(dumps(s), avain, kiireellinen)
+    if self.koonti is not None:
+      kooste = _Kooste(
+        send_raw,
+        dumps,
+        aika=self.koonti,
+        enintaan=self.koonti_enintaan,
+      )
+      request.send = kooste.send
+      request.send_raw = kooste.send_raw
+      request.flush = kooste.flush
+    else:
+      kooste = None
+      request.send = send
+      request.send_raw = send_raw
+    request.receive = receive
+    # Puretaan myös protokollan tarjoamat erälukumetodit.
+    receive_nowait = getattr(request, 'receive_nowait', None)
+    receive_many = getattr(request, 'receive_many', None)
+    if receive_nowait is not None:
+      @functools.wraps(receive_nowait)
+      def _receive_nowait():
+        return loads(receive_nowait())
+      request.receive_nowait = _receive_nowait
+    if receive_many is not None:
+      @functools.wraps(receive_many)
+      async def _receive_many(*args, **kwargs):
+        return [
+          loads(data)
+          for data in await receive_many(*args, **kwargs)
+        ]
+      request.receive_many = _receive_many
+    try:
+      tulos = await self.__wrapped__(
+        request, *args, **kwargs
+      )
+      if kooste is not None:
+        await kooste.flush()
+      return tulos
+    finally:
+      if kooste is not None:
+        kooste.sulje()
+        del request.flush
+      request.receive = receive.__wrapped__
+      request.send = send_raw.__wrapped__
+      del request.send_raw
+      if receive_nowait is not None:
+        request.receive_nowait = receive_nowait
+      if receive_many is not None:
+        request.receive_many = receive_many
+    # async def __call__
+
+  # class _Sanomaliikenne
+
+
+class JsonLiikenne(_Sanomaliikenne):
+  '''
+  JSON-muotoinen viestinvaihto.
+
+  Koodain (ks. `pistoke.koodain`) annetaan parametrinä `koodain` tai
+  projektiasetuksella `PISTOKE_JSON_KOODAIN`. Vaihtoehtoisesti voidaan
+  antaa vakiokirjaston `json.loads`- ja `json.dumps`-funktioiden
+  parametrit (`loads`, `dumps`).
+
+  Mikäli koodain tuottaa tavujonon (esim. `orjson`), se lähetetään
+  tekstisanomana (`teksti=True`, oletus) tai binäärisanomana
+  (`teksti=False`). Jo valmiiksi koodattu sanoma voidaan lähettää
+  sellaisenaan metodilla `request.send_raw`.
+
+  Koonti (`koonti`, `koonti_enintaan`): ks. `_Sanomaliikenne`. Kukin
+  lähtevä sanoma on tällöin JSON-taulukko.
+  '''
 
   def __init__(
     self,
     websocket, *,
     loads=None,
     dumps=None,
+    koodain=None,
+    teksti=True,
+    koonti=None,
+    koonti_enintaan=None,
+  ):
+    # pylint: disable=redefined-outer-name, too-many-arguments
+    super().__init__(websocket)
+    self._aseta_koonti(koonti, koonti_enintaan)
+    if koodain is not None:
+      if loads or dumps:
+        raise ValueError(
+          'Parametrejä `loads` ja `dumps` ei voi käyttää'
+          ' koodaimen yhteydessä.'
+        )
+      self.koodain = muodosta_koodain(koodain)
+    elif loads or dumps:
+      self.koodain = JsonKoodain(loads=loads, dumps=dumps)
+    else:
+      self.koodain = json_koodain()
+    self.teksti = teksti
+    # def __init__
+
+  def pyynnon_koodain(self, request):
+    return self.koodain
+
+  def muunna(self, data):
+    if self.teksti and not isinstance(data, str):
+      return str(data, 'utf-8')
+    return data
+
+  # class JsonLiikenne
+
+
+class BinaariLiikenne(_Sanomaliikenne):
+  '''
+  Koodattu (esim. MessagePack- tai CBOR-muotoinen) viestinvaihto.
+
+  Koodain annetaan parametrinä `koodain` (olio, luokka, polku tai
+  rekisteröity nimi, ks. `pistoke.koodain.koodaimet`). Mikäli koodainta
+  ei anneta, se valitaan yhteyskohtaisesti neuvotellun aliprotokollan
+  (`WebsocketAliprotokolla`) pisteen jälkeisen päätteen mukaan:
+  esim. `v1.msgpack` -> `msgpack`, `v1.json` -> `json`.
+
+  Koodaimen tuottama tavujono lähetetään binäärisanomana ja
+  merkkijono tekstisanomana.
+  '''
+
+  def __init__(
+    self, websocket, *, koodain=None, koonti=None, koonti_enintaan=None,
   ):
     super().__init__(websocket)
-    self.loads = loads or {}
-    self.dumps = dumps or {}
+    self._aseta_koonti(koonti, koonti_enintaan)
+    self.koodain = (
+      nimetty_koodain(koodain)
+      if isinstance(koodain, str) and koodain in koodaimet
+      else muodosta_koodain(koodain)
+      if koodain is not None
+      else None
+    )
     # def __init__
 
+  def pyynnon_koodain(self, request):
+    if self.koodain is not None:
+      return self.koodain
+    protokolla = getattr(request, 'protokolla', None)
+    if not protokolla:
+      raise ValueError(
+        'Koodainta ei annettu eikä aliprotokollaa neuvoteltu.'
+      )
+    return nimetty_koodain(protokolla.rpartition('.')[2])
+    # def pyynnon_koodain
+
+  # class BinaariLiikenne
+
+
+class Pakkaus(Koriste):
+  '''
+  Sovellustason zlib-pakkaus (raaka deflate-virta).
+
+  Lähtevä sanoma, jonka koko on vähintään `kynnys` tavua, pakataan
+  yhteyskohtaisella pakkaimella ja lähetetään binäärisanomana.
+  Pakkaimen tila säilyy sanomasta toiseen (Z_SYNC_FLUSH), joten
+  toistuvat rakenteet pakkautuvat myös pienissä sanomissa. Yhteinen
+  esisanakirja annetaan parametrinä `sanakirja`.
+
+  Binäärisanoman ensimmäinen tavu kertoo sen sisällön:
+  0 = pakkaamaton tavujono, 1 = pakattu tavujono, 2 = pakattu
+  UTF-8-teksti. Pakkaamattomat tekstisanomat välitetään sellaisenaan.
+
+  Mikäli `protokollat` on annettu, pakkaus on käytössä vain, kun
+  neuvoteltu aliprotokolla (`WebsocketAliprotokolla`) on jokin näistä.
+
+  Pakatut tavumäärät kirjataan laskureihin `pakkaus.raaka` ja
+  `pakkaus.pakattu` (sekä yhteyskohtaisesti `request.mittarit`);
+  ohitetut, kynnystä pienemmät sanomat laskuriin `pakkaus.ohitettu`.
+
+  Saapuvan sanoman purettu koko on enintään `purettu_enintaan` tavua
+  (oletuksena projektiasetus `PISTOKE_SAAPUVAN_KOKO_ENINTAAN`);
+  ylitys sulkee yhteyden koodilla 1009 (laskuri `pakkaus.liian_suuri`).
+  '''
+
+  kynnys = 128
+  taso = zlib.Z_DEFAULT_COMPRESSION
+  purettu_enintaan = None
+
+  PAKKAAMATON = b'\x00'
+  PAKATTU = b'\x01'
+  PAKATTU_TEKSTI = b'\x02'
+  # Z_SYNC_FLUSH-kutsun tuottama, aina samanlainen loppu jätetään pois.
+  LOPPU = b'\x00\x00\xff\xff'
+
+  def __init__(
+    self,
+    websocket, *,
+    sanakirja=None,
+    kynnys=None,
+    taso=None,
+    protokollat=None,
+    purettu_enintaan=None,
+  ):
+    super().__init__(websocket)
+    self.sanakirja = sanakirja
+    if kynnys is not None:
+      self.kynnys = kynnys
+    if taso is not None:
+      self.taso = taso
+    self.protokollat = (
+      frozenset(protokollat) if protokollat is not None else None
+    )
+    if purettu_enintaan is not None:
+      self.purettu_enintaan = purettu_enintaan
+    # def __init__
+
+  def pakkain(self):
+    ''' Muodosta yhteyskohtainen pakkain. '''
+    if self.sanakirja is not None:
+      return zlib.compressobj(
+        self.taso, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.sanakirja
+      )
+    return zlib.compressobj(self.taso, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # def pakkain
+
+  def purkain(self):
+    ''' Muodosta yhteyskohtainen purkain. '''
+    if self.sanakirja is not None:
+      return zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.sanakirja)
+    return zlib.decompressobj(-zlib.MAX_WBITS)
+    # def purkain
+
   async def __call__(self, request, *args, **kwargs):
+    if self.protokollat is not None \
+    and getattr(request, 'protokolla', None) not in self.protokollat:
+      return await self.__wrapped__(request, *args, **kwargs)
+
+    pakkain, purkain = self.pakkain(), self.purkain()
+    kynnys, lukko = self.kynnys, asyncio.Lock()
+    _mittarit = request.mittarit
+    sync_flush, loppu = zlib.Z_SYNC_FLUSH, self.LOPPU
+    purettu_enintaan = self.purettu_enintaan
+    if purettu_enintaan is None:
+      purettu_enintaan = getattr(
+        settings, 'PISTOKE_SAAPUVAN_KOKO_ENINTAAN', None
+      )
+
+    def pura(data):
+      if isinstance(data, str):
+        return data
+      merkki = data[:1]
+      if merkki == self.PAKKAAMATON:
+        return data[1:]
+      data = purkain.decompress(
+        memoryview(data)[1:], purettu_enintaan or 0
+      )
+      if purkain.unconsumed_tail:
+        # Purettu sanoma ylittää enimmäiskoon: suljetaan yhteys.
+        # pylint: disable=import-outside-toplevel
+        from .protokolla import katkaise
+        mittarit.kasvata('pakkaus.liian_suuri')
+        katkaise(request, 1009)
+        raise asyncio.CancelledError
+      # Tyhjä loppu ei tuota dataa, mutta pidetään purkain ajan tasalla.
+      purkain.decompress(loppu)
+      return str(data, 'utf-8') if merkki == self.PAKATTU_TEKSTI else data
+      # def pura
+
     @functools.wraps(request.receive)
     async def receive():
-      return json.loads(
-        await receive.__wrapped__(),
-        **self.loads
-      )
+      return pura(await receive.__wrapped__())
     @functools.wraps(request.send)
-    async def send(s):
-      return await send.__wrapped__(
-        json.dumps(s, **self.dumps)
-      )
+    async def send(data, avain=None, kiireellinen=False):
+      # Pakatut sanomat riippuvat toisistaan (yhteinen pakkaimen tila),
+      # joten niitä ei voi korvata tai ohittaa puskurissa: avain ja
+      # kiireellisyys ohitetaan.
+      # pylint: disable=unused-argument
+      if isinstance(data, str):
+        raaka, merkki = data.encode('utf-8'), self.PAKATTU_TEKSTI
+      else:
+        raaka, merkki = data, self.PAKATTU
+      if len(raaka) < kynnys:
+        _mittarit['pakkaus.ohitettu'] += 1
+        mittarit.kasvata('pakkaus.ohitettu')
+        return await send.__wrapped__(
+          data if merkki is self.PAKATTU_TEKSTI
+          else b''.join((self.PAKKAAMATON, raaka))
+        )
+      # Pakkaus ja lähetys tehdään lukittuna, jotta sanomat
+      # lähtevät pakkausjärjestyksessä.
+      async with lukko:
+        pakattu = bytearray(merkki)
+        pakattu += pakkain.compress(raaka)
+        pakattu += pakkain.flush(sync_flush)
+        del pakattu[-len(loppu):]
+        _mittarit['pakkaus.raaka'] += len(raaka)
+        _mittarit['pakkaus.pakattu'] += len(pakattu)
+        mittarit.kasvata('pakkaus.raaka', len(raaka))
+        mittarit.kasvata('pakkaus.pakattu', len(pakattu))
+        return await send.__wrapped__(pakattu)
+      # async def send
     request.receive = receive
     request.send = send
+    receive_nowait = getattr(request, 'receive_nowait', None)
+    receive_many = getattr(request, 'receive_many', None)
+    if receive_nowait is not None:
+      @functools.wraps(receive_nowait)
+      def _receive_nowait():
+        return pura(receive_nowait())
+      request.receive_nowait = _receive_nowait
+    if receive_many is not None:
+      @functools.wraps(receive_many)
+      async def _receive_many(*args, **kwargs):
+        return [
+          pura(data)
+          for data in await receive_many(*args, **kwargs)
+        ]
+      request.receive_many = _receive_many
     try:
       return await self.__wrapped__(
         request, *args, **kwargs
@@ -84,27 +598,55 @@ class JsonLiikenne(Koriste):
     finally:
       request.receive = receive.__wrapped__
       request.send = send.__wrapped__
+      if receive_nowait is not None:
+        request.receive_nowait = receive_nowait
+      if receive_many is not None:
+        request.receive_many = receive_many
     # async def __call__
 
-  # class JsonLiikenne
+  # class Pakkaus
 
 
 class CsrfKattely(Koriste):
+  '''
+  Vaaditaan CSRF-avain yhteyden ensimmäisessä sanomassa.
+
+  Mikäli `kattelyn_aikakatkaisu` on annettu, eikä sanomaa saavu
+  tämän ajan (s) kuluessa, yhteys suljetaan (laskuri
+  `csrf.aikakatkaisu`).
+  '''
+
+  # Aika (s), jonka ensimmäistä sanomaa odotetaan (None: rajoittamaton).
+  kattelyn_aikakatkaisu: float = None
 
   def __init__(
     self,
     websocket, *,
     csrf_avain=None,
-    virhe_avain=None
+    virhe_avain=None,
+    kattelyn_aikakatkaisu=None,
   ):
     super().__init__(websocket)
     self.csrf_avain = csrf_avain
     self.virhe_avain = virhe_avain
+    if kattelyn_aikakatkaisu is not None:
+      self.kattelyn_aikakatkaisu = kattelyn_aikakatkaisu
     # def __init__
 
   async def __call__(self, request, *args, **kwargs):
     try:
-      kattely = await request.receive()
+      if self.kattelyn_aikakatkaisu is None:
+        kattely = await request.receive()
+      else:
+        kattely = await odota_enintaan(
+          request.receive(), self.kattelyn_aikakatkaisu
+        )
+    except asyncio.TimeoutError:
+      mittarit.kasvata('csrf.aikakatkaisu')
+      virhe = 'CSRF-kättely aikakatkaistiin!'
+      return await request.send({
+        self.virhe_avain: virhe
+      } if self.virhe_avain is not None else virhe)
     except ValueError:
       virhe = 'Yhteyden muodostus epäonnistui!'
       return await request.send({
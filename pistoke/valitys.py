@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+
+'''
+Ryhmäsanomien välitys prosessien ja palvelinten välillä.
+
+Ryhmälähetysten keskitin (`pistoke.ryhma.Keskitin`) jakaa sanoman oman
+prosessinsa jäsenille ja välittää sen liitoksen kautta muille
+prosesseille, jotka jakavat sen puolestaan omille jäsenilleen.
+
+Toteutukset:
+- `Muistivalitys`: saman prosessin keskittimet (esim. testaus);
+- `Verkkovalitys`: välittäjäprosessi (`Valittaja`) Unix-pistokkeen tai
+  TCP-yhteyden kautta.
+
+Välittäjä käynnistetään komennolla:
+  python -m pistoke.valitys unix:/tmp/pistoke.sock
+ja työprosessit liitetään siihen projektiasetuksella:
+  PISTOKE_RYHMAVALITYS = 'unix:/tmp/pistoke.sock'
+
+Yhteydellä sanomat välitetään erinä: kaikki saman tapahtumasilmukan
+kierroksen aikana julkaistut sanomat kirjoitetaan yhtenä eränä, jonka
+välittäjä edelleenlähettää sellaisenaan purkamatta sitä.
+'''
+
+import asyncio
+import logging
+import struct
+import sys
+
+from . import mittarit
+
+
+loki = logging.getLogger('django.' + __name__)
+
+# Erän otsake: sisällön pituus.
+_ERA = struct.Struct('>I')
+
+# Sanoman otsake: ryhmän nimen pituus, tyyppi (0: teksti, 1: tavujono)
+# ja datan pituus.
+_SANOMA = struct.Struct('>HBI')
+
+
+def _koodaa(puskuri, ryhma, data):
+  ''' Lisää sanoma puskuriin. '''
+  nimi = ryhma.encode('utf-8')
+  if isinstance(data, str):
+    tyyppi, data = 0, data.encode('utf-8')
+  else:
+    tyyppi = 1
+  puskuri += _SANOMA.pack(len(nimi), tyyppi, len(data))
+  puskuri += nimi
+  puskuri += data
+  # def _koodaa
+
+
+def _pura(era):
+  ''' Pura erän sanomat (ryhmä, data). '''
+  era = memoryview(era)
+  alku, loppu = 0, len(era)
+  while alku < loppu:
+    nimen_pituus, tyyppi, pituus = _SANOMA.unpack_from(era, alku)
+    alku += _SANOMA.size
+    ryhma = str(era[alku:alku + nimen_pituus], 'utf-8')
+    alku += nimen_pituus
+    data = era[alku:alku + pituus]
+    alku += pituus
+    yield ryhma, str(data, 'utf-8') if tyyppi == 0 else bytes(data)
+  # def _pura
+
+
+async def _avaa_yhteys(osoite):
+  ''' Avaa yhteys osoitteeseen `unix:/polku` tai `[tcp:]kone:portti`. '''
+  if osoite.startswith('unix:'):
+    return await asyncio.open_unix_connection(osoite[5:])
+  kone, __, portti = osoite.rpartition(':')
+  return await asyncio.open_connection(
+    kone.split('tcp:', 1)[-1] or None, int(portti)
+  )
+  # async def _avaa_yhteys
+
+
+class Ryhmavalitys:
+  '''
+  Ryhmäsanomien välityksen rajapinta.
+
+  `liita(vastaanota)` liittää keskittimen välitykseen ja palauttaa
+  liitoksen, jonka metodi `julkaise(ryhma, data)` välittää sanoman
+  muille liitoksille. Nämä kutsuvat kukin omaa
+  `vastaanota(ryhma, data)`-funktiotaan. `julkaise` ei odota.
+  '''
+
+  def liita(self, vastaanota):
+    ''' Liitä vastaanottaja; palauta liitos. '''
+    raise NotImplementedError
+
+  def julkaise(self, ryhma, data):
+    ''' Välitä sanoma muille liitoksille. '''
+    raise NotImplementedError
+
+  async def sulje(self):
+    ''' Sulje välitys. '''
+
+  # class Ryhmavalitys
+
+
+class _Muistiliitos(Ryhmavalitys):
+
+  def __init__(self, valitys, vastaanota):
+    self.valitys = valitys
+    self.vastaanota = vastaanota
+    # def __init__
+
+  def julkaise(self, ryhma, data):
+    for liitos in self.valitys.liitokset:
+      if liitos is not self:
+        liitos.vastaanota(ryhma, data)
+    # def julkaise
+
+  async def sulje(self):
+    self.valitys.liitokset.remove(self)
+    # async def sulje
+
+  # class _Muistiliitos
+
+
+class Muistivalitys(Ryhmavalitys):
+  ''' Välitys saman prosessin keskittimien kesken. '''
+
+  def __init__(self):
+    self.liitokset = []
+    # def __init__
+
+  def liita(self, vastaanota):
+    liitos = _Muistiliitos(self, vastaanota)
+    self.liitokset.append(liitos)
+    return liitos
+    # def liita
+
+  # class Muistivalitys
+
+
+class Verkkovalitys(Ryhmavalitys):
+  '''
+  Välitys välittäjäprosessin (`Valittaja`) kautta.
+
+  Yhteys avataan ensimmäisen julkaisun tai liitoksen yhteydessä, ja se
+  muodostetaan katkettuaan uudelleen `uudelleenyhteys` sekunnin
+  kuluttua. Julkaistut sanomat kootaan puskuriin ja kirjoitetaan
+  tapahtumasilmukan kierroksen lopuksi yhtenä eränä (`koonti=False`:
+  kukin sanoma erikseen). Mikäli kirjoittamatonta dataa on yli
+  `puskuri_enintaan` tavua, sanoma hylätään (laskuri
+  `valitys.pudotettu`).
+
+  Virheellisen saapuvan erän loppuosa hylätään (laskuri
+  `valitys.virheellinen`); vastaanottajan nostama poikkeus kirjataan
+  lokiin. Kumpikaan ei katkaise yhteyttä.
+  '''
+  # pylint: disable=too-many-instance-attributes
+
+  puskuri_enintaan: int = 4 * 1024 * 1024
+  uudelleenyhteys: float = 1.0
+
+  def __init__(self, osoite, *, koonti=True):
+    self.osoite = osoite
+    self.koonti = koonti
+    self.vastaanota = None
+    self._puskuri = bytearray()
+    self._ajastettu = False
+    self._kirjoittaja = None
+    self._tehtava = None
+    # def __init__
+
+  def liita(self, vastaanota):
+    if self.vastaanota is not None:
+      raise RuntimeError('Välitys on jo liitetty.')
+    self.vastaanota = vastaanota
+    self._kaynnista()
+    return self
+    # def liita
+
+  def _kaynnista(self):
+    if self._tehtava is None:
+      try:
+        silmukka = asyncio.get_running_loop()
+      except RuntimeError:
+        return
+      self._tehtava = silmukka.create_task(self._yhteys())
+    # def _kaynnista
+
+  async def _yhteys(self):
+    ''' Ylläpidä yhteyttä välittäjään ja vastaanota saapuvat erät. '''
+    while True:
+      try:
+        lukija, kirjoittaja = await _avaa_yhteys(self.osoite)
+      except OSError:
+        await asyncio.sleep(self.uudelleenyhteys)
+        continue
+      self._kirjoittaja = kirjoittaja
+      self._kirjoita()
+      try:
+        while True:
+          pituus, = _ERA.unpack(await lukija.readexactly(_ERA.size))
+          era = await lukija.readexactly(pituus)
+          mittarit.kasvata('valitys.vastaanotettu')
+          if self.vastaanota is not None:
+            self._jaa(era)
+      except (asyncio.IncompleteReadError, OSError):
+        pass
+      finally:
+        self._kirjoittaja = None
+        kirjoittaja.close()
+      await asyncio.sleep(self.uudelleenyhteys)
+      # while True
+    # async def _yhteys
+
+  def _jaa(self, era):
+    ''' Välitä erän sanomat vastaanottajalle. '''
+    try:
+      for ryhma, data in _pura(era):
+        try:
+          self.vastaanota(ryhma, data)
+        except Exception:  # pylint: disable=broad-except
+          loki.exception(
+            'Ryhmän %r sanoman vastaanotto päättyi poikkeukseen.', ryhma
+          )
+    except (struct.error, UnicodeDecodeError):
+      mittarit.kasvata('valitys.virheellinen')
+      loki.warning('Virheellinen erä (%d tavua) hylättiin.', len(era))
+    # def _jaa
+
+  def julkaise(self, ryhma, data):
+    self._kaynnista()
+    kirjoittaja = self._kirjoittaja
+    if len(self._puskuri) + (
+      kirjoittaja.transport.get_write_buffer_size()
+      if kirjoittaja is not None else 0
+    ) > self.puskuri_enintaan:
+      mittarit.kasvata('valitys.pudotettu')
+      return
+    _koodaa(self._puskuri, ryhma, data)
+    if not self.koonti:
+      self._kirjoita()
+    elif not self._ajastettu and kirjoittaja is not None:
+      self._ajastettu = True
+      asyncio.get_running_loop().call_soon(self._kirjoita)
+    # def julkaise
+
+  def _kirjoita(self):
+    ''' Kirjoita puskuroidut sanomat yhtenä eränä. '''
+    self._ajastettu = False
+    puskuri, kirjoittaja = self._puskuri, self._kirjoittaja
+    if not puskuri or kirjoittaja is None:
+      return
+    self._puskuri = bytearray()
+    kirjoittaja.write(_ERA.pack(len(puskuri)))
+    kirjoittaja.write(puskuri)
+    mittarit.kasvata('valitys.lahetetty')
+    # def _kirjoita
+
+  async def sulje(self):
+    if self._tehtava is not None:
+      self._tehtava.cancel()
+      try:
+        await self._tehtava
+      except asyncio.CancelledError:
+        pass
+      self._tehtava = None
+    # async def sulje
+
+  # class Verkkovalitys
+
+
+class Valittaja:
+  '''
+  Välittäjäprosessi: välittää kultakin asiakkaalta saapuvat erät
+  sellaisenaan kaikille muille asiakkaille.
+
+  Asiakas, jonka kirjoittamatonta dataa on yli `puskuri_enintaan`
+  tavua, ohitetaan (laskuri `valitys.ohitettu`).
+  '''
+
+  puskuri_enintaan: int = 16 * 1024 * 1024
+
+  def __init__(self):
+    self.asiakkaat = set()
+    # def __init__
+
+  async def _asiakas(self, lukija, kirjoittaja):
+    asiakkaat = self.asiakkaat
+    asiakkaat.add(kirjoittaja)
+    try:
+      while True:
+        otsake = await lukija.readexactly(_ERA.size)
+        pituus, = _ERA.unpack(otsake)
+        era = await lukija.readexactly(pituus)
+        for muu in asiakkaat:
+          if muu is kirjoittaja:
+            continue
+          if muu.transport.get_write_buffer_size() > self.puskuri_enintaan:
+            mittarit.kasvata('valitys.ohitettu')
+            continue
+          muu.write(otsake)
+          muu.write(era)
+        # while True
+    except (asyncio.IncompleteReadError, ConnectionError):
+      pass
+    finally:
+      asiakkaat.discard(kirjoittaja)
+      kirjoittaja.close()
+    # async def _asiakas
+
+  async def kaynnista(self, osoite):
+    '''
+    Käynnistä palvelin osoitteessa `unix:/polku` tai `[tcp:]kone:portti`.
+
+    Palauttaa `asyncio`-palvelimen.
+    '''
+    if osoite.startswith('unix:'):
+      return await asyncio.start_unix_server(self._asiakas, osoite[5:])
+    kone, __, portti = osoite.rpartition(':')
+    return await asyncio.start_server(
+      self._asiakas, kone.split('tcp:', 1)[-1] or None, int(portti)
+    )
+    # async def kaynnista
+
+  # class Valittaja
+
+
+def muodosta_valitys(arvo):
+  '''
+  Muodosta välitys annetun olion, luokan tai osoitteen mukaan.
+  '''
+  if isinstance(arvo, str):
+    return Verkkovalitys(arvo)
+  if isinstance(arvo, type):
+    return arvo()
+  return arvo
+  # def muodosta_valitys
+
+
+async def _palvele(osoite):
+  palvelin = await Valittaja().kaynnista(osoite)
+  async with palvelin:
+    await palvelin.serve_forever()
+  # async def _palvele
+
+
+if __name__ == '__main__':
+  try:
+    asyncio.run(_palvele(sys.argv[1]))
+  except KeyboardInterrupt:
+    pass
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+
+from django.test.utils import override_settings
+from django.urls import path
+
+from pistoke.etakutsu import Etakutsu, EtakutsuVirhe
+from pistoke.testaus import WebsocketTesti
+
+
+###############
+#
+# TESTINÄKYMÄT.
+
+rpc = Etakutsu(rinnakkain=2, kesken_enintaan=3)
+vapauta = None
+
+
+@rpc.metodi
+async def summa(request, a, b):
+  return a + b
+
+
+@rpc.metodi(nimi='odota')
+async def _odota(request):
+  await vapauta.wait()
+  return 'valmis'
+
+
+@rpc.metodi
+def kertolasku(request, a, b):
+  return a * b
+
+
+@rpc.metodi
+async def virhe(request):
+  raise EtakutsuVirhe(1, 'Virhe', data={'syy': 'testi'})
+
+
+urlpatterns = [path('rpc/', rpc)]
+
+
+def _kutsu(tunnus, metodi, *args, **kwargs):
+  kutsu = {'jsonrpc': '2.0', 'method': metodi, 'params': kwargs or args}
+  if tunnus is not None:
+    kutsu['id'] = tunnus
+  return json.dumps(kutsu)
+
+
+###############
+# TESTIMETODIT.
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Etakutsut(WebsocketTesti):
+
+  async def _vastaus(self, websocket):
+    return json.loads(await websocket.receive())
+
+  async def testaa_kutsut(self):
+    ''' Ohjataanko kutsut metodeille ja vastataanko tunnuksella? '''
+    async with self.async_client.websocket('/rpc/') as websocket:
+      await websocket.send(_kutsu(1, 'summa', 1, 2))
+      self.assertEqual(
+        await self._vastaus(websocket),
+        {'jsonrpc': '2.0', 'id': 1, 'result': 3},
+      )
+      await websocket.send(_kutsu('k', 'kertolasku', a=3, b=4))
+      self.assertEqual((await self._vastaus(websocket))['result'], 12)
+      await websocket.send(_kutsu(2, 'virhe'))
+      self.assertEqual((await self._vastaus(websocket))['error'], {
+        'code': 1, 'message': 'Virhe', 'data': {'syy': 'testi'},
+      })
+      await websocket.send(_kutsu(3, 'tuntematon'))
+      self.assertEqual(
+        (await self._vastaus(websocket))['error']['code'], -32601
+      )
+      await websocket.send(_kutsu(4, 'summa', 1))
+      self.assertEqual(
+        (await self._vastaus(websocket))['error']['code'], -32602
+      )
+      await websocket.send('{')
+      self.assertEqual(
+        (await self._vastaus(websocket))['error']['code'], -32700
+      )
+      await websocket.send('[]')
+      self.assertEqual(
+        (await self._vastaus(websocket))['error']['code'], -32600
+      )
+      # Ilmoitukseen ei vastata.
+      await websocket.send(_kutsu(None, 'summa', 1, 2))
+      await websocket.send(_kutsu(5, 'summa', 2, 2))
+      self.assertEqual((await self._vastaus(websocket))['id'], 5)
+    # async def testaa_kutsut
+
+  async def testaa_rinnakkaisuus(self):
+    ''' Suoritetaanko kutsut rinnakkain ja voidaanko ne perua? '''
+    # Luodaan tapahtuma testin omassa tapahtumasilmukassa (Python 3.8).
+    global vapauta  # pylint: disable=global-statement
+    vapauta = asyncio.Event()
+    async with self.async_client.websocket('/rpc/') as websocket:
+      await websocket.send(_kutsu(1, 'odota'))
+      await websocket.send(_kutsu(2, 'summa', 1, 1))
+      # Hidas kutsu ei viivästytä myöhempää kutsua.
+      self.assertEqual(await self._vastaus(websocket), {
+        'jsonrpc': '2.0', 'id': 2, 'result': 2,
+      })
+      await websocket.send(_kutsu(3, 'odota'))
+      await websocket.send(_kutsu(4, 'odota'))
+      await websocket.send(_kutsu(5, 'odota'))
+      # Keskeneräisten kutsujen enimmäismäärä ylittyy.
+      self.assertEqual(await self._vastaus(websocket), {
+        'jsonrpc': '2.0', 'id': 5, 'error': {
+          'code': -32000, 'message': 'Liian monta keskeneräistä kutsua.',
+        },
+      })
+      await websocket.send(_kutsu(None, '$/cancelRequest', id=4))
+      self.assertEqual(await self._vastaus(websocket), {
+        'jsonrpc': '2.0', 'id': 4, 'error': {
+          'code': -32800, 'message': 'Kutsu peruttu.',
+        },
+      })
+      vapauta.set()
+      self.assertEqual(
+        sorted([
+          (await self._vastaus(websocket))['id'],
+          (await self._vastaus(websocket))['id'],
+        ]),
+        [1, 3],
+      )
+    # async def testaa_rinnakkaisuus
+
+  # class Etakutsut
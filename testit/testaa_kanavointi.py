@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import struct
+
+from django.test.utils import override_settings
+from django.urls import path
+
+from pistoke.kanavointi import Kanavointi
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.pyynto import WebsocketPyynto
+from pistoke.testaus import WebsocketTesti
+from pistoke.tyokalut import JsonLiikenne, OriginPoikkeus, Yhteysraja
+
+
+###############
+#
+# TESTINÄKYMÄT.
+
+@WebsocketProtokolla
+async def kaiku(request):
+  async for data in request:
+    await request.send(data)
+
+
+@WebsocketProtokolla
+@JsonLiikenne
+async def tervehdys(request, nimi):
+  await request.send({
+    'nimi': nimi,
+    'kieli': request.GET.get('kieli'),
+    'kayttaja': request.user.is_anonymous,
+    'istunto': hasattr(request, 'session'),
+  })
+
+
+@WebsocketProtokolla(syotejono_enintaan=1)
+async def hidas(request):
+  await asyncio.sleep(0.1)
+
+
+@Yhteysraja(1)
+@WebsocketProtokolla
+async def rajattu(request):
+  await request.send(await request.receive())
+
+
+urlpatterns = [
+  path('kanavointi/', Kanavointi(virtoja_enintaan=2)),
+  path('kanavointi_origin/', OriginPoikkeus(Kanavointi())),
+  path('rajattu/', rajattu),
+  path('kanavointi_rajattu/', Kanavointi(virran_syote_enintaan=2)),
+  path('kaiku/', kaiku),
+  path('hidas/', hidas),
+  path('tervehdys/<str:nimi>/', tervehdys),
+]
+
+
+def _ohjaus(**kwargs):
+  return '0:' + json.dumps(kwargs)
+
+
+async def _katkaisukoodi(data):
+  ''' Lähetä kehys kanavointinäkymälle; palauta yhteyden katkaisukoodi. '''
+  syote = asyncio.Queue()
+  syote.put_nowait({'type': 'websocket.connect'})
+  syote.put_nowait({
+    'type': 'websocket.receive',
+    'text' if isinstance(data, str) else 'bytes': data,
+  })
+  tuloste = []
+  async def send(sanoma):
+    tuloste.append(sanoma)
+    if sanoma['type'] == 'websocket.close':
+      syote.put_nowait({'type': 'websocket.disconnect'})
+  await asyncio.wait_for(Kanavointi()(WebsocketPyynto(
+    {'type': 'websocket', 'path': '/'}, syote.get, send
+  )), timeout=1.0)
+  return tuloste[-1].get('code')
+  # async def _katkaisukoodi
+
+
+###############
+# TESTIMETODIT.
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Kanavointi_(WebsocketTesti):
+
+  async def testaa_virrat(self):
+    ''' Välitetäänkö virtojen sanomat oikeille näkymille? '''
+    async with self.async_client.websocket('/kanavointi/') as websocket:
+      await websocket.send(_ohjaus(avaa=1, polku='/kaiku/'))
+      self.assertEqual(await websocket.receive(), _ohjaus(avattu=1))
+      await websocket.send(
+        _ohjaus(avaa=2, polku='/tervehdys/maailma/?kieli=fi')
+      )
+      self.assertEqual(await websocket.receive(), _ohjaus(avattu=2))
+      self.assertEqual(json.loads(
+        (await websocket.receive()).partition('2:')[2]
+      ), {
+        'nimi': 'maailma', 'kieli': 'fi',
+        'kayttaja': True, 'istunto': True,
+      })
+      # Tervehdysnäkymä päättyy ja sulkee virtansa.
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=2, koodi=1000)
+      )
+
+      await websocket.send('1:hei')
+      self.assertEqual(await websocket.receive(), '1:hei')
+      await websocket.send(struct.pack('>I', 1) + b'\x00\x01')
+      self.assertEqual(
+        await websocket.receive(), struct.pack('>I', 1) + b'\x00\x01'
+      )
+      await websocket.send(_ohjaus(sulje=1))
+    # async def testaa_virrat
+
+  async def testaa_hylkays(self):
+    ''' Hylätäänkö tuntematon polku ja enimmäismäärän ylitys? '''
+    async with self.async_client.websocket('/kanavointi/') as websocket:
+      await websocket.send(_ohjaus(avaa=1, polku='/tuntematon/'))
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=1, koodi=1008)
+      )
+      for tunnus in (1, 2):
+        await websocket.send(_ohjaus(avaa=tunnus, polku='/kaiku/'))
+        self.assertEqual(
+          await websocket.receive(), _ohjaus(avattu=tunnus)
+        )
+      await websocket.send(_ohjaus(avaa=3, polku='/kaiku/'))
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=3, koodi=1013)
+      )
+    # async def testaa_hylkays
+
+  async def testaa_virheelliset_kehykset(self):
+    ''' Suljetaanko yhteys virheellisen kehyksen vuoksi? '''
+    for data, koodi in (
+      ('x:hei', 1007),
+      ('0:{', 1007),
+      (b'\x00\x01', 1007),
+      ('0:[1, 2]', 1008),
+      ('0:"avaa"', 1008),
+      (_ohjaus(avaa=1), 1008),
+      (_ohjaus(avaa=1, polku=None), 1008),
+      (_ohjaus(avaa='x', polku='/kaiku/'), 1008),
+      (_ohjaus(sulje=None), 1008),
+      (struct.pack('>I', 0) + b'x', 1008),
+    ):
+      with self.subTest(data=data):
+        self.assertEqual(await _katkaisukoodi(data), koodi)
+    # async def testaa_virheelliset_kehykset
+
+  async def testaa_kaytossa_oleva_virta(self):
+    ''' Hylätäänkö käytössä olevan virran avaus sulkematta virtaa? '''
+    async with self.async_client.websocket('/kanavointi/') as websocket:
+      await websocket.send(_ohjaus(avaa=1, polku='/kaiku/'))
+      self.assertEqual(await websocket.receive(), _ohjaus(avattu=1))
+      await websocket.send(_ohjaus(avaa=1, polku='/kaiku/'))
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(hylatty=1, koodi=1008)
+      )
+      await websocket.send('1:hei')
+      self.assertEqual(await websocket.receive(), '1:hei')
+      await websocket.send(_ohjaus(sulje=1))
+    # async def testaa_kaytossa_oleva_virta
+
+  async def testaa_virran_ylivuoto(self):
+    ''' Suljetaanko syötettään lukematon virta? '''
+    async with self.async_client.websocket(
+      '/kanavointi_rajattu/'
+    ) as websocket:
+      await websocket.send(_ohjaus(avaa=1, polku='/hidas/'))
+      self.assertEqual(await websocket.receive(), _ohjaus(avattu=1))
+      for __ in range(10):
+        await websocket.send('1:x')
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=1, koodi=1008)
+      )
+    # async def testaa_virran_ylivuoto
+
+  async def testaa_virran_numero(self):
+    ''' Hylätäänkö uint32-alueen ulkopuolinen virran numero? '''
+    async with self.async_client.websocket('/kanavointi/') as websocket:
+      await websocket.send(_ohjaus(avaa=1 << 32, polku='/kaiku/'))
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(hylatty=1 << 32, koodi=1008)
+      )
+    # async def testaa_virran_numero
+
+  async def testaa_sisakkainen_kanavointi(self):
+    ''' Hylätäänkö kanavointinäkymään ohjautuva virta? '''
+    async with self.async_client.websocket('/kanavointi/') as websocket:
+      for polku in ('/kanavointi/', '/kanavointi_origin/'):
+        await websocket.send(_ohjaus(avaa=1, polku=polku))
+        self.assertEqual(
+          await websocket.receive(), _ohjaus(suljettu=1, koodi=1008)
+        )
+    # async def testaa_sisakkainen_kanavointi
+
+  async def testaa_yhteysraja(self):
+    ''' Sovelletaanko näkymän yhteysrajaa virtoihin? '''
+    async with self.async_client.websocket('/kanavointi/') as websocket:
+      await websocket.send(_ohjaus(avaa=1, polku='/rajattu/'))
+      self.assertEqual(await websocket.receive(), _ohjaus(avattu=1))
+      await websocket.send(_ohjaus(avaa=2, polku='/rajattu/'))
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=2, koodi=1013)
+      )
+      # Virran päätyttyä raja vapautuu.
+      await websocket.send('1:hei')
+      self.assertEqual(await websocket.receive(), '1:hei')
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=1, koodi=1000)
+      )
+      await websocket.send(_ohjaus(avaa=3, polku='/rajattu/'))
+      self.assertEqual(await websocket.receive(), _ohjaus(avattu=3))
+      await websocket.send(_ohjaus(sulje=3))
+    # async def testaa_yhteysraja
+
+  @override_settings(MIDDLEWARE=[
+    'pistoke.ohjain.OriginVaatimus',
+    'pistoke.ohjain.WebsocketOhjain',
+  ])
+  async def testaa_nakymaohjaimet(self):
+    ''' Ajetaanko ohjainten `process_view`-vaihe kullekin virralle? '''
+    async with self.async_client.websocket(
+      '/kanavointi_origin/', origin='http://vieras.example'
+    ) as websocket:
+      await websocket.send(_ohjaus(avaa=1, polku='/kaiku/'))
+      self.assertEqual(
+        await websocket.receive(), _ohjaus(suljettu=1, koodi=1008)
+      )
+    # async def testaa_nakymaohjaimet
+
+  # class Kanavointi_
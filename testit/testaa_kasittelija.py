@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+
+from django.core.signals import request_finished, request_started
+from django.test.utils import override_settings
+from django.urls import clear_url_caches, get_resolver, path
+from django.utils.decorators import method_decorator
+
+from pistoke import kasittelija, mittarit
+from pistoke.nakyma import WebsocketNakyma
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.testaus import WebsocketTesti
+from pistoke.tyokalut import Yhteysraja
+
+
+###############
+#
+# TESTINÄKYMÄT.
+
+urlpatterns = []
+def _testinakyma(nakyma):
+  urlpatterns.append(
+    path(
+      nakyma.__name__.lower() + '/',
+      nakyma.as_view() if isinstance(nakyma, type) else nakyma
+    )
+  )
+  return nakyma
+
+
+@_testinakyma
+@WebsocketProtokolla
+async def kaiku(request):
+  await request.send(await request.receive())
+
+
+@_testinakyma
+@Yhteysraja(1)
+@WebsocketProtokolla
+async def rajattu(request):
+  await request.send(await request.receive())
+
+
+@_testinakyma
+@method_decorator(Yhteysraja(1), name='websocket')
+@method_decorator(WebsocketProtokolla, name='websocket')
+class Rajattu_LK(WebsocketNakyma):
+  async def websocket(self, request):
+    await request.send(await request.receive())
+
+
+async def _yhteys(_kasittelija, polku):
+  '''
+  Avaa yhteys käsittelijään ilman testipäätettä.
+
+  Palauttaa syöte- ja tulostejonot sekä yhteyttä käsittelevän tehtävän.
+  '''
+  syote, tuloste = asyncio.Queue(), asyncio.Queue()
+  await syote.put({'type': 'websocket.connect'})
+  async def send(sanoma):
+    # Kuitataan palvelimen lähettämä katkaisu.
+    if sanoma['type'] == 'websocket.close':
+      syote.put_nowait({'type': 'websocket.disconnect'})
+    await tuloste.put(sanoma)
+  return syote, tuloste, asyncio.create_task(_kasittelija(
+    {
+      'type': 'websocket',
+      'path': polku,
+      'headers': [(b'host', b'testserver')],
+    },
+    syote.get,
+    send,
+  ))
+  # async def _yhteys
+
+
+###############
+# TESTIMETODIT.
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Signaalit(WebsocketTesti):
+
+  async def testaa_asynkroninen_vastaanottaja(self):
+    ''' Suoritetaanko asynkroninen vastaanottaja tapahtumasilmukassa? '''
+    saikeet = []
+    async def vastaanottaja(**kwargs):
+      saikeet.append(threading.current_thread())
+    request_started.connect(vastaanottaja)
+    request_finished.connect(vastaanottaja)
+    try:
+      async with self.async_client.websocket('/kaiku/') as websocket:
+        await websocket.send('data')
+        self.assertEqual(await websocket.receive(), 'data')
+    finally:
+      request_started.disconnect(vastaanottaja)
+      request_finished.disconnect(vastaanottaja)
+    self.assertEqual(saikeet, [threading.current_thread()] * 2)
+    # async def testaa_asynkroninen_vastaanottaja
+
+  async def testaa_synkroninen_vastaanottaja(self):
+    ''' Suoritetaanko synkroninen vastaanottaja erillisessä säikeessä? '''
+    saikeet = []
+    def vastaanottaja(**kwargs):
+      saikeet.append(threading.current_thread())
+    request_started.connect(vastaanottaja)
+    try:
+      async with self.async_client.websocket('/kaiku/') as websocket:
+        await websocket.send('data')
+        self.assertEqual(await websocket.receive(), 'data')
+    finally:
+      request_started.disconnect(vastaanottaja)
+    self.assertEqual(len(saikeet), 1)
+    self.assertNotEqual(saikeet[0], threading.current_thread())
+    # async def testaa_synkroninen_vastaanottaja
+
+  async def testaa_koottu_kutsu(self):
+    ''' Kootaanko samanaikaiset ylläpitokutsut yhdeksi suoritukseksi? '''
+    kutsut = []
+    def vastaanottaja(**kwargs):
+      kutsut.append(kwargs)
+    await asyncio.gather(*(
+      kasittelija._kokoa((vastaanottaja, ), request_started, sender=None)
+      for __ in range(10)
+    ))
+    self.assertEqual(len(kutsut), 1)
+    # async def testaa_koottu_kutsu
+
+  # class Signaalit
+
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Reititys(WebsocketTesti):
+
+  async def testaa_valimuisti(self):
+    ''' Ratkaistaanko toistuva polku välimuistista? '''
+    kasittelija.ratkaise_reitti.cache_clear()
+    for __ in range(3):
+      async with self.async_client.websocket('/kaiku/') as websocket:
+        await websocket.send('data')
+        self.assertEqual(await websocket.receive(), 'data')
+    tilasto = kasittelija.ratkaise_reitti.cache_info()
+    self.assertEqual(tilasto.misses, 1)
+    self.assertGreaterEqual(tilasto.hits, 2)
+    # async def testaa_valimuisti
+
+  def testaa_tyhjennys(self):
+    ''' Tyhjennetäänkö välimuisti `ROOT_URLCONF`-asetuksen muuttuessa? '''
+    kasittelija.ratkaise_reitti(__name__, '/kaiku/')
+    self.assertEqual(kasittelija.ratkaise_reitti.cache_info().currsize, 1)
+    with override_settings(ROOT_URLCONF='testit.testaa_funktio'):
+      self.assertEqual(kasittelija.ratkaise_reitti.cache_info().currsize, 0)
+    # def testaa_tyhjennys
+
+  # class Reititys
+
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Yhteysrajat(WebsocketTesti):
+
+  async def _testaa_raja(self, _kasittelija, polku):
+    ''' Hyväksytäänkö ensimmäinen yhteys ja evätäänkö toinen? '''
+    hylatty = mittarit.laskurit['yhteys.hylatty']
+    syote1, tuloste1, yhteys1 = await _yhteys(_kasittelija, polku)
+    self.assertEqual(await tuloste1.get(), {'type': 'websocket.accept'})
+
+    syote2, tuloste2, yhteys2 = await _yhteys(_kasittelija, polku)
+    self.assertEqual(await tuloste2.get(), {'type': 'websocket.close'})
+    await yhteys2
+    self.assertEqual(mittarit.laskurit['yhteys.hylatty'], hylatty + 1)
+
+    await syote1.put({'type': 'websocket.disconnect'})
+    await yhteys1
+    self.assertEqual(_kasittelija.yhteyksia, 0)
+    # async def _testaa_raja
+
+  async def testaa_kasittelijan_raja(self):
+    ''' Evätäänkö käsittelijän enimmäismäärän ylittävä yhteys? '''
+    with override_settings(PISTOKE_YHTEYKSIA_ENINTAAN=1):
+      _kasittelija = kasittelija.WebsocketKasittelija()
+    await self._testaa_raja(_kasittelija, '/kaiku/')
+    # async def testaa_kasittelijan_raja
+
+  async def testaa_nakyman_raja(self):
+    ''' Evätäänkö näkymän enimmäismäärän ylittävä yhteys? '''
+    _kasittelija = kasittelija.WebsocketKasittelija()
+    await self._testaa_raja(_kasittelija, '/rajattu/')
+    await self._testaa_raja(_kasittelija, '/rajattu_lk/')
+    # async def testaa_nakyman_raja
+
+  # class Yhteysrajat
+
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Tyhjennys(WebsocketTesti):
+
+  async def testaa_tyhjennys(self):
+    ''' Suljetaanko avoimet yhteydet koodilla 1001? '''
+    _kasittelija = kasittelija.WebsocketKasittelija()
+    yhteydet = [await _yhteys(_kasittelija, '/kaiku/') for __ in range(3)]
+    for syote, tuloste, yhteys in yhteydet:
+      self.assertEqual(await tuloste.get(), {'type': 'websocket.accept'})
+    await _kasittelija.tyhjenna(aikakatkaisu=1.0, hajonta=0.05)
+    for syote, tuloste, yhteys in yhteydet:
+      self.assertEqual(
+        await tuloste.get(),
+        {'type': 'websocket.close', 'code': 1001}
+      )
+      self.assertTrue(yhteys.done())
+    self.assertEqual(_kasittelija.yhteyksia, 0)
+    # async def testaa_tyhjennys
+
+  async def testaa_elinkaari(self):
+    ''' Toteuttaako käsittelijä ASGI-elinkaariprotokollan? '''
+    _kasittelija = kasittelija.WebsocketKasittelija()
+    syote, tuloste = asyncio.Queue(), asyncio.Queue()
+    elinkaari = asyncio.create_task(_kasittelija.elinkaari(
+      {'type': 'lifespan'}, syote.get, tuloste.put
+    ))
+    await syote.put({'type': 'lifespan.startup'})
+    self.assertEqual(
+      await tuloste.get(), {'type': 'lifespan.startup.complete'}
+    )
+    await syote.put({'type': 'lifespan.shutdown'})
+    self.assertEqual(
+      await tuloste.get(), {'type': 'lifespan.shutdown.complete'}
+    )
+    await elinkaari
+    # async def testaa_elinkaari
+
+  async def testaa_elinkaaren_tyhjennys(self):
+    ''' Suljetaanko avoimet yhteydet elinkaaren sammutussanomalla? '''
+    _kasittelija = kasittelija.WebsocketKasittelija()
+    _kasittelija.tyhjennyksen_hajonta = 0.01
+    syote, tuloste = asyncio.Queue(), asyncio.Queue()
+    elinkaari = asyncio.create_task(_kasittelija.elinkaari(
+      {'type': 'lifespan'}, syote.get, tuloste.put
+    ))
+    await syote.put({'type': 'lifespan.startup'})
+    self.assertEqual(
+      await tuloste.get(), {'type': 'lifespan.startup.complete'}
+    )
+    __, yhteyden_tuloste, yhteys = await _yhteys(_kasittelija, '/kaiku/')
+    self.assertEqual(
+      await yhteyden_tuloste.get(), {'type': 'websocket.accept'}
+    )
+    await syote.put({'type': 'lifespan.shutdown'})
+    self.assertEqual(
+      await tuloste.get(), {'type': 'lifespan.shutdown.complete'}
+    )
+    self.assertEqual(
+      await yhteyden_tuloste.get(),
+      {'type': 'websocket.close', 'code': 1001}
+    )
+    self.assertTrue(yhteys.done())
+    await elinkaari
+    # async def testaa_elinkaaren_tyhjennys
+
+  async def testaa_lammitys(self):
+    ''' Muodostetaanko reititystaulu esilämmityksen yhteydessä? '''
+    clear_url_caches()
+    _kasittelija = kasittelija.WebsocketKasittelija()
+    # pylint: disable=protected-access
+    self.assertFalse(get_resolver()._populated)
+    await _kasittelija.lammita()
+    self.assertTrue(get_resolver()._populated)
+    # async def testaa_lammitys
+
+  # class Tyhjennys
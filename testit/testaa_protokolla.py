@@ -1,19 +1,26 @@
 # -*- coding: utf-8 -*-
 
+import array
+import asyncio
+
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.test import SimpleTestCase
+from django.utils.asyncio import async_unsafe
+from django.utils.functional import SimpleLazyObject
 from django.test.utils import override_settings
 from django.urls import path
 from django.utils.decorators import method_decorator
 from django import VERSION as django_versio
 
+from pistoke import mittarit
 from pistoke.nakyma import WebsocketNakyma
 from pistoke.protokolla import (
   WebsocketProtokolla,
   WebsocketAliprotokolla,
 )
+from pistoke.pyynto import WebsocketPyynto
 from pistoke.testaus import WebsocketPaate, WebsocketTesti
 
 
@@ -338,3 +345,614 @@ class WebsocketProtokollaTesti(WebsocketTesti, SimpleTestCase):
     # async def testaa_tyhja_aliprotokolla
 
   # class WebsocketProtokollaTesti
+
+
+async def _istunto(
+  nakyma, *sanomat, send=None, kuittaa=True, scope=None, maareet=None,
+):
+  '''
+  Aja näkymä ilman käsittelijää annetuilla saapuvilla sanomilla.
+
+  Palauttaa ASGI-syötejonon sekä listan lähteneistä sanomista.
+  Palvelimen lähettämä katkaisu kuitataan, mikäli `kuittaa` on tosi.
+  Pyynnön ASGI-määritykseen lisätään `scope` ja pyynnölle asetetaan
+  määreet `maareet` (esim. ohjainten asettama `user`).
+  '''
+  syote, tuloste = asyncio.Queue(), []
+  syote.put_nowait({'type': 'websocket.connect'})
+  for sanoma in sanomat:
+    syote.put_nowait({'type': 'websocket.receive', 'text': sanoma})
+  async def _send(sanoma):
+    if send is not None:
+      await send(sanoma)
+    if kuittaa and sanoma['type'] == 'websocket.close':
+      syote.put_nowait({'type': 'websocket.disconnect'})
+    tuloste.append(sanoma)
+  request = WebsocketPyynto(
+    {'type': 'websocket', 'path': '/', **(scope or {})}, syote.get, _send
+  )
+  for nimi, arvo in (maareet or {}).items():
+    setattr(request, nimi, arvo)
+  await nakyma(request)
+  return syote, tuloste
+  # async def _istunto
+
+
+class Syotejono(SimpleTestCase):
+  ''' Rajoitetun syötejonon ylivuototoiminnot. '''
+
+  async def testaa_odota(self):
+    ''' Keskeytetäänkö lukeminen, kun syötejono on täynnä? '''
+    @WebsocketProtokolla(syotejono_enintaan=1)
+    async def nakyma(request):
+      while request.mittarit['syote.jonossa'] < 1:
+        await asyncio.sleep(0)
+      for __ in range(10):
+        await asyncio.sleep(0)
+      await request.send(str(request.mittarit['syote.enimmillaan']))
+      await request.send(','.join([
+        await request.receive() for __ in range(3)
+      ]))
+    syote, tuloste = await _istunto(nakyma, 'a', 'b', 'c')
+    self.assertEqual(
+      [s.get('text') for s in tuloste[1:3]], ['1', 'a,b,c']
+    )
+    self.assertTrue(syote.empty())
+    # async def testaa_odota
+
+  async def testaa_pudota(self):
+    ''' Pudotetaanko vanhimmat sanomat jonon täyttyessä? '''
+    @WebsocketProtokolla(syotejono_enintaan=2, syotejonon_ylivuoto='pudota')
+    async def nakyma(request):
+      while request.mittarit['syote.pudotettu'] < 3:
+        await asyncio.sleep(0)
+      await request.send(','.join([
+        await request.receive() for __ in range(2)
+      ]))
+    __, tuloste = await _istunto(nakyma, 'a', 'b', 'c', 'd', 'e')
+    self.assertEqual(tuloste[1].get('text'), 'd,e')
+    # async def testaa_pudota
+
+  async def testaa_sulje(self):
+    ''' Suljetaanko yhteys koodilla 1008 jonon täyttyessä? '''
+    @WebsocketProtokolla(syotejono_enintaan=1, syotejonon_ylivuoto='sulje')
+    async def nakyma(request):
+      await asyncio.Future()
+    __, tuloste = await _istunto(nakyma, 'a', 'b')
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1008}
+    )
+    # async def testaa_sulje
+
+  async def testaa_ylisuuri_sanoma(self):
+    ''' Suljetaanko yhteys koodilla 1009 ylisuuren sanoman saapuessa? '''
+    ylisuuria = mittarit.laskurit['syote.liian_suuri']
+    @WebsocketProtokolla(saapuvan_koko_enintaan=3)
+    async def nakyma(request):
+      self.assertEqual(await request.receive(), 'abc')
+      await asyncio.Future()
+    __, tuloste = await _istunto(nakyma, 'abc', 'abcd')
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1009}
+    )
+    self.assertEqual(mittarit.laskurit['syote.liian_suuri'], ylisuuria + 1)
+    # async def testaa_ylisuuri_sanoma
+
+  async def testaa_tavuja_enintaan(self):
+    ''' Suljetaanko yhteys, kun syötejonon koko ylittää rajan? '''
+    ylivuotoja = mittarit.laskurit['syote.tavuylivuoto']
+    @WebsocketProtokolla(syotejono_tavuja_enintaan=5)
+    async def nakyma(request):
+      await asyncio.Future()
+    __, tuloste = await _istunto(nakyma, 'abc', 'de', 'f')
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1009}
+    )
+    self.assertEqual(
+      mittarit.laskurit['syote.tavuylivuoto'], ylivuotoja + 1
+    )
+
+    # Luetut sanomat vapauttavat tilaa jonosta.
+    @WebsocketProtokolla(syotejono_enintaan=1, syotejono_tavuja_enintaan=5)
+    async def nakyma(request):
+      await request.send(''.join([
+        await request.receive() for __ in range(4)
+      ]))
+    __, tuloste = await _istunto(nakyma, 'abc', 'de', 'fgh', 'i')
+    self.assertEqual(tuloste[1].get('text'), 'abcdefghi')
+    self.assertEqual(tuloste[-1], {'type': 'websocket.close'})
+    # async def testaa_tavuja_enintaan
+
+  @override_settings(PISTOKE_SAAPUVAN_KOKO_ENINTAAN=3)
+  async def testaa_projektiasetus(self):
+    ''' Käytetäänkö projektiasetuksen mukaista oletusrajaa? '''
+    @WebsocketProtokolla
+    async def nakyma(request):
+      await asyncio.Future()
+    __, tuloste = await _istunto(nakyma, 'abcd')
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1009}
+    )
+    # async def testaa_projektiasetus
+
+  async def testaa_molemmat_avaimet(self):
+    ''' Hyväksytäänkö sanoma, jossa on sekä `text`- että `bytes`-avain? '''
+    @WebsocketProtokolla(syotejono_tavuja_enintaan=100)
+    async def nakyma(request):
+      await request.send(await request.receive())
+      await request.send(await request.receive())
+    syote = asyncio.Queue()
+    for sanoma in (
+      {'type': 'websocket.connect'},
+      {'type': 'websocket.receive', 'bytes': b'abc', 'text': None},
+      {'type': 'websocket.receive', 'bytes': None, 'text': 'def'},
+    ):
+      syote.put_nowait(sanoma)
+    tuloste = []
+    async def send(sanoma):
+      tuloste.append(sanoma)
+      if sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    await asyncio.wait_for(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )), timeout=1.0)
+    self.assertEqual(tuloste[1].get('bytes'), b'abc')
+    self.assertEqual(tuloste[2].get('text'), 'def')
+    # async def testaa_molemmat_avaimet
+
+  def testaa_virheellinen_toiminta(self):
+    ''' Hylätäänkö tuntematon ylivuototoiminta? '''
+    with self.assertRaises(ValueError):
+      @WebsocketProtokolla(syotejonon_ylivuoto='ohita')
+      async def nakyma(request):
+        pass
+    # def testaa_virheellinen_toiminta
+
+  def testaa_parametrit(self):
+    ''' Asetetaanko annetut parametrit ja hylätäänkö tuntemattomat? '''
+    @WebsocketProtokolla(syotejono_enintaan=5, lahtevia_enintaan=None)
+    async def nakyma(request):
+      pass
+    self.assertEqual(nakyma.syotejono_enintaan, 5)
+    self.assertIsNone(nakyma.lahtevia_enintaan)
+    self.assertEqual(WebsocketProtokolla.syotejono_enintaan, 0)
+    with self.assertRaises(TypeError):
+      @WebsocketProtokolla(syotejono=5)
+      async def nakyma2(request):
+        pass
+    # def testaa_parametrit
+
+  # class Syotejono
+
+
+class Saapuvienrajoitus(SimpleTestCase):
+  ''' Saapuvien sanomien kiintiö. '''
+
+  async def testaa_odota(self):
+    ''' Viivästetäänkö kiintiön ylittävät sanomat? '''
+    @WebsocketProtokolla(saapuvia_sekunnissa=100, saapuvia_kerralla=2)
+    async def nakyma(request):
+      alku = asyncio.get_running_loop().time()
+      sanomat = [await request.receive() for __ in range(6)]
+      kesto = asyncio.get_running_loop().time() - alku
+      self.assertGreaterEqual(kesto, 0.03)
+      self.assertEqual(request.mittarit['rajoitus.viivastetty'], 4)
+      await request.send(''.join(sanomat))
+    __, tuloste = await _istunto(nakyma, *'abcdef')
+    self.assertEqual(tuloste[1].get('text'), 'abcdef')
+    # async def testaa_odota
+
+  async def testaa_pudota(self):
+    ''' Hylätäänkö sanomat, jotka eivät mahdu kiintiöön? '''
+    @WebsocketProtokolla(
+      saapuvia_sekunnissa=0.1,
+      saapuvia_tavuja_sekunnissa=0.1,
+      saapuvia_tavuja_kerralla=5,
+      saapuvien_ylitys='pudota',
+    )
+    async def nakyma(request):
+      while request.mittarit['rajoitus.pudotettu'] < 3:
+        await asyncio.sleep(0)
+      await request.send(await request.receive())
+    __, tuloste = await _istunto(nakyma, 'abc', 'def', 'g', 'h')
+    self.assertEqual(tuloste[1].get('text'), 'abc')
+    # async def testaa_pudota
+
+  async def testaa_sulje(self):
+    ''' Suljetaanko yhteys koodilla 1008 kiintiön ylittyessä? '''
+    @WebsocketProtokolla(
+      saapuvia_sekunnissa=0.1, saapuvia_kerralla=1, saapuvien_ylitys='sulje',
+    )
+    async def nakyma(request):
+      await asyncio.Future()
+    __, tuloste = await _istunto(nakyma, 'a', 'b')
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1008}
+    )
+    # async def testaa_sulje
+
+  async def testaa_jaettu(self):
+    ''' Jaetaanko kiintiö saman avaimen yhteyksien kesken? '''
+    @WebsocketProtokolla(
+      saapuvia_sekunnissa=0.1,
+      saapuvia_kerralla=3,
+      saapuvien_ylitys='pudota',
+      saapuvien_rajoitus=lambda request: 'yhteinen',
+    )
+    async def nakyma(request):
+      for __ in range(10):
+        await asyncio.sleep(0)
+      await request.send(str(request.mittarit['rajoitus.pudotettu']))
+      while True:
+        try:
+          request.receive_nowait()
+        except asyncio.QueueEmpty:
+          break
+    tulosteet = await asyncio.gather(
+      _istunto(nakyma, 'a', 'b'), _istunto(nakyma, 'c', 'd'),
+    )
+    self.assertEqual(sorted(
+      int(tuloste[1]['text']) for __, tuloste in tulosteet
+    ), [0, 1])
+    self.assertFalse(nakyma._kiintiot)
+    # async def testaa_jaettu
+
+  @staticmethod
+  def _jaettu_kiintio(saapuvien_rajoitus):
+    ''' Näkymä, joka palauttaa pudotettujen sanomien määrän. '''
+    @WebsocketProtokolla(
+      saapuvia_sekunnissa=0.1,
+      saapuvia_kerralla=3,
+      saapuvien_ylitys='pudota',
+      saapuvien_rajoitus=saapuvien_rajoitus,
+    )
+    async def nakyma(request):
+      # Odotetaan, että kaikki yhteydet ovat varanneet kiintiönsä.
+      await asyncio.sleep(0.05)
+      await request.send(str(request.mittarit['rajoitus.pudotettu']))
+      while True:
+        try:
+          request.receive_nowait()
+        except asyncio.QueueEmpty:
+          break
+    return nakyma
+    # def _jaettu_kiintio
+
+  async def testaa_jaettu_osoite(self):
+    ''' Jaetaanko kiintiö saman asiakasosoitteen yhteyksien kesken? '''
+    nakyma = self._jaettu_kiintio('osoite')
+    def osoite(ip):
+      return {'client': (ip, 1234)}
+    tulosteet = await asyncio.gather(
+      _istunto(nakyma, 'a', 'b', scope=osoite('10.0.0.1')),
+      _istunto(nakyma, 'c', 'd', scope=osoite('10.0.0.1')),
+      _istunto(nakyma, 'e', 'f', scope=osoite('10.0.0.2')),
+    )
+    self.assertEqual(int(tulosteet[2][1][1]['text']), 0)
+    self.assertEqual(sorted(
+      int(tuloste[1]['text']) for __, tuloste in tulosteet[:2]
+    ), [0, 1])
+    self.assertFalse(nakyma._kiintiot)
+    # async def testaa_jaettu_osoite
+
+  async def testaa_jaettu_kayttaja(self):
+    ''' Jaetaanko kiintiö saman käyttäjän yhteyksien kesken? '''
+    class Kayttaja:
+      is_authenticated = True
+      def __init__(self, pk):
+        self.pk = pk
+    @async_unsafe
+    def synkroninen():
+      raise AssertionError('request.user luettiin synkronisesti.')
+    def kayttaja(pk):
+      async def auser():
+        return Kayttaja(pk)
+      return {'user': SimpleLazyObject(synkroninen), 'auser': auser}
+    nakyma = self._jaettu_kiintio('kayttaja')
+    tulosteet = await asyncio.gather(
+      _istunto(nakyma, 'a', 'b', maareet=kayttaja(1)),
+      _istunto(nakyma, 'c', 'd', maareet=kayttaja(1)),
+      _istunto(nakyma, 'e', 'f', maareet=kayttaja(2)),
+    )
+    self.assertEqual(int(tulosteet[2][1][1]['text']), 0)
+    self.assertEqual(sorted(
+      int(tuloste[1]['text']) for __, tuloste in tulosteet[:2]
+    ), [0, 1])
+    self.assertFalse(nakyma._kiintiot)
+    # async def testaa_jaettu_kayttaja
+
+  async def testaa_kayttaja_ilman_auser(self):
+    ''' Luetaanko `request.user` säikeessä, ellei `auser` ole saatavilla? '''
+    class Kayttaja:
+      is_authenticated = True
+      pk = 1
+    nakyma = self._jaettu_kiintio('kayttaja')
+    tulosteet = await asyncio.gather(*(
+      _istunto(nakyma, 'a', 'b', maareet={
+        'user': SimpleLazyObject(async_unsafe(Kayttaja)),
+      })
+      for __ in range(2)
+    ))
+    self.assertEqual(sorted(
+      int(tuloste[1]['text']) for __, tuloste in tulosteet
+    ), [0, 1])
+    # async def testaa_kayttaja_ilman_auser
+
+  def testaa_virheellinen_toiminta(self):
+    ''' Hylätäänkö tuntematon ylitystoiminta tai rajoitusperuste? '''
+    with self.assertRaises(ValueError):
+      @WebsocketProtokolla(saapuvien_ylitys='ohita')
+      async def nakyma(request):
+        pass
+    with self.assertRaises(ValueError):
+      @WebsocketProtokolla(saapuvien_rajoitus='istunto')
+      async def nakyma2(request):
+        pass
+    # def testaa_virheellinen_toiminta
+
+  # class Saapuvienrajoitus
+
+
+class Lahetepuskuri(SimpleTestCase):
+  ''' Puskuroitu lähetys erillisen kirjoitustehtävän kautta. '''
+
+  async def testaa_puskurointi(self):
+    ''' Palaako lähetys ennen kuin ASGI-palvelin on vastaanottanut sen? '''
+    vapautettu = asyncio.Event()
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await vapautettu.wait()
+    @WebsocketProtokolla(lahtevia_enintaan=5)
+    async def nakyma(request):
+      for sanoma in ('a', 'b', 'c'):
+        await request.send(sanoma)
+      self.assertEqual(request.mittarit['lahete.enimmillaan'], 3)
+      vapautettu.set()
+    __, tuloste = await _istunto(nakyma, send=send)
+    self.assertEqual(
+      [s.get('text') for s in tuloste[1:4]], ['a', 'b', 'c']
+    )
+    # async def testaa_puskurointi
+
+  async def testaa_hidas_vastaanottaja(self):
+    ''' Katkaistaanko hitaan vastaanottajan yhteys koodilla 1008? '''
+    hidas = mittarit.laskurit['lahete.hidas']
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await asyncio.Future()
+    @WebsocketProtokolla(lahtevia_enintaan=1, hidas_vastaanottaja=0.05)
+    async def nakyma(request):
+      for sanoma in ('a', 'b', 'c'):
+        await request.send(sanoma)
+      await asyncio.Future()
+    __, tuloste = await _istunto(nakyma, send=send)
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1008}
+    )
+    self.assertEqual(mittarit.laskurit['lahete.hidas'], hidas + 1)
+    # async def testaa_hidas_vastaanottaja
+
+  async def testaa_yhdistaminen(self):
+    ''' Korvaako avaimella lähetetty sanoma saman avaimen sanoman? '''
+    vapautettu = asyncio.Event()
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await vapautettu.wait()
+    @WebsocketProtokolla(lahtevia_enintaan=4)
+    async def nakyma(request):
+      await request.send('a', avain='x')
+      # Kirjoitettavana olevaa sanomaa ei korvata.
+      await asyncio.sleep(0)
+      for sanoma, avain in (
+        ('b', 'x'), ('c', 'y'), ('d', 'x'), ('e', 'y'), ('f', None),
+      ):
+        await request.send(sanoma, avain=avain)
+      # Puskuri on täynnä, mutta korvaava sanoma ei jää odottamaan.
+      await request.send('g', avain='y')
+      self.assertEqual(request.mittarit['lahete.yhdistetty'], 3)
+      self.assertEqual(request.mittarit['lahete.enimmillaan'], 4)
+      vapautettu.set()
+    __, tuloste = await _istunto(nakyma, send=send)
+    self.assertEqual(
+      [s.get('text') for s in tuloste[1:-1]], ['a', 'd', 'g', 'f']
+    )
+    # async def testaa_yhdistaminen
+
+  async def testaa_kiireellinen(self):
+    ''' Ohittaako kiireellinen sanoma puskuroidut sanomat? '''
+    vapautettu = asyncio.Event()
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await vapautettu.wait()
+    @WebsocketProtokolla(lahtevia_enintaan=3, kiireellisia_enintaan=2)
+    async def nakyma(request):
+      await request.send('a')
+      # Kirjoitettavana oleva sanoma lähtee ensin.
+      await asyncio.sleep(0)
+      for sanoma in 'bc':
+        await request.send(sanoma)
+      await request.send('x', kiireellinen=True)
+      await request.send('y', kiireellinen=True)
+      # Kiireellisten jono on täynnä: kolmas jää odottamaan.
+      kolmas = asyncio.ensure_future(request.send('z', kiireellinen=True))
+      await asyncio.sleep(0.01)
+      self.assertFalse(kolmas.done())
+      vapautettu.set()
+      await kolmas
+      self.assertEqual(request.mittarit['lahete.kiireellinen'], 3)
+    __, tuloste = await _istunto(nakyma, send=send)
+    tekstit = [s.get('text') for s in tuloste[1:-1]]
+    self.assertEqual(tekstit[:3], ['a', 'x', 'y'])
+    # Odottanut kiireellinen sanoma ei ollut vielä jonossa.
+    self.assertEqual(sorted(tekstit[3:]), ['b', 'c', 'z'])
+    # async def testaa_kiireellinen
+
+  # class Lahetepuskuri
+
+
+class Avaaminen(SimpleTestCase):
+  ''' Avaava kättely. '''
+
+  async def testaa_aikakatkaisu(self):
+    ''' Hylätäänkö yhteys, ellei yhteyspyyntöä saavu ajoissa? '''
+    aikakatkaisuja = mittarit.laskurit['kattely.aikakatkaisu']
+    suoritettu = False
+    @WebsocketProtokolla(avaamisen_aikakatkaisu=0.05)
+    async def nakyma(request):
+      nonlocal suoritettu
+      suoritettu = True
+    tuloste = []
+    async def send(sanoma):
+      tuloste.append(sanoma)
+    await asyncio.wait_for(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, asyncio.Event().wait, send
+    )), timeout=1.0)
+    self.assertFalse(suoritettu)
+    self.assertEqual(tuloste, [{'type': 'websocket.close'}])
+    self.assertEqual(
+      mittarit.laskurit['kattely.aikakatkaisu'], aikakatkaisuja + 1
+    )
+    # async def testaa_aikakatkaisu
+
+  # class Avaaminen
+
+
+class Sulkeminen(SimpleTestCase):
+  ''' Sulkeva kättely. '''
+
+  async def testaa_kuittaus(self):
+    ''' Päättyykö yhteys heti, kun vastapää kuittaa katkaisun? '''
+    @WebsocketProtokolla(sulkemisen_aikakatkaisu=10.0)
+    async def nakyma(request):
+      await request.send('abc')
+    syote, tuloste = await asyncio.wait_for(_istunto(nakyma), timeout=1.0)
+    self.assertEqual(tuloste[-1], {'type': 'websocket.close'})
+    self.assertTrue(syote.empty())
+    # async def testaa_kuittaus
+
+  async def testaa_aikakatkaisu(self):
+    ''' Päättyykö yhteys aikakatkaisuun, ellei katkaisua kuitata? '''
+    @WebsocketProtokolla(sulkemisen_aikakatkaisu=0.05)
+    async def nakyma(request):
+      await request.send('abc')
+    __, tuloste = await asyncio.wait_for(
+      _istunto(nakyma, kuittaa=False), timeout=1.0
+    )
+    self.assertEqual(tuloste[-1], {'type': 'websocket.close'})
+    # async def testaa_aikakatkaisu
+
+  async def testaa_myohainen_sanoma(self):
+    ''' Hylätäänkö sulkevan kättelyn aikana saapuva sanoma? '''
+    @WebsocketProtokolla
+    async def nakyma(request):
+      await request.send('hei hei')
+    syote, tuloste = asyncio.Queue(), []
+    syote.put_nowait({'type': 'websocket.connect'})
+    async def send(sanoma):
+      tuloste.append(sanoma)
+      if sanoma['type'] == 'websocket.close':
+        # Vastapää lähettää sanoman ennen katkaisun kuittausta.
+        syote.put_nowait({'type': 'websocket.receive', 'text': 'myohassa'})
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    await asyncio.wait_for(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )), timeout=1.0)
+    self.assertEqual(tuloste[-1], {'type': 'websocket.close'})
+    self.assertTrue(syote.empty())
+    # async def testaa_myohainen_sanoma
+
+  # class Sulkeminen
+
+
+class Tavudata(SimpleTestCase):
+  ''' Puskuriprotokollaa tukevien olioiden lähetys. '''
+
+  async def testaa_kopioiden(self):
+    ''' Muunnetaanko puskurit oletuksena `bytes`-olioiksi? '''
+    puskuri = bytearray(b'abc')
+    taulukko = array.array('H', [1, 2, 3])
+    @WebsocketProtokolla
+    async def nakyma(request):
+      await request.send(puskuri)
+      await request.send(memoryview(puskuri))
+      await request.send(taulukko)
+      puskuri[:] = b'xyz'
+    __, tuloste = await _istunto(nakyma)
+    for sanoma, odotettu in zip(
+      tuloste[1:4], (b'abc', b'abc', taulukko.tobytes())
+    ):
+      self.assertIs(type(sanoma['bytes']), bytes)
+      self.assertEqual(sanoma['bytes'], odotettu)
+    # async def testaa_kopioiden
+
+  async def testaa_kopioimatta(self):
+    ''' Välitetäänkö puskurit ASGI-palvelimelle kopioimatta? '''
+    puskuri = bytearray(b'abc')
+    nakyma_ = memoryview(puskuri)
+    taulukko = array.array('H', [1, 2, 3])
+    @WebsocketProtokolla(nollakopio=True)
+    async def nakyma(request):
+      await request.send(puskuri)
+      await request.send(nakyma_)
+      await request.send(taulukko)
+    __, tuloste = await _istunto(nakyma)
+    self.assertIs(tuloste[1]['bytes'], puskuri)
+    self.assertIs(tuloste[2]['bytes'], nakyma_)
+    self.assertIs(tuloste[3]['bytes'].obj, taulukko)
+    self.assertEqual(tuloste[3]['bytes'].nbytes, 6)
+    # async def testaa_kopioimatta
+
+  async def testaa_epayhtenainen(self):
+    ''' Kopioidaanko muu kuin yhtenäinen tavunäkymä? '''
+    viipale = memoryview(b'abcdef')[::2]
+    @WebsocketProtokolla(nollakopio=True)
+    async def nakyma(request):
+      await request.send(viipale)
+    __, tuloste = await _istunto(nakyma)
+    self.assertEqual(bytes(tuloste[1]['bytes']), b'ace')
+    self.assertTrue(tuloste[1]['bytes'].c_contiguous)
+    # async def testaa_epayhtenainen
+
+  async def testaa_puskuroitu(self):
+    ''' Kopioidaanko muuttuva puskuri lähetepuskuriin? '''
+    puskuri = bytearray(b'abc')
+    @WebsocketProtokolla(lahtevia_enintaan=10)
+    async def nakyma(request):
+      await request.send(memoryview(puskuri))
+      puskuri[:] = b'xyz'
+    __, tuloste = await _istunto(nakyma)
+    self.assertEqual(tuloste[1]['bytes'], b'abc')
+    # async def testaa_puskuroitu
+
+  async def testaa_virheellinen(self):
+    ''' Hylätäänkö muu kuin teksti tai puskuri? '''
+    @WebsocketProtokolla
+    async def nakyma(request):
+      await request.send(42)
+    with self.assertRaises(TypeError):
+      await _istunto(nakyma)
+    # async def testaa_virheellinen
+
+  # class Tavudata
+
+
+class Eraluku(SimpleTestCase):
+  ''' Jonossa olevien sanomien luku yhdellä kutsulla. '''
+
+  async def testaa_eraluku(self):
+    ''' Palauttavatko erälukumetodit jonossa olevat sanomat? '''
+    tulokset = []
+    @WebsocketProtokolla
+    async def nakyma(request):
+      while request.mittarit['syote.jonossa'] < 3:
+        await asyncio.sleep(0)
+      tulokset.append(await request.receive_many(2))
+      tulokset.append(request.receive_nowait())
+      with self.assertRaises(asyncio.QueueEmpty):
+        request.receive_nowait()
+      tulokset.append(await request.receive_many(timeout=0.01))
+    await _istunto(nakyma, 'a', 'b', 'c')
+    self.assertEqual(tulokset, [['a', 'b'], 'c', []])
+    # async def testaa_eraluku
+
+  # class Eraluku
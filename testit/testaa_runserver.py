@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*-
 
-from unittest.mock import MagicMock, patch
+import asyncio
+import os
+import tempfile
+from unittest import skipIf
+from unittest.mock import patch
 
 from django.core.management.base import CommandError
 from django.core.management import call_command
 from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+try:
+  import uvicorn
+except ImportError:
+  uvicorn = None
+
+
+urlpatterns = []
 
 
 class Runserver(SimpleTestCase):
@@ -34,14 +47,38 @@ class Runserver(SimpleTestCase):
     # def testaa_runserver_asgi_ei_uvicornia
 
   @patch('django.core.management.commands.runserver.Command.check_migrations', lambda self: None)
+  @patch('pistoke.management.commands.runserver.Palvelin')
   @patch('pistoke.management.commands.runserver.uvicorn')
-  def testaa_runserver_asgi_uvicorn(self, mock):
+  def testaa_runserver_asgi_uvicorn(self, mock, palvelin):
     ''' Käynnistääkö `runserver --asgi` uvicorn-palvelimen? '''
-    mock.run = MagicMock()
+    mock.Config.return_value.should_reload = False
+    mock.Config.return_value.workers = 1
+    mock.Config.return_value.uds = None
+    palvelin.return_value.started = True
     call_command('runserver', '--asgi')
-    mock.run.assert_called_once()
+    palvelin.assert_called_once_with(config=mock.Config.return_value)
+    palvelin.return_value.run.assert_called_once()
     # def testaa_runserver_asgi_uvicorn
 
+  @patch('django.core.management.commands.runserver.Command.check_migrations', lambda self: None)
+  @patch('pistoke.management.commands.runserver.STARTUP_FAILURE', 3, create=True)
+  @patch('pistoke.management.commands.runserver.Palvelin')
+  @patch('pistoke.management.commands.runserver.uvicorn')
+  def testaa_runserver_kaynnistysvirhe(self, mock, palvelin):
+    ''' Päättyykö `runserver --asgi` virhekoodiin, ellei palvelin käynnisty? '''
+    with tempfile.TemporaryDirectory() as hakemisto:
+      uds = os.path.join(hakemisto, 'uvicorn.sock')
+      open(uds, 'w').close()
+      mock.Config.return_value.should_reload = False
+      mock.Config.return_value.workers = 1
+      mock.Config.return_value.uds = uds
+      palvelin.return_value.started = False
+      with self.assertRaises(SystemExit) as konteksti:
+        call_command('runserver', '--asgi')
+      self.assertEqual(konteksti.exception.code, 3)
+      self.assertFalse(os.path.exists(uds))
+    # def testaa_runserver_kaynnistysvirhe
+
   @patch('django.core.management.commands.runserver.Command.check_migrations', lambda self: None)
   @patch('django.core.management.commands.runserver.run')
   def testaa_runserver_wsgi(self, mock):
@@ -50,4 +87,42 @@ class Runserver(SimpleTestCase):
     mock.assert_called_once()
     # def testaa_runserver_wsgi
 
+  @override_settings(ROOT_URLCONF=__name__)
+  async def testaa_runserver_elinkaari(self):
+    ''' Käsitteleekö ASGI-kehityspalvelin elinkaarisanomat (lifespan)? '''
+    from pistoke.management.commands.runserver import uvicorn_application
+    syote, tuloste = asyncio.Queue(), asyncio.Queue()
+    await syote.put({'type': 'lifespan.startup'})
+    await syote.put({'type': 'lifespan.shutdown'})
+    await uvicorn_application({'type': 'lifespan'}, syote.get, tuloste.put)
+    self.assertEqual(
+      await tuloste.get(), {'type': 'lifespan.startup.complete'}
+    )
+    self.assertEqual(
+      await tuloste.get(), {'type': 'lifespan.shutdown.complete'}
+    )
+    # async def testaa_runserver_elinkaari
+
+  @skipIf(uvicorn is None, 'Uvicorn-pakettia ei ole asennettu')
+  async def testaa_runserver_sammutus(self):
+    ''' Tyhjentääkö ASGI-kehityspalvelin käsittelijät ennen sammumista? '''
+    from pistoke.management.commands.runserver import (
+      Palvelin, uvicorn_application, uvicorn_application_static,
+    )
+    palvelin = Palvelin(config=uvicorn.Config(uvicorn_application))
+    tyhjennetty = []
+    async def tyhjenna():
+      tyhjennetty.append(True)
+    with patch.object(
+      uvicorn_application.websocket, 'tyhjenna', tyhjenna
+    ), patch.object(
+      uvicorn_application_static.websocket, 'tyhjenna', tyhjenna
+    ), patch.object(
+      uvicorn.Server, 'shutdown', autospec=True
+    ) as shutdown:
+      await palvelin.shutdown()
+    self.assertEqual(tyhjennetty, [True, True])
+    shutdown.assert_called_once()
+    # async def testaa_runserver_sammutus
+
   # class Runserver
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+
+from django.test.utils import override_settings
+from django.urls import path
+
+from pistoke import mittarit
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.pyynto import WebsocketPyynto
+from pistoke.ryhma import Keskitin
+from pistoke.testaus import WebsocketTesti
+from pistoke.tyokalut import JsonLiikenne, Pakkaus
+
+
+###############
+#
+# TESTINÄKYMÄT.
+
+keskitin = Keskitin()
+
+
+@WebsocketProtokolla
+@JsonLiikenne
+async def huone(request, nimi):
+  with keskitin.liity(request, f'huone-{nimi}', 'kaikki'):
+    await request.send({'liitytty': nimi})
+    async for sanoma in request:
+      keskitin.julkaise(f'huone-{nimi}', sanoma)
+
+
+urlpatterns = [path('huone/<str:nimi>/', huone)]
+
+
+###############
+# TESTIMETODIT.
+
+@override_settings(
+  ROOT_URLCONF=__name__,
+)
+class Ryhmat(WebsocketTesti):
+
+  async def testaa_julkaisu(self):
+    ''' Välitetäänkö julkaistu sanoma ryhmän kaikille jäsenille? '''
+    async with self.async_client.websocket('/huone/a/') as a1, \
+    self.async_client.websocket('/huone/a/') as a2, \
+    self.async_client.websocket('/huone/b/') as b:
+      for websocket, nimi in ((a1, 'a'), (a2, 'a'), (b, 'b')):
+        self.assertEqual(
+          await websocket.receive(), '{"liitytty": "%s"}' % nimi
+        )
+      self.assertEqual(keskitin.jasenia('huone-a'), 2)
+      self.assertEqual(keskitin.jasenia('kaikki'), 3)
+
+      await a1.send('{"teksti": "hei"}')
+      self.assertEqual(await a1.receive(), '{"teksti": "hei"}')
+      self.assertEqual(await a2.receive(), '{"teksti": "hei"}')
+      self.assertEqual(keskitin.julkaise('kaikki', [1, 2]), 3)
+      for websocket in (a1, a2, b):
+        self.assertEqual(await websocket.receive(), '[1, 2]')
+      # async with self.async_client.websocket
+    self.assertEqual(keskitin.jasenia('kaikki'), 0)
+    self.assertEqual(keskitin.julkaise('kaikki', 'ohi'), 0)
+    # async def testaa_julkaisu
+
+  async def testaa_keskeytynyt_kirjoitus(self):
+    ''' Kirjoitetaanko jonotetut sanomat keskeytyksen jälkeen? '''
+    _keskitin = Keskitin()
+    liitytty = asyncio.get_running_loop().create_future()
+    @WebsocketProtokolla
+    async def nakyma(request):
+      with _keskitin.liity(request, 'ryhma'):
+        liitytty.set_result(None)
+        await request.receive()
+
+    syote, tuloste, jatka = asyncio.Queue(), [], asyncio.Event()
+    await syote.put({'type': 'websocket.connect'})
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await jatka.wait()
+        tuloste.append(sanoma['text'])
+        if len(tuloste) == 3:
+          syote.put_nowait({'type': 'websocket.receive', 'text': ''})
+      elif sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    yhteys = asyncio.create_task(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )))
+    await liitytty
+    for data in 'abc':
+      _keskitin.julkaise_raaka('ryhma', data)
+    self.assertEqual(tuloste, [])
+    jatka.set()
+    await yhteys
+    self.assertEqual(tuloste, ['a', 'b', 'c'])
+    # async def testaa_keskeytynyt_kirjoitus
+
+  async def testaa_keskenerainen_kirjoitus(self):
+    '''
+    Kirjoitetaanko sanomat, kun ASGI-palvelimen kirjoitus on vielä
+    kesken jatkotehtävän käynnistyessä?
+    '''
+    _keskitin = Keskitin()
+    liitytty = asyncio.get_running_loop().create_future()
+    @WebsocketProtokolla
+    async def nakyma(request):
+      with _keskitin.liity(request, 'ryhma'):
+        liitytty.set_result(None)
+        await request.receive()
+
+    syote, tuloste = asyncio.Queue(), []
+    await syote.put({'type': 'websocket.connect'})
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await asyncio.sleep(0.01)
+        tuloste.append(sanoma['text'])
+        if len(tuloste) == 3:
+          syote.put_nowait({'type': 'websocket.receive', 'text': ''})
+      elif sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    yhteys = asyncio.create_task(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )))
+    await liitytty
+    _keskitin.julkaise_raaka('ryhma', 'a')
+    await asyncio.sleep(0.001)
+    for data in 'bc':
+      _keskitin.julkaise_raaka('ryhma', data)
+    await asyncio.wait_for(yhteys, timeout=1.0)
+    self.assertEqual(tuloste, ['a', 'b', 'c'])
+    # async def testaa_keskenerainen_kirjoitus
+
+  async def testaa_lahetepuskuri(self):
+    ''' Kulkevatko ryhmäsanomat yhteyden lähetepuskurin kautta? '''
+    _keskitin = Keskitin()
+    @WebsocketProtokolla(lahtevia_enintaan=10)
+    async def nakyma(request):
+      with _keskitin.liity(request, 'ryhma'):
+        await request.send('1')
+        await request.send('2')
+        _keskitin.julkaise_raaka('ryhma', '3')
+        await request.receive()
+
+    syote, tuloste = asyncio.Queue(), []
+    await syote.put({'type': 'websocket.connect'})
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        await asyncio.sleep(0.001)
+        tuloste.append(sanoma['text'])
+        if len(tuloste) == 3:
+          syote.put_nowait({'type': 'websocket.receive', 'text': ''})
+      elif sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    await asyncio.wait_for(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )), timeout=1.0)
+    self.assertEqual(tuloste, ['1', '2', '3'])
+    # async def testaa_lahetepuskuri
+
+  async def testaa_pakkaus(self):
+    ''' Pakataanko ryhmäsanomat yhteyden pakkauksen mukaisesti? '''
+    _keskitin = Keskitin()
+    @WebsocketProtokolla
+    @Pakkaus(kynnys=1)
+    async def nakyma(request):
+      with _keskitin.liity(request, 'ryhma'):
+        _keskitin.julkaise_raaka('ryhma', 'abc' * 10)
+        await request.receive()
+
+    syote, tuloste = asyncio.Queue(), []
+    await syote.put({'type': 'websocket.connect'})
+    async def send(sanoma):
+      if sanoma['type'] == 'websocket.send':
+        tuloste.append(sanoma)
+        syote.put_nowait({'type': 'websocket.receive', 'text': ''})
+      elif sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    await asyncio.wait_for(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )), timeout=1.0)
+    self.assertEqual(len(tuloste), 1)
+    self.assertEqual(
+      bytes(tuloste[0]['bytes'][:1]), Pakkaus.PAKATTU_TEKSTI
+    )
+    # async def testaa_pakkaus
+
+  async def testaa_hidas_jasen(self):
+    ''' Katkaistaanko jäsen, jonka jono täyttyy? '''
+    hidas = Keskitin(jono_enintaan=2)
+    liitytty = asyncio.get_running_loop().create_future()
+    @WebsocketProtokolla
+    async def nakyma(request):
+      with hidas.liity(request, 'ryhma'):
+        liitytty.set_result(None)
+        await request.receive()
+
+    syote, tuloste = asyncio.Queue(), []
+    await syote.put({'type': 'websocket.connect'})
+    async def send(sanoma):
+      tuloste.append(sanoma)
+      if sanoma['type'] == 'websocket.send':
+        # Vastaanottaja ei koskaan kuittaa sanomaa.
+        await asyncio.Event().wait()
+      elif sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    yhteys = asyncio.create_task(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )))
+    await liitytty
+    laskuri = mittarit.laskurit['ryhma.hidas']
+    # Ensimmäinen sanoma jää kirjoitukseen, kaksi seuraavaa jonoon.
+    self.assertEqual(hidas.julkaise_raaka('ryhma', 'a'), 1)
+    await asyncio.sleep(0)
+    for data in 'bc':
+      self.assertEqual(hidas.julkaise_raaka('ryhma', data), 1)
+    self.assertEqual(hidas.julkaise_raaka('ryhma', 'd'), 0)
+    await yhteys
+    self.assertEqual(mittarit.laskurit['ryhma.hidas'], laskuri + 1)
+    self.assertEqual(hidas.jasenia('ryhma'), 0)
+    self.assertEqual(
+      tuloste[-1], {'type': 'websocket.close', 'code': 1008}
+    )
+    # async def testaa_hidas_jasen
+
+  # class Ryhmat
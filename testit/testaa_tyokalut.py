@@ -1,6 +1,20 @@
+import array
 import asyncio
+import ctypes
 from decimal import Decimal
 import json
+import struct
+import unittest
+import zlib
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+try:
+  import orjson
+except ImportError:
+  orjson = None
 
 from django.contrib.auth.decorators import permission_required
 from django.contrib.auth.mixins import PermissionRequiredMixin
@@ -9,15 +23,29 @@ from django.test.utils import override_settings
 from django.urls import path
 from django.utils.decorators import method_decorator
 
+from pistoke.koodain import (
+  JsonKoodain,
+  OrjsonKoodain,
+  TaulukkoKoodain,
+  koodaimet,
+  nimetty_koodain,
+  rekisteroi,
+)
 from pistoke.nakyma import WebsocketNakyma
+from pistoke import mittarit
 from pistoke.protokolla import (
   WebsocketProtokolla,
   WebsocketAliprotokolla,
 )
 from pistoke.tyokalut import (
+  BinaariLiikenne,
   CsrfKattely,
   JsonLiikenne,
+  Pakkaus,
+  _Kooste,
+  odota_enintaan,
 )
+from pistoke.pyynto import WebsocketPyynto
 from pistoke.testaus import WebsocketPaate
 
 
@@ -74,6 +102,13 @@ async def csrf(request):
   await request.send('ok')
 
 
+@_testinakyma
+@WebsocketProtokolla
+@CsrfKattely(kattelyn_aikakatkaisu=0.05)
+async def csrf_aikakatkaisu(request):
+  await request.send('ok')
+
+
 @_testinakyma
 @method_decorator(
   WebsocketAliprotokolla('summa', 'erotus'),
@@ -100,6 +135,84 @@ class Aritmetiikkaa(WebsocketNakyma):
   # class Aritmetiikkaa
 
 
+@_testinakyma
+@WebsocketProtokolla
+@JsonLiikenne
+async def json_era(request):
+  luvut = []
+  while len(luvut) < 3:
+    luvut += await request.receive_many(3 - len(luvut))
+  await request.send(sum(luvut))
+
+
+@_testinakyma
+@WebsocketProtokolla
+@JsonLiikenne
+async def json_raaka(request):
+  await request.send_raw(b'{"valmis": true}')
+  await request.send_raw('{"valmis": false}')
+
+
+if orjson is not None:
+  @_testinakyma
+  @WebsocketProtokolla
+  @JsonLiikenne(koodain=OrjsonKoodain)
+  async def orjson_teksti(request):
+    await request.send({'summa': sum(await request.receive())})
+
+  @_testinakyma
+  @WebsocketProtokolla
+  @JsonLiikenne(koodain=OrjsonKoodain, teksti=False)
+  async def orjson_binaari(request):
+    await request.send({'summa': sum(await request.receive())})
+
+
+@_testinakyma
+@WebsocketAliprotokolla('v1.msgpack', 'v1.json')
+@BinaariLiikenne
+async def binaari(request):
+  await request.send({'summa': sum(await request.receive())})
+
+
+@_testinakyma
+@WebsocketProtokolla
+@BinaariLiikenne(koodain='taulukko')
+async def taulukko(request):
+  matriisi = await request.receive()
+  await request.send(matriisi[::-1])
+  await request.send(matriisi)
+
+
+SANAKIRJA = b'{"tunnus": , "tila": "kunnossa", "arvot": []}'
+
+
+@_testinakyma
+@WebsocketAliprotokolla('v1.z', 'v1')
+@Pakkaus(sanakirja=SANAKIRJA, kynnys=32, protokollat=('v1.z', ))
+@JsonLiikenne
+async def pakattu(request):
+  while True:
+    sanoma = await request.receive()
+    sanoma['tila'] = 'kunnossa'
+    await request.send(sanoma)
+
+
+@_testinakyma
+@WebsocketProtokolla
+@JsonLiikenne(koonti=0.01, koonti_enintaan=3)
+async def koottu(request):
+  for luku in (1, 2, 3, 4):
+    await request.send(luku)
+  await request.flush()
+  await request.send({'tila': 1}, avain='tila')
+  await request.send({'tila': 2}, avain='tila')
+  await request.receive()
+  await request.send(5)
+  await request.send(7, kiireellinen=True)
+  await request.send_raw('"valmis"')
+  await request.send(6)
+
+
 ###############
 # TESTIMETODIT.
 
@@ -144,6 +257,24 @@ class Tyokalut(SimpleTestCase):
       # async with self.async_client.websocket as websocket
     # async def testaa_virheellinen_csrf_b
 
+  async def testaa_csrf_aikakatkaisu(self):
+    '''
+    Sulkeutuuko yhteys, ellei CSRF-avainta lähetetä ajoissa?
+    '''
+    aikakatkaisuja = mittarit.laskurit['csrf.aikakatkaisu']
+    async with self.async_client_csrf.websocket(
+      '/csrf_aikakatkaisu/'
+    ) as websocket:
+      self.assertEqual(
+        await websocket.receive(),
+        'CSRF-kättely aikakatkaistiin!'
+      )
+      # async with self.async_client.websocket as websocket
+    self.assertEqual(
+      mittarit.laskurit['csrf.aikakatkaisu'], aikakatkaisuja + 1
+    )
+    # async def testaa_csrf_aikakatkaisu
+
   async def testaa_puuttuva_aliprotokolla(self):
     '''
     Sulkeutuuko yhteys, kun protokolla puuttuu?
@@ -255,4 +386,301 @@ class Tyokalut(SimpleTestCase):
         await asyncio.wait_for(websocket.receive(), timeout=0.1)
     # async def testaa_summa
 
+  async def testaa_json_era(self):
+    ''' Puretaanko JSON-sanomat myös erälukumetodilla? '''
+    async with self.async_client.websocket('/json_era/') as websocket:
+      for luku in (1, 2, 3):
+        await websocket.send(json.dumps(luku))
+      self.assertEqual(await websocket.receive(), '6')
+    # async def testaa_json_era
+
+  async def testaa_json_raaka(self):
+    ''' Lähetetäänkö valmiiksi koodattu sanoma sellaisenaan? '''
+    async with self.async_client.websocket('/json_raaka/') as websocket:
+      self.assertEqual(await websocket.receive(), '{"valmis": true}')
+      self.assertEqual(await websocket.receive(), '{"valmis": false}')
+    # async def testaa_json_raaka
+
+  @unittest.skipIf(orjson is None, 'orjson puuttuu')
+  async def testaa_orjson(self):
+    ''' Lähetetäänkö orjson-sanoma teksti- tai binäärisanomana? '''
+    async with self.async_client.websocket('/orjson_teksti/') as websocket:
+      await websocket.send('[1, 2, 3]')
+      self.assertEqual(await websocket.receive(), '{"summa":6}')
+    async with self.async_client.websocket('/orjson_binaari/') as websocket:
+      await websocket.send('[1, 2, 3]')
+      self.assertEqual(await websocket.receive(), b'{"summa":6}')
+    # async def testaa_orjson
+
+  def testaa_json_koodain(self):
+    ''' Valitaanko koodain parametrin tai projektiasetuksen mukaan? '''
+    async def nakyma(request):
+      pass
+    self.assertIsInstance(JsonLiikenne(nakyma).koodain, JsonKoodain)
+    with override_settings(
+      PISTOKE_JSON_KOODAIN='pistoke.koodain.OrjsonKoodain'
+    ):
+      if orjson is not None:
+        self.assertIsInstance(
+          JsonLiikenne(nakyma).koodain, OrjsonKoodain
+        )
+    with self.assertRaises(ValueError):
+      JsonLiikenne(nakyma, koodain=JsonKoodain, loads={'cls': JSONLatain})
+    # def testaa_json_koodain
+
+  async def testaa_binaari_json(self):
+    ''' Valitaanko JSON-koodain aliprotokollan päätteen mukaan? '''
+    async with self.async_client.websocket(
+      '/binaari/', protokolla='v1.json'
+    ) as websocket:
+      await websocket.send('[1, 2, 3]')
+      self.assertEqual(
+        json.loads(await websocket.receive()), {'summa': 6}
+      )
+    # async def testaa_binaari_json
+
+  @unittest.skipIf(msgpack is None, 'msgpack puuttuu')
+  async def testaa_binaari_msgpack(self):
+    ''' Lähetetäänkö MessagePack-sanoma binäärisanomana? '''
+    async with self.async_client.websocket(
+      '/binaari/', protokolla='v1.msgpack'
+    ) as websocket:
+      await websocket.send(msgpack.packb([1, 2, 3]))
+      self.assertEqual(
+        msgpack.unpackb(await websocket.receive()), {'summa': 6}
+      )
+    # async def testaa_binaari_msgpack
+
+  def testaa_koodainrekisteri(self):
+    ''' Muodostetaanko rekisteröity koodain nimen perusteella? '''
+    @rekisteroi('testi')
+    class Testikoodain(JsonKoodain):
+      pass
+    try:
+      koodain = nimetty_koodain('testi')
+      self.assertIsInstance(koodain, Testikoodain)
+      self.assertIs(nimetty_koodain('testi'), koodain)
+      async def nakyma(request):
+        pass
+      self.assertIs(BinaariLiikenne(nakyma, koodain='testi').koodain, koodain)
+    finally:
+      del koodaimet['testi']
+    with self.assertRaises(LookupError):
+      nimetty_koodain('testi')
+    # def testaa_koodainrekisteri
+
+  async def testaa_taulukko(self):
+    ''' Välitetäänkö taulukon tyyppi ja muoto sanoman mukana? '''
+    koodain = TaulukkoKoodain()
+    matriisi = memoryview(array.array('d', range(6))).cast('B').cast(
+      'd', (2, 3)
+    )
+    async with self.async_client.websocket('/taulukko/') as websocket:
+      await websocket.send(koodain.dumps(matriisi))
+      kaannetty = koodain.loads(await websocket.receive())
+      self.assertEqual((kaannetty.format, kaannetty.shape), ('d', (2, 3)))
+      self.assertEqual(kaannetty.tolist(), [[3.0, 4.0, 5.0], [0.0, 1.0, 2.0]])
+      kokonainen = koodain.loads(await websocket.receive())
+      self.assertEqual(kokonainen.tolist(), matriisi.tolist())
+    # async def testaa_taulukko
+
+  def testaa_taulukko_virheet(self):
+    ''' Hylätäänkö tukematon alkiotyyppi tai tavujärjestys? '''
+    koodain = TaulukkoKoodain()
+    self.assertEqual(
+      koodain.loads(koodain.dumps((ctypes.c_double * 2)(1, 2))).tolist(),
+      [1.0, 2.0]
+    )
+    with self.assertRaises(ValueError):
+      koodain.dumps(((
+        ctypes.c_double.__ctype_be__
+        if koodain.jarjestys == b'<'
+        else ctypes.c_double.__ctype_le__
+      ) * 2)())
+    data = bytearray(koodain.dumps(array.array('i', (1, 2))))
+    data[1:2] = b'>' if koodain.jarjestys == b'<' else b'<'
+    with self.assertRaises(ValueError):
+      koodain.loads(data)
+    # def testaa_taulukko_virheet
+
+  def testaa_taulukko_vakiokoko(self):
+    ''' Kirjataanko alkiotyyppi otsakkeeseen vakiokokoisena? '''
+    koodain = TaulukkoKoodain()
+    for tyyppi in ('l', 'L', 'i', 'd'):
+      with self.subTest(tyyppi=tyyppi):
+        taulukko = array.array(tyyppi, (1, 2, 3))
+        data = koodain.dumps(taulukko)
+        self.assertEqual(
+          struct.calcsize('<' + data[2:3].decode('ascii')),
+          taulukko.itemsize,
+        )
+        self.assertEqual(len(data) - data[0], 3 * taulukko.itemsize)
+        self.assertEqual(koodain.loads(data).tolist(), [1, 2, 3])
+    # Alustakohtaisen kokoista tyyppiä ei pureta.
+    data = bytearray(koodain.dumps(array.array('i', (1, 2))))
+    data[2:3] = b'n'
+    with self.assertRaises(ValueError):
+      koodain.loads(data)
+    # def testaa_taulukko_vakiokoko
+
+  async def testaa_pakkaus(self):
+    ''' Pakataanko kynnyksen ylittävät sanomat yhteisellä virralla? '''
+    pakkain = zlib.compressobj(
+      zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS,
+      zdict=SANAKIRJA,
+    )
+    purkain = zlib.decompressobj(-zlib.MAX_WBITS, zdict=SANAKIRJA)
+    def pakkaa(data):
+      data = pakkain.compress(data) + pakkain.flush(zlib.Z_SYNC_FLUSH)
+      return b'\x02' + data[:-4]
+    def pura(data):
+      self.assertEqual(data[:1], b'\x02')
+      return json.loads(purkain.decompress(data[1:] + b'\x00\x00\xff\xff'))
+    raaka = mittarit.laskurit['pakkaus.raaka']
+    pakattu = mittarit.laskurit['pakkaus.pakattu']
+    async with self.async_client.websocket(
+      '/pakattu/', protokolla='v1.z'
+    ) as websocket:
+      # Kynnystä pienempi sanoma lähetetään tekstinä.
+      await websocket.send('{}')
+      self.assertEqual(await websocket.receive(), '{"tila": "kunnossa"}')
+      koot = []
+      for tunnus in range(3):
+        sanoma = {'tunnus': tunnus, 'arvot': list(range(10))}
+        await websocket.send(pakkaa(json.dumps(sanoma).encode()))
+        data = await websocket.receive()
+        koot.append(len(data))
+        self.assertEqual(pura(data), {**sanoma, 'tila': 'kunnossa'})
+      # Toistuva rakenne pakkautuu yhteyskohtaisen virran ansiosta.
+      self.assertLess(koot[-1], koot[0])
+    self.assertGreater(mittarit.laskurit['pakkaus.raaka'], raaka)
+    self.assertLess(
+      mittarit.laskurit['pakkaus.pakattu'] - pakattu,
+      mittarit.laskurit['pakkaus.raaka'] - raaka,
+    )
+    self.assertIn('pakkaus.suhde', mittarit.tilasto())
+    # async def testaa_pakkaus
+
+  async def testaa_pakkaus_neuvottelu(self):
+    ''' Ohitetaanko pakkaus, kun sitä ei neuvoteltu? '''
+    async with self.async_client.websocket(
+      '/pakattu/', protokolla='v1'
+    ) as websocket:
+      sanoma = {'tunnus': 1, 'arvot': list(range(10))}
+      await websocket.send(json.dumps(sanoma))
+      self.assertEqual(
+        json.loads(await websocket.receive()),
+        {**sanoma, 'tila': 'kunnossa'}
+      )
+    # async def testaa_pakkaus_neuvottelu
+
+  async def testaa_pakkaus_purettu_enintaan(self):
+    ''' Suljetaanko yhteys, kun purettu sanoma ylittää enimmäiskoon? '''
+    pakkain = zlib.compressobj(
+      zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS
+    )
+    data = pakkain.compress(b'x' * 10000) + pakkain.flush(zlib.Z_SYNC_FLUSH)
+    syote = asyncio.Queue()
+    syote.put_nowait({'type': 'websocket.connect'})
+    syote.put_nowait(
+      {'type': 'websocket.receive', 'bytes': b'\x01' + data[:-4]}
+    )
+    tuloste, vastaanotettu = [], []
+    async def send(sanoma):
+      tuloste.append(sanoma)
+      if sanoma['type'] == 'websocket.close':
+        syote.put_nowait({'type': 'websocket.disconnect'})
+    @WebsocketProtokolla
+    @Pakkaus(purettu_enintaan=1000)
+    async def nakyma(request):
+      vastaanotettu.append(await request.receive())
+    liian_suuri = mittarit.laskurit['pakkaus.liian_suuri']
+    await asyncio.wait_for(nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, syote.get, send
+    )), timeout=1.0)
+    self.assertEqual(vastaanotettu, [])
+    self.assertEqual(tuloste[-1], {'type': 'websocket.close', 'code': 1009})
+    self.assertEqual(
+      mittarit.laskurit['pakkaus.liian_suuri'], liian_suuri + 1
+    )
+    # async def testaa_pakkaus_purettu_enintaan
+
+  async def testaa_koonti(self):
+    ''' Kootaanko lähtevät sanomat taulukoiksi? '''
+    async with self.async_client.websocket('/koottu/') as websocket:
+      self.assertEqual(await websocket.receive(), '[1, 2, 3]')
+      self.assertEqual(await websocket.receive(), '[4]')
+      # Ajastettu lähetys; saman avaimen sanoma korvataan.
+      self.assertEqual(await websocket.receive(), '[{"tila": 2}]')
+      await websocket.send('null')
+      # Kiireellinen sanoma ohittaa koosteen.
+      self.assertEqual(await websocket.receive(), '[7]')
+      self.assertEqual(await websocket.receive(), '[5]')
+      self.assertEqual(await websocket.receive(), '"valmis"')
+      # Näkymän päättyessä jäljellä olevat sanomat lähetetään.
+      self.assertEqual(await websocket.receive(), '[6]')
+    # async def testaa_koonti
+
+  async def testaa_koonti_lahetyksen_aikana(self):
+    ''' Ajastetaanko ajastetun lähetyksen aikana lisätty sanoma? '''
+    # pylint: disable=protected-access
+    silmukka = asyncio.get_running_loop()
+    vapautettu, lahetetty = asyncio.Event(), []
+    async def laheta(data, **kwargs):
+      await vapautettu.wait()
+      lahetetty.append((data, silmukka.time()))
+    kooste = _Kooste(laheta, json.dumps, aika=0.01, enintaan=100)
+    await kooste.send('A')
+    await asyncio.sleep(0.02)
+    # Ajastettu lähetys on kesken.
+    self.assertIsNotNone(kooste._tehtava)
+    await kooste.send('B')
+    vapautettu.set()
+    alku = silmukka.time()
+    while len(lahetetty) < 2 and silmukka.time() - alku < 1.0:
+      await asyncio.sleep(0.005)
+    self.assertEqual([data for data, __ in lahetetty], ['["A"]', '["B"]'])
+    self.assertLess(lahetetty[1][1] - alku, 0.5)
+    kooste.sulje()
+    # async def testaa_koonti_lahetyksen_aikana
+
+  async def testaa_lahetysmaareet(self):
+    ''' Välitetäänkö avain ja kiireellisyys vain annettuina? '''
+    lahetetty = []
+    async def send(data, **kwargs):
+      lahetetty.append((data, kwargs))
+    @JsonLiikenne
+    async def nakyma(request):
+      await request.send(1)
+      await request.send_raw('2')
+      await request.send(3, avain='a')
+      await request.send(4, kiireellinen=True)
+    await nakyma(WebsocketPyynto(
+      {'type': 'websocket', 'path': '/'}, None, send
+    ))
+    self.assertEqual(lahetetty, [
+      ('1', {}),
+      ('2', {}),
+      ('3', {'avain': 'a'}),
+      ('4', {'kiireellinen': True}),
+    ])
+    # async def testaa_lahetysmaareet
+
+  async def testaa_odota_enintaan(self):
+    ''' Toteuttaako `odota_enintaan` aikarajan kutsuvassa tehtävässä? '''
+    tehtavat = []
+    async def alirutiini(viive):
+      tehtavat.append(asyncio.current_task())
+      await asyncio.sleep(viive)
+      return viive
+    self.assertEqual(await odota_enintaan(alirutiini(0), 1.0), 0)
+    with self.assertRaises(asyncio.TimeoutError):
+      await odota_enintaan(alirutiini(1.0), 0.01)
+    self.assertEqual(tehtavat, [asyncio.current_task()] * 2)
+    if hasattr(asyncio.current_task(), 'cancelling'):
+      self.assertEqual(asyncio.current_task().cancelling(), 0)
+    # Tehtävää ei keskeytetä aikarajan jälkeen.
+    await asyncio.sleep(0.02)
+    # async def testaa_odota_enintaan
+
   # class Tyokalut
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from pistoke import mittarit
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.pyynto import WebsocketPyynto
+from pistoke.ryhma import Keskitin
+from pistoke.valitys import (
+  Muistivalitys, Valittaja, Verkkovalitys, _ERA, _koodaa,
+)
+
+
+async def _jasen(keskitin, ryhma):
+  '''
+  Avaa yhteys, joka liittyy ryhmään `ryhma`.
+
+  Palauttaa vastaanotettujen sanomien jonon ja yhteyttä käsittelevän
+  tehtävän, joka päättyy, kun yhteydelle lähetetään sanoma.
+  '''
+  liitytty = asyncio.get_running_loop().create_future()
+  @WebsocketProtokolla
+  async def nakyma(request):
+    with keskitin.liity(request, ryhma):
+      liitytty.set_result(None)
+      await request.receive()
+
+  syote, tuloste = asyncio.Queue(), asyncio.Queue()
+  await syote.put({'type': 'websocket.connect'})
+  async def send(sanoma):
+    if sanoma['type'] == 'websocket.send':
+      await tuloste.put(sanoma.get('text', sanoma.get('bytes')))
+    elif sanoma['type'] == 'websocket.close':
+      syote.put_nowait({'type': 'websocket.disconnect'})
+  yhteys = asyncio.create_task(nakyma(WebsocketPyynto(
+    {'type': 'websocket', 'path': '/'}, syote.get, send
+  )))
+  await liitytty
+  async def sulje():
+    await syote.put({'type': 'websocket.receive', 'text': ''})
+    await yhteys
+  return tuloste, sulje
+  # async def _jasen
+
+
+class Valitys(SimpleTestCase):
+
+  async def testaa_muistivalitys(self):
+    ''' Välitetäänkö sanoma saman prosessin toiselle keskittimelle? '''
+    valitys = Muistivalitys()
+    a, b = Keskitin(valitys=valitys), Keskitin(valitys=valitys)
+    tuloste_a, sulje_a = await _jasen(a, 'ryhma')
+    tuloste_b, sulje_b = await _jasen(b, 'ryhma')
+    self.assertEqual(a.julkaise_raaka('ryhma', 'data'), 1)
+    self.assertEqual(await tuloste_a.get(), 'data')
+    self.assertEqual(await tuloste_b.get(), 'data')
+    await sulje_a()
+    await sulje_b()
+    # async def testaa_muistivalitys
+
+  async def _testaa_valittaja(self, osoite):
+    ''' Välitetäänkö sanomat erinä välittäjän kautta? '''
+    valittaja = Valittaja()
+    palvelin = await valittaja.kaynnista(osoite)
+    if not osoite.startswith('unix:'):
+      osoite = '127.0.0.1:%d' % palvelin.sockets[0].getsockname()[1]
+    valitys_a, valitys_b = Verkkovalitys(osoite), Verkkovalitys(osoite)
+    a, b = Keskitin(valitys=valitys_a), Keskitin(valitys=valitys_b)
+    try:
+      tuloste_a, sulje_a = await _jasen(a, 'ryhma')
+      tuloste_b, sulje_b = await _jasen(b, 'ryhma')
+      # Odotetaan, että kumpikin välitys on yhdistetty.
+      while len(valittaja.asiakkaat) < 2:
+        await asyncio.sleep(0.01)
+
+      lahetetty = mittarit.laskurit['valitys.lahetetty']
+      for i in range(100):
+        a.julkaise('ryhma', i)
+      b.julkaise_raaka('ryhma', b'\x00\x01')
+      # Oman prosessin jäsenet saavat sanoman välittömästi.
+      self.assertEqual(await tuloste_b.get(), b'\x00\x01')
+      for i in range(100):
+        self.assertEqual(await tuloste_a.get(), str(i))
+        self.assertEqual(await tuloste_b.get(), str(i))
+      self.assertEqual(await tuloste_a.get(), b'\x00\x01')
+      # Kunkin keskittimen sanomat kirjoitettiin yhtenä eränä.
+      self.assertEqual(
+        mittarit.laskurit['valitys.lahetetty'], lahetetty + 2
+      )
+      await sulje_a()
+      await sulje_b()
+    finally:
+      await valitys_a.sulje()
+      await valitys_b.sulje()
+      while valittaja.asiakkaat:
+        await asyncio.sleep(0.01)
+      palvelin.close()
+      await palvelin.wait_closed()
+    # async def _testaa_valittaja
+
+  async def testaa_unix(self):
+    ''' Toimiiko välitys Unix-pistokkeen kautta? '''
+    with tempfile.TemporaryDirectory() as hakemisto:
+      await self._testaa_valittaja(
+        'unix:' + os.path.join(hakemisto, 'pistoke.sock')
+      )
+    # async def testaa_unix
+
+  async def testaa_tcp(self):
+    ''' Toimiiko välitys TCP-yhteyden kautta? '''
+    await self._testaa_valittaja('tcp:127.0.0.1:0')
+    # async def testaa_tcp
+
+  async def testaa_virheellinen_era(self):
+    ''' Jatkuuko vastaanotto virheellisen erän ja poikkeuksen jälkeen? '''
+    # pylint: disable=protected-access
+    yhdistetty = asyncio.get_running_loop().create_future()
+    async def asiakas(lukija, kirjoittaja):
+      # pylint: disable=unused-argument
+      yhdistetty.set_result(kirjoittaja)
+    palvelin = await asyncio.start_server(asiakas, '127.0.0.1', 0)
+    vastaanotetut = asyncio.Queue()
+    def vastaanota(ryhma, data):
+      if data == 'virhe':
+        raise ValueError(data)
+      vastaanotetut.put_nowait((ryhma, data))
+    valitys = Verkkovalitys(
+      '127.0.0.1:%d' % palvelin.sockets[0].getsockname()[1]
+    )
+    valitys.liita(vastaanota)
+    try:
+      kirjoittaja = await yhdistetty
+      virheelliset = mittarit.laskurit['valitys.virheellinen']
+      # Katkennut sanoman otsake ja virheellinen UTF-8-nimi.
+      for era in (b'\x00', b'\x00\x01\x00\x00\x00\x00\x00\xff'):
+        kirjoittaja.write(_ERA.pack(len(era)) + era)
+      era = bytearray()
+      _koodaa(era, 'ryhma', 'virhe')
+      _koodaa(era, 'ryhma', 'data')
+      kirjoittaja.write(_ERA.pack(len(era)) + era)
+      with self.assertLogs('django.pistoke.valitys', 'WARNING'):
+        self.assertEqual(await vastaanotetut.get(), ('ryhma', 'data'))
+      self.assertEqual(
+        mittarit.laskurit['valitys.virheellinen'], virheelliset + 2
+      )
+      self.assertFalse(valitys._tehtava.done())
+      kirjoittaja.close()
+    finally:
+      await valitys.sulje()
+      palvelin.close()
+      await palvelin.wait_closed()
+    # async def testaa_virheellinen_era
+
+  # class Valitys
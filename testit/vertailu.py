@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailujen (`testit.vertailu_*`) yhteiset apuvälineet.
+
+Moduulin tuonti alustaa Djangon testiasetuksin. Kukin vertailu
+määrittää oman skenaarionsa ja funktion `main`, joka ajetaan
+komentoriviltä funktiolla `suorita`.
+'''
+
+import asyncio
+import os
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'testit.asetukset')
+
+# pylint: disable=wrong-import-position
+import django
+django.setup()
+
+from django.test.utils import override_settings
+
+from pistoke.pyynto import WebsocketPyynto
+# pylint: enable=wrong-import-position
+
+
+def pyynto(receive, send, polku='/'):
+  ''' Muodosta pyyntö näkymän suorittamiseksi ilman käsittelijää. '''
+  return WebsocketPyynto({'type': 'websocket', 'path': polku}, receive, send)
+  # def pyynto
+
+
+def kasittelijan_scope(polku):
+  ''' Muodosta `WebsocketKasittelija`-kutsun ASGI-määritys. '''
+  return {
+    'type': 'websocket',
+    'path': polku,
+    'query_string': b'',
+    'headers': [(b'host', b'testserver')],
+    'client': ('127.0.0.1', 0),
+    'server': ('testserver', 80),
+  }
+  # def kasittelijan_scope
+
+
+def kanava(kasittele=None):
+  '''
+  Muodosta jonoon perustuva ASGI-kanava.
+
+  Palauttaa syötejonon sekä funktiot `receive` ja `send`. Jonossa on
+  valmiina kättely (`websocket.connect`). Lähtevät sanomat välitetään
+  alirutiinille `kasittele`; palvelimen lähettämä katkaisu kuitataan.
+  '''
+  syote = asyncio.Queue()
+  syote.put_nowait({'type': 'websocket.connect'})
+  async def send(sanoma):
+    if kasittele is not None:
+      await kasittele(sanoma)
+    if sanoma['type'] == 'websocket.close':
+      syote.put_nowait({'type': 'websocket.disconnect'})
+  return syote, syote.get, send
+  # def kanava
+
+
+def odottava_receive(katkaisu):
+  '''
+  Muodosta `receive`-funktio, joka palauttaa kättelyn ja katkaisee
+  yhteyden, kun `katkaisu`-tulevaisuus on valmistunut.
+
+  Kevyempi kuin `kanava`: sopii suurelle määrälle samanaikaisia
+  yhteyksiä, jotka katkaistaan yhtä aikaa.
+  '''
+  kattely = True
+  async def receive():
+    nonlocal kattely
+    if kattely:
+      kattely = False
+      return {'type': 'websocket.connect'}
+    await katkaisu
+    return {'type': 'websocket.disconnect'}
+  return receive
+  # def odottava_receive
+
+
+async def ohita(sanoma):
+  ''' Lähtevä sanoma ohitetaan. '''
+  # pylint: disable=unused-argument
+
+
+def reititys(urlconf, *, ohjaimet=True):
+  '''
+  Ota vertailumoduulin URL-taulu käyttöön; `ohjaimet=False`:
+  ohjainketju (middleware) tyhjennetään.
+  '''
+  return override_settings(
+    ROOT_URLCONF=urlconf,
+    ALLOWED_HOSTS=['testserver'],
+    **({} if ohjaimet else {'MIDDLEWARE': []}),
+  )
+  # def reititys
+
+
+def suorita(main):
+  '''
+  Aja vertailun `main`-funktio komentoriviparametrein: kokonaisluvut
+  annetaan järjestyksessä, valitsin `--nimi` nimettynä parametrinä
+  `nimi=True`.
+  '''
+  parametrit = sys.argv[1:]
+  main(
+    *(int(p) for p in parametrit if not p.startswith('--')),
+    **{p[2:]: True for p in parametrit if p.startswith('--')},
+  )
+  # def suorita
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: pyyntö-vastaus-kutsut yhden yhteyden kautta.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_etakutsu [kutsuja] [kutsun kesto (ms)]
+
+Asiakas lähettää annetun määrän kutsuja kerralla; kunkin käsittely
+kestää annetun ajan (esim. tietokantakysely). Mitataan aika
+ensimmäisestä kutsusta viimeiseen vastaukseen. Vertailtavat tavat:
+- `silmukka`: näkymä lukee ja käsittelee kutsut yksi kerrallaan;
+- `etakutsu-N`: `pistoke.etakutsu.Etakutsu`, enintään N kutsua
+  rinnakkain.
+'''
+
+import asyncio
+import json
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, pyynto, suorita
+
+from pistoke.etakutsu import Etakutsu
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.tyokalut import JsonLiikenne
+
+
+async def _vertailu(nakyma, kutsuja):
+  ''' Lähetä kutsut; palauta kesto sekunteina. '''
+  valmis = asyncio.get_running_loop().create_future()
+  vastauksia = 0
+  async def kasittele(sanoma):
+    nonlocal vastauksia
+    if sanoma['type'] == 'websocket.send':
+      vastauksia += 1
+      if vastauksia == kutsuja:
+        valmis.set_result(time.perf_counter())
+  syote, receive, send = kanava(kasittele)
+
+  yhteys = asyncio.create_task(nakyma(pyynto(receive, send)))
+  alku = time.perf_counter()
+  for tunnus in range(kutsuja):
+    syote.put_nowait({'type': 'websocket.receive', 'text': json.dumps({
+      'jsonrpc': '2.0', 'id': tunnus, 'method': 'kysely', 'params': [],
+    })})
+  loppu = await valmis
+  syote.put_nowait({'type': 'websocket.disconnect'})
+  await yhteys
+  return loppu - alku
+  # async def _vertailu
+
+
+def main(kutsuja=200, kesto=5):
+  async def kysely(request):
+    await asyncio.sleep(kesto / 1000)
+    return {'rivit': []}
+
+  @WebsocketProtokolla
+  @JsonLiikenne
+  async def silmukka(request):
+    async for kutsu in request:
+      await request.send({
+        'jsonrpc': '2.0',
+        'id': kutsu['id'],
+        'result': await kysely(request),
+      })
+
+  tavat = {'silmukka': silmukka}
+  for rinnakkain in (8, 64):
+    rpc = Etakutsu(rinnakkain=rinnakkain, kesken_enintaan=kutsuja)
+    rpc.metodi(kysely)
+    tavat[f'etakutsu-{rinnakkain}'] = rpc
+
+  for nimi, nakyma in tavat.items():
+    kesto_s = asyncio.run(_vertailu(nakyma, kutsuja))
+    print(
+      f'{nimi:>12}: {kutsuja} kutsua, {kesto_s * 1000:.0f} ms,'
+      f' {kutsuja / kesto_s:.0f} kutsua/s'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
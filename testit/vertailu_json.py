@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: JSON-koodaimet `JsonLiikenne`-koristeessa.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_json [sanomia]
+
+Näkymä lähettää annetun määrän JSON-sanomia, jotka luetaan
+`WebsocketPaate`-testipäätteellä. Vertailtavat koodaimet:
+vakiokirjaston `json`, `orjson` (teksti- ja binäärisanomina) sekä
+valmiiksi koodatun sanoman lähetys (`send_raw`).
+'''
+
+import asyncio
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import reititys, suorita
+
+from django.urls import path
+
+from pistoke.koodain import JsonKoodain, OrjsonKoodain
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.testaus import WebsocketPaate
+from pistoke.tyokalut import JsonLiikenne
+
+
+SANOMA = {
+  'tunnus': 12345,
+  'nimi': 'Mittausasema 7',
+  'aikaleima': '2024-01-01T12:00:00Z',
+  'arvot': [round(i * 0.1, 1) for i in range(32)],
+  'tila': {'kunnossa': True, 'varoitukset': []},
+}
+SANOMIA = 20000
+
+
+def _nakyma(**kwargs):
+  @WebsocketProtokolla
+  @JsonLiikenne(**kwargs)
+  async def nakyma(request):
+    for __ in range(SANOMIA):
+      await request.send(SANOMA)
+  return nakyma
+  # def _nakyma
+
+
+@WebsocketProtokolla
+@JsonLiikenne
+async def raaka(request):
+  data = JsonKoodain().dumps(SANOMA)
+  for __ in range(SANOMIA):
+    await request.send_raw(data)
+
+
+urlpatterns = [
+  path('json/', _nakyma(koodain=JsonKoodain)),
+  path('raaka/', raaka),
+]
+try:
+  urlpatterns += [
+    path('orjson/', _nakyma(koodain=OrjsonKoodain)),
+    path('orjson_binaari/', _nakyma(koodain=OrjsonKoodain, teksti=False)),
+  ]
+except ImportError:
+  pass
+
+
+async def _vertailu(polku):
+  paate = WebsocketPaate(websocket_aikakatkaisu=None)
+  alku = time.perf_counter()
+  async with paate.websocket(polku) as websocket:
+    for __ in range(SANOMIA):
+      await websocket.receive()
+  return time.perf_counter() - alku
+  # async def _vertailu
+
+
+def main(sanomia=SANOMIA):
+  # pylint: disable=global-statement
+  global SANOMIA
+  SANOMIA = sanomia
+  with reititys(__name__):
+    for reitti in urlpatterns:
+      polku = f'/{reitti.pattern}'
+      kesto = asyncio.run(_vertailu(polku))
+      print(f'{polku:>18}: {sanomia / kesto:.0f} sanomaa/s')
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: Websocket-kättelyjä sekunnissa.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_kattely [--ohjaimet] [yhteyksiä] [samanaikaisesti]
+
+Kukin yhteys avataan ja suljetaan `WebsocketKasittelija`-käsittelijän
+kautta ilman verkkoliikennettä; mitattava aika koostuu Django-signaaleista,
+reitityksestä ja protokollan avaus- ja sulkukättelystä. Asiakas kuittaa
+palvelimen lähettämän katkaisun välittömästi. Ohjainketju (middleware)
+ohitetaan, ellei vipua `--ohjaimet` anneta.
+'''
+
+import asyncio
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, kasittelijan_scope, reititys, suorita
+
+from django.urls import path
+
+from pistoke.kasittelija import WebsocketKasittelija
+from pistoke.protokolla import WebsocketProtokolla
+
+
+@WebsocketProtokolla
+async def tyhja(request):
+  pass
+
+
+urlpatterns = [path('tyhja/', tyhja)]
+
+
+async def _yhteys(kasittelija):
+  # Asiakas kuittaa palvelimen lähettämän katkaisun (websocket.close).
+  __, receive, send = kanava()
+  await kasittelija(kasittelijan_scope('/tyhja/'), receive, send)
+  # async def _yhteys
+
+
+async def _vertailu(yhteyksia, samanaikaisesti):
+  kasittelija = WebsocketKasittelija()
+  rajoitin = asyncio.Semaphore(samanaikaisesti)
+  async def _rajoitettu():
+    async with rajoitin:
+      await _yhteys(kasittelija)
+  alku = time.perf_counter()
+  await asyncio.gather(*(_rajoitettu() for __ in range(yhteyksia)))
+  return time.perf_counter() - alku
+  # async def _vertailu
+
+
+def main(yhteyksia=2000, samanaikaisesti=500, ohjaimet=False):
+  with reititys(__name__, ohjaimet=ohjaimet):
+    kesto = asyncio.run(_vertailu(yhteyksia, samanaikaisesti))
+  print(
+    f'{yhteyksia} kättelyä ({samanaikaisesti} samanaikaisesti):'
+    f' {kesto:.3f} s, {yhteyksia / kesto:.0f} kättelyä/s'
+  )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: kiireellisten sanomien viive täyden puskurin takana.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_kiireelliset [sanomia]
+
+Näkymä täyttää lähetepuskurin (`lahtevia_enintaan=1000`) massadatalla
+ja lähettää sen jälkeen tasaisin välein ohjaussanoman (esim. ping tai
+peruutus). ASGI-palvelin kirjoittaa sanoman 0,1 ms:ssa. Mitataan
+ohjaussanomien viive lähetyksestä kirjoitukseen:
+- `jono`: ohjaussanomat jonotetaan massadatan perään;
+- `kiireellinen`: `request.send(..., kiireellinen=True)`.
+'''
+
+import asyncio
+import statistics
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, pyynto, suorita
+
+from pistoke.protokolla import WebsocketProtokolla
+
+
+MASSA = 'x' * 1024
+
+
+async def _vertailu(sanomia, kiireellinen):
+  ''' Lähetä sanomat; palauta ohjaussanomien viiveet sekunteina. '''
+  lahetetty = {}
+  viiveet = []
+  async def kasittele(sanoma):
+    if sanoma['type'] == 'websocket.send':
+      await asyncio.sleep(0.0001)
+      alku = lahetetty.pop(sanoma['text'], None)
+      if alku is not None:
+        viiveet.append(time.perf_counter() - alku)
+  __, receive, send = kanava(kasittele)
+
+  @WebsocketProtokolla(lahtevia_enintaan=1000)
+  async def nakyma(request):
+    async def ohjaus():
+      for i in range(20):
+        await asyncio.sleep(0.005)
+        teksti = f'ping {i}'
+        lahetetty[teksti] = time.perf_counter()
+        await request.send(teksti, kiireellinen=kiireellinen)
+    tehtava = asyncio.create_task(ohjaus())
+    for __ in range(sanomia):
+      await request.send(MASSA)
+    await tehtava
+
+  await nakyma(pyynto(receive, send))
+  return viiveet
+  # async def _vertailu
+
+
+def main(sanomia=5000):
+  for nimi, kiireellinen in (('jono', False), ('kiireellinen', True)):
+    viiveet = asyncio.run(_vertailu(sanomia, kiireellinen))
+    print(
+      f'{nimi:>12}: viive mediaani'
+      f' {statistics.median(viiveet) * 1000:.1f} ms,'
+      f' enintään {max(viiveet) * 1000:.1f} ms'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
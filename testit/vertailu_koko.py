@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: saapuvien sanomien kokorajat.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_koko [sanomia]
+
+1. Läpäisy: asiakas lähettää annetun määrän pieniä sanomia;
+   mitataan sanomaa/s ilman rajoja ja rajojen kanssa (tarkistuksen
+   hinta).
+2. Muisti: asiakas lähettää 20 kpl 10 Mt:n sanomia näkymälle, joka
+   jää jälkeen (lukee sanoman 50 ms välein `JsonLiikenne`-koristeen
+   kautta). Mitataan Python-muistin huippukäyttö (tracemalloc) ilman
+   rajoja ja rajalla `syotejono_tavuja_enintaan=32 Mt`.
+'''
+
+import asyncio
+import time
+import tracemalloc
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, ohita, pyynto, suorita
+
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.tyokalut import JsonLiikenne
+
+
+RAJAT = {
+  'saapuvan_koko_enintaan': 1 << 20,
+  'syotejono_tavuja_enintaan': 32 << 20,
+}
+
+
+async def _lapaisy(parametrit, sanomia):
+  ''' Lähetä pienet sanomat; palauta kesto sekunteina. '''
+  kasitelty = 0
+  kattely = True
+  lahetetty = 0
+  async def receive():
+    nonlocal kattely, lahetetty
+    if kattely:
+      kattely = False
+      return {'type': 'websocket.connect'}
+    if lahetetty < sanomia:
+      lahetetty += 1
+      return {'type': 'websocket.receive', 'text': '{"x": 1}'}
+    while kasitelty < sanomia:
+      await asyncio.sleep(0)
+    return {'type': 'websocket.disconnect'}
+
+  @WebsocketProtokolla(syotejono_enintaan=100, **parametrit)
+  async def nakyma(request):
+    nonlocal kasitelty
+    async for __ in request:
+      kasitelty += 1
+
+  alku = time.perf_counter()
+  await nakyma(pyynto(receive, ohita))
+  return time.perf_counter() - alku
+  # async def _lapaisy
+
+
+async def _muisti(parametrit):
+  ''' Lähetä suuret sanomat; palauta muistin huippu ja katkaisukoodi. '''
+  katkaisu = None
+  async def kasittele(sanoma):
+    nonlocal katkaisu
+    if sanoma['type'] == 'websocket.close':
+      katkaisu = sanoma.get('code')
+  syote, seuraava, send = kanava(kasittele)
+  async def receive():
+    sanoma = await seuraava()
+    if sanoma['type'] == 'websocket.receive':
+      # Palvelin on vastaanottanut kehyksen muistiin.
+      sanoma = {**sanoma, 'text': '"' + 'x' * (10 << 20) + '"'}
+    return sanoma
+
+  @WebsocketProtokolla(**parametrit)
+  @JsonLiikenne
+  async def nakyma(request):
+    for __ in range(20):
+      await request.receive()
+      await asyncio.sleep(0.05)
+
+  for __ in range(20):
+    syote.put_nowait({'type': 'websocket.receive'})
+  tracemalloc.start()
+  try:
+    await nakyma(pyynto(receive, send))
+  except WebsocketProtokolla.SyotettaEiLuettu:
+    pass
+  __, huippu = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return huippu, katkaisu
+  # async def _muisti
+
+
+def main(sanomia=200000):
+  for nimi, parametrit in (('rajoittamaton', {}), ('rajat', RAJAT)):
+    kesto = asyncio.run(_lapaisy(parametrit, sanomia))
+    print(f'{nimi:>13}: {sanomia / kesto:.0f} sanomaa/s')
+  for nimi, parametrit in (
+    ('rajoittamaton', {}),
+    ('rajat', {'syotejono_tavuja_enintaan': 32 << 20}),
+  ):
+    huippu, katkaisu = asyncio.run(_muisti(parametrit))
+    print(
+      f'{nimi:>13}: muistin huippu {huippu >> 20} Mt,'
+      f' katkaisukoodi {katkaisu}'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
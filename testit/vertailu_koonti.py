@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: pienten JSON-sanomien koonti.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_koonti [sanomia]
+
+Näkymä lähettää annetun määrän pieniä JSON-sanomia `JsonLiikenne`-
+koristeen kautta. ASGI-palvelimen `send` koodaa kunkin kehyksen
+tavujonoksi (vrt. palvelimen kehyskohtainen käsittely). Vertailtavat
+tavat:
+- `erikseen`: kukin sanoma omana kehyksenään;
+- `koonti-N`: `JsonLiikenne(koonti=0.005, koonti_enintaan=N)`; sanomat
+  lähetetään N sanoman JSON-taulukkoina.
+'''
+
+import asyncio
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, pyynto, suorita
+
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.tyokalut import JsonLiikenne
+
+
+SANOMA = {'tyyppi': 'hinta', 'tunnus': 42, 'arvo': 17.25}
+
+
+async def _vertailu(koriste, sanomia):
+  ''' Lähetä sanomat; palauta kesto sekunteina ja kehysten määrä. '''
+  kehyksia = 0
+  async def kasittele(sanoma):
+    nonlocal kehyksia
+    if sanoma['type'] == 'websocket.send':
+      kehyksia += 1
+      sanoma['text'].encode('utf-8')
+  __, receive, send = kanava(kasittele)
+
+  kesto = None
+  @WebsocketProtokolla
+  @koriste
+  async def nakyma(request):
+    nonlocal kesto
+    alku = time.perf_counter()
+    for __ in range(sanomia):
+      await request.send(SANOMA)
+    flush = getattr(request, 'flush', None)
+    if flush is not None:
+      await flush()
+    kesto = time.perf_counter() - alku
+
+  await nakyma(pyynto(receive, send))
+  return kesto, kehyksia
+  # async def _vertailu
+
+
+def main(sanomia=200000):
+  tavat = {'erikseen': JsonLiikenne}
+  for enintaan in (10, 100):
+    tavat[f'koonti-{enintaan}'] = JsonLiikenne(
+      koonti=0.005, koonti_enintaan=enintaan
+    )
+  for nimi, koriste in tavat.items():
+    kesto, kehyksia = asyncio.run(_vertailu(koriste, sanomia))
+    print(
+      f'{nimi:>10}: {sanomia / kesto:.0f} sanomaa/s,'
+      f' {kehyksia} kehystä'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: muistinkäyttö ja tehtävät per avoin yhteys.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_muisti [--ohjaimet] [yhteyksiä]
+
+Avataan annettu määrä yhteyksiä näkymään, joka jää odottamaan syötettä,
+ja mitataan `tracemalloc`-moduulilla yhteyksien varaama muisti sekä
+tapahtumasilmukan tehtävien määrä yhteyttä kohti. Ohjainketju
+(middleware) ohitetaan, ellei vipua `--ohjaimet` anneta.
+'''
+
+import asyncio
+import tracemalloc
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import (
+  kasittelijan_scope, odottava_receive, reititys, suorita,
+)
+
+from django.urls import path
+
+from pistoke.kasittelija import WebsocketKasittelija
+from pistoke.protokolla import WebsocketProtokolla
+
+
+@WebsocketProtokolla
+async def odottava(request):
+  await request.receive()
+
+
+urlpatterns = [path('odottava/', odottava)]
+
+
+def _yhteys(kasittelija, hyvaksytty, katkaisu):
+  '''
+  Avaa yhteys, joka jää odottamaan syötettä.
+
+  `hyvaksytty`-tulevaisuus valmistuu, kun yhteys on hyväksytty;
+  `katkaisu`-tulevaisuuden valmistuttua asiakas katkaisee yhteyden.
+  '''
+  async def send(sanoma):
+    if sanoma['type'] == 'websocket.accept':
+      hyvaksytty.set_result(None)
+  return asyncio.create_task(kasittelija(
+    kasittelijan_scope('/odottava/'), odottava_receive(katkaisu), send
+  ))
+  # def _yhteys
+
+
+async def _vertailu(yhteyksia):
+  silmukka = asyncio.get_running_loop()
+  kasittelija = WebsocketKasittelija()
+  katkaisu = silmukka.create_future()
+
+  # Lämmitetään käsittelijä yhdellä yhteydellä ennen mittausta.
+  hyvaksytty = silmukka.create_future()
+  lammitys = _yhteys(kasittelija, hyvaksytty, katkaisu)
+  await hyvaksytty
+
+  tehtavia = len(asyncio.all_tasks())
+  tracemalloc.start()
+  alku = tracemalloc.take_snapshot()
+  hyvaksytyt = [silmukka.create_future() for __ in range(yhteyksia)]
+  yhteydet = [
+    _yhteys(kasittelija, hyvaksytty, katkaisu)
+    for hyvaksytty in hyvaksytyt
+  ]
+  await asyncio.gather(*hyvaksytyt)
+  # Annetaan yhteyksien asettua lepotilaan.
+  for __ in range(10):
+    await asyncio.sleep(0)
+  loppu = tracemalloc.take_snapshot()
+  tehtavia = len(asyncio.all_tasks()) - tehtavia
+  tracemalloc.stop()
+
+  katkaisu.set_result(None)
+  await asyncio.gather(lammitys, *yhteydet)
+  muisti = sum(
+    tilasto.size_diff
+    for tilasto in loppu.compare_to(alku, 'filename')
+  )
+  return muisti, tehtavia
+  # async def _vertailu
+
+
+def main(yhteyksia=1000, ohjaimet=False):
+  with reititys(__name__, ohjaimet=ohjaimet):
+    muisti, tehtavia = asyncio.run(_vertailu(yhteyksia))
+  print(
+    f'{yhteyksia} avointa yhteyttä:'
+    f' {muisti / yhteyksia / 1024:.1f} KiB/yhteys,'
+    f' {tehtavia / yhteyksia:.1f} tehtävää/yhteys'
+  )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: saapuvien sanomien kiintiö.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_rajoitus [sanomia]
+
+Asiakas lähettää annetun määrän sanomia niin nopeasti kuin vastapaine
+(syötejono 100 sanomaa) sallii; näkymä jäsentää kunkin sanoman
+JSON-muodosta. Mitataan kokonaisaika ja näkymälle asti päässeiden
+sanomien määrä:
+- `rajoittamaton`: ei kiintiötä;
+- `kiintio`: kiintiö, joka ei ylity (kiintiön laskennan hinta);
+- `pudota`: 1000 sanomaa/s, ylimenevät sanomat hylätään.
+'''
+
+import asyncio
+import json
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import ohita, pyynto, suorita
+
+from pistoke import mittarit
+from pistoke.protokolla import WebsocketProtokolla
+
+
+SANOMA = json.dumps({'tyyppi': 'liike', 'x': 123, 'y': 456, 'napit': [1, 0]})
+
+
+async def _vertailu(parametrit, sanomia):
+  ''' Lähetä sanomat; palauta kesto ja käsiteltyjen sanomien määrä. '''
+  kasitelty = 0
+  pudotettu = mittarit.laskurit['rajoitus.pudotettu']
+  kattely = True
+  lahetetty = 0
+  async def receive():
+    nonlocal kattely, lahetetty
+    if kattely:
+      kattely = False
+      return {'type': 'websocket.connect'}
+    if lahetetty < sanomia:
+      lahetetty += 1
+      return {'type': 'websocket.receive', 'text': SANOMA}
+    # Katkaistaan yhteys, kun näkymä on lukenut kaikki sanomat.
+    while kasitelty + mittarit.laskurit['rajoitus.pudotettu'] \
+    < sanomia + pudotettu:
+      await asyncio.sleep(0)
+    return {'type': 'websocket.disconnect'}
+
+  # Rajattu syötejono: lukeminen odottaa näkymää (TCP-vastapaine).
+  @WebsocketProtokolla(syotejono_enintaan=100, **parametrit)
+  async def nakyma(request):
+    nonlocal kasitelty
+    async for data in request:
+      json.loads(data)
+      kasitelty += 1
+
+  alku = time.perf_counter()
+  await nakyma(pyynto(receive, ohita))
+  return time.perf_counter() - alku, kasitelty
+  # async def _vertailu
+
+
+def main(sanomia=200000):
+  tavat = {
+    'rajoittamaton': {},
+    'kiintio': {'saapuvia_sekunnissa': 1e9},
+    'pudota': {
+      'saapuvia_sekunnissa': 1000, 'saapuvien_ylitys': 'pudota',
+    },
+  }
+  for nimi, parametrit in tavat.items():
+    kesto, kasitelty = asyncio.run(_vertailu(parametrit, sanomia))
+    print(
+      f'{nimi:>13}: {sanomia / kesto:.0f} sanomaa/s,'
+      f' näkymälle {kasitelty} / {sanomia}'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
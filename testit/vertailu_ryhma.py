@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: ryhmälähetys usealle yhteydelle.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_ryhma [jäseniä] [kierroksia]
+
+Avataan annettu määrä yhteyksiä ja julkaistaan kullakin kierroksella
+yksi JSON-sanoma kaikille. Mitataan aika julkaisusta siihen, kun
+viimeinenkin jäsen on saanut sanoman (ASGI-palvelimen `send`).
+Vertailtavat tavat:
+- `nakymat`: kukin näkymä lukee sanoman omasta jonostaan ja lähettää
+  sen `JsonLiikenne`-koristeen kautta (koodaus jäsentä kohti);
+- `keskitin`: `pistoke.ryhma.Keskitin` koodaa sanoman kerran ja lisää
+  saman ASGI-sanoman kunkin jäsenen jonoon.
+'''
+
+import asyncio
+import statistics
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import odottava_receive, pyynto, suorita
+
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.ryhma import Keskitin
+from pistoke.tyokalut import JsonLiikenne
+
+
+SANOMA = {
+  'tunnus': 12345,
+  'nimi': 'Mittausasema 7',
+  'aikaleima': '2024-01-01T12:00:00Z',
+  'arvot': [round(i * 0.1, 1) for i in range(32)],
+  'tila': {'kunnossa': True, 'varoitukset': []},
+}
+
+
+class _Vastaanotto:
+  ''' Laske vastaanotetut sanomat; herätä, kun kaikki ovat perillä. '''
+
+  def __init__(self, odotettu):
+    self.odotettu = odotettu
+    self.saatu = 0
+    self.valmis = None
+
+  def odota(self):
+    self.saatu = 0
+    self.valmis = asyncio.get_running_loop().create_future()
+    return self.valmis
+
+  def kirjaa(self):
+    self.saatu += 1
+    if self.saatu == self.odotettu:
+      self.valmis.set_result(time.perf_counter())
+
+  # class _Vastaanotto
+
+
+def _yhteys(nakyma, vastaanotto, hyvaksytty, katkaisu):
+  async def send(sanoma):
+    if sanoma['type'] == 'websocket.send':
+      vastaanotto.kirjaa()
+    elif sanoma['type'] == 'websocket.accept':
+      hyvaksytty.set_result(None)
+  return asyncio.create_task(
+    nakyma(pyynto(odottava_receive(katkaisu), send))
+  )
+  # def _yhteys
+
+
+async def _vertailu(tapa, jasenia, kierroksia):
+  silmukka = asyncio.get_running_loop()
+  katkaisu = silmukka.create_future()
+  vastaanotto = _Vastaanotto(jasenia)
+
+  if tapa == 'keskitin':
+    keskitin = Keskitin()
+    @WebsocketProtokolla
+    @JsonLiikenne
+    async def nakyma(request):
+      with keskitin.liity(request, 'ryhma'):
+        await request.receive()
+    def julkaise(sanoma):
+      keskitin.julkaise('ryhma', sanoma)
+  else:
+    jonot = []
+    @WebsocketProtokolla
+    @JsonLiikenne
+    async def nakyma(request):
+      jono = asyncio.Queue()
+      jonot.append(jono)
+      while True:
+        await request.send(await jono.get())
+    def julkaise(sanoma):
+      for jono in jonot:
+        jono.put_nowait(sanoma)
+
+  hyvaksytyt = [silmukka.create_future() for __ in range(jasenia)]
+  yhteydet = [
+    _yhteys(nakyma, vastaanotto, hyvaksytty, katkaisu)
+    for hyvaksytty in hyvaksytyt
+  ]
+  await asyncio.gather(*hyvaksytyt)
+  for __ in range(10):
+    await asyncio.sleep(0)
+
+  viiveet, julkaisut = [], []
+  for __ in range(kierroksia):
+    valmis = vastaanotto.odota()
+    alku = time.perf_counter()
+    julkaise(SANOMA)
+    julkaisut.append(time.perf_counter() - alku)
+    viiveet.append(await valmis - alku)
+
+  katkaisu.set_result(None)
+  for yhteys in yhteydet:
+    yhteys.cancel()
+  await asyncio.gather(*yhteydet, return_exceptions=True)
+  return viiveet, julkaisut
+  # async def _vertailu
+
+
+def main(jasenia=10000, kierroksia=20):
+  for tapa in ('nakymat', 'keskitin'):
+    viiveet, julkaisut = asyncio.run(
+      _vertailu(tapa, jasenia, kierroksia)
+    )
+    print(
+      f'{tapa:>9}: {jasenia} jäsentä,'
+      f' viive ka. {statistics.mean(viiveet) * 1000:.1f} ms,'
+      f' enint. {max(viiveet) * 1000:.1f} ms,'
+      f' julkaisukutsu {statistics.mean(julkaisut) * 1000:.1f} ms'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
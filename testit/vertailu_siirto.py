@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: binääridatan siirtonopeus protokollakerroksen läpi.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_siirto [sanomia] [sanoman koko (tavua)]
+
+Näkymä lähettää annetun määrän sanomia `request.send`-kutsulla eri
+tietotyypeillä (bytes, bytearray, memoryview, array). ASGI-palvelimen
+`send` ei tee mitään, joten mitattava aika koostuu protokollakerroksen
+käsittelystä (tyyppitarkistus, mahdollinen kopiointi, ASGI-sanoman
+muodostus). Kukin tyyppi mitataan oletusasetuksin (kopioiden) sekä
+`nollakopio=True`-asetuksella.
+'''
+
+import array
+import asyncio
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, pyynto, suorita
+
+from pistoke.protokolla import WebsocketProtokolla
+
+
+async def _siirto(data, sanomia, nollakopio):
+  ''' Lähetä `data` `sanomia` kertaa; palauta kesto sekunteina. '''
+  __, receive, send = kanava()
+
+  kesto = None
+  @WebsocketProtokolla(nollakopio=nollakopio)
+  async def nakyma(request):
+    nonlocal kesto
+    alku = time.perf_counter()
+    for __ in range(sanomia):
+      await request.send(data)
+    kesto = time.perf_counter() - alku
+
+  await nakyma(pyynto(receive, send))
+  return kesto
+  # async def _siirto
+
+
+def main(sanomia=100000, koko=65536):
+  tyypit = {
+    'bytes': bytes(koko),
+    'bytearray': bytearray(koko),
+    'memoryview': memoryview(bytearray(koko)),
+    'array': array.array('d', bytes(koko)),
+  }
+  for nollakopio in (False, True):
+    print(f'nollakopio={nollakopio}')
+    for nimi, data in tyypit.items():
+      kesto = asyncio.run(_siirto(data, sanomia, nollakopio))
+      print(
+        f'{nimi:>10}: {sanomia / kesto:.0f} sanomaa/s,'
+        f' {sanomia * koko / kesto / 2 ** 20:.0f} MiB/s'
+      )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: numeeristen taulukoiden siirto.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_taulukko [sanomia] [alkioita]
+
+Näkymä lähettää annetun määrän liukulukutaulukoita, jotka luetaan ja
+puretaan `WebsocketPaate`-testipäätteellä. Vertailtavat polut:
+`JsonLiikenne` (vakiokirjaston `json` ja `orjson`) sekä
+`BinaariLiikenne(koodain='taulukko')`.
+'''
+
+import array
+import asyncio
+import time
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import reititys, suorita
+
+from django.urls import path
+
+from pistoke.koodain import JsonKoodain, OrjsonKoodain, TaulukkoKoodain
+from pistoke.protokolla import WebsocketProtokolla
+from pistoke.testaus import WebsocketPaate
+from pistoke.tyokalut import BinaariLiikenne, JsonLiikenne
+
+
+SANOMIA = 2000
+ALKIOITA = 4096
+TAULUKKO = array.array('d')
+
+
+@WebsocketProtokolla
+@JsonLiikenne(koodain=JsonKoodain)
+async def json_(request):
+  for __ in range(SANOMIA):
+    await request.send(TAULUKKO.tolist())
+
+
+@WebsocketProtokolla
+@BinaariLiikenne(koodain='taulukko')
+async def taulukko(request):
+  for __ in range(SANOMIA):
+    await request.send(TAULUKKO)
+
+
+# Polku, näkymä ja vastaanottajan käyttämä koodain.
+vertailut = [
+  ('json/', json_, JsonKoodain()),
+  ('taulukko/', taulukko, TaulukkoKoodain()),
+]
+try:
+  @WebsocketProtokolla
+  @JsonLiikenne(koodain=OrjsonKoodain, teksti=False)
+  async def orjson_(request):
+    for __ in range(SANOMIA):
+      await request.send(TAULUKKO.tolist())
+  vertailut.append(('orjson/', orjson_, OrjsonKoodain()))
+except ImportError:
+  pass
+urlpatterns = [path(polku, nakyma) for polku, nakyma, __ in vertailut]
+
+
+async def _vertailu(polku, koodain):
+  paate = WebsocketPaate(websocket_aikakatkaisu=None)
+  alku = time.perf_counter()
+  async with paate.websocket(f'/{polku}') as websocket:
+    for __ in range(SANOMIA):
+      koodain.loads(await websocket.receive())
+  return time.perf_counter() - alku
+  # async def _vertailu
+
+
+def main(sanomia=SANOMIA, alkioita=ALKIOITA):
+  # pylint: disable=global-statement
+  global SANOMIA
+  SANOMIA = sanomia
+  TAULUKKO.extend(i * 0.001 for i in range(alkioita))
+  with reititys(__name__):
+    for polku, __, koodain in vertailut:
+      kesto = asyncio.run(_vertailu(polku, koodain))
+      print(
+        f'{polku:>10}: {sanomia / kesto:.0f} sanomaa/s,'
+        f' {sanomia * alkioita * 8 / kesto / 2 ** 20:.0f} MiB/s'
+      )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
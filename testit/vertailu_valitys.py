@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: ryhmäsanomien välitys prosessien välillä.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_valitys [sanomia] [erän koko]
+
+Käynnistetään välittäjä Unix-pistokkeeseen ja liitetään siihen kaksi
+`Verkkovalitys`-asiakasta. Ensimmäinen julkaisee annetun määrän
+sanomia `erän koko` sanoman ryppäinä (tapahtumasilmukan kierrosta
+kohti); mitataan aika, jossa toinen asiakas on vastaanottanut kaikki.
+Vertaillaan sanomien koontia eriksi (oletus) ja sanomakohtaista
+kirjoitusta (`koonti=False`).
+'''
+
+import asyncio
+import os
+import tempfile
+import time
+
+from pistoke import mittarit
+from pistoke.valitys import Valittaja, Verkkovalitys
+
+from testit.vertailu import suorita
+
+
+SANOMA = '{"tunnus": 12345, "tila": "kunnossa", "arvo": 1.5}'
+
+
+async def _vertailu(osoite, sanomia, eran_koko, koonti):
+  valittaja = Valittaja()
+  palvelin = await valittaja.kaynnista(osoite)
+  vastaanotettu = 0
+  valmis = asyncio.get_running_loop().create_future()
+  def vastaanota(ryhma, data):
+    nonlocal vastaanotettu
+    vastaanotettu += 1
+    if vastaanotettu == sanomia:
+      valmis.set_result(time.perf_counter())
+  lahettaja = Verkkovalitys(osoite, koonti=koonti)
+  lahettaja.liita(lambda ryhma, data: None)
+  vastaanottaja = Verkkovalitys(osoite)
+  vastaanottaja.liita(vastaanota)
+  while len(valittaja.asiakkaat) < 2:
+    await asyncio.sleep(0.01)
+
+  eria = mittarit.laskurit['valitys.lahetetty']
+  alku = time.perf_counter()
+  for i in range(0, sanomia, eran_koko):
+    for __ in range(min(eran_koko, sanomia - i)):
+      lahettaja.julkaise('ryhma', SANOMA)
+    await asyncio.sleep(0)
+  kesto = await valmis - alku
+  eria = mittarit.laskurit['valitys.lahetetty'] - eria
+
+  await lahettaja.sulje()
+  await vastaanottaja.sulje()
+  while valittaja.asiakkaat:
+    await asyncio.sleep(0.01)
+  palvelin.close()
+  await palvelin.wait_closed()
+  return kesto, eria
+  # async def _vertailu
+
+
+def main(sanomia=200000, eran_koko=100):
+  with tempfile.TemporaryDirectory() as hakemisto:
+    osoite = 'unix:' + os.path.join(hakemisto, 'pistoke.sock')
+    for koonti in (False, True):
+      kesto, eria = asyncio.run(
+        _vertailu(osoite, sanomia, eran_koko, koonti)
+      )
+      print(
+        f'koonti={koonti!s:>5}: {sanomia / kesto:.0f} sanomaa/s,'
+        f' {eria} kirjoitusta'
+      )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+'''
+Suorituskykyvertailu: hitaan vastaanottajan lähtevät tilapäivitykset.
+
+Ajetaan komennolla:
+  python -m testit.vertailu_yhdistaminen [päivityksiä] [avaimia]
+
+Näkymä lähettää annetun määrän JSON-muotoisia tilapäivityksiä satunnaisille
+avaimille (esim. kohteen tunnus) 10 000 päivityksen sekuntivauhdilla.
+ASGI-palvelin kirjoittaa sanoman 1 ms:ssa, joten vastaanottaja jää
+jälkeen. Mitataan lähetettyjen sanomien ja tavujen määrä sekä puskurin
+enimmäispituus:
+- `jono`: kukin päivitys lähetetään;
+- `yhdistetty`: `request.send(..., avain=...)`; puskurissa odottava saman
+  avaimen päivitys korvataan uusimmalla.
+'''
+
+import asyncio
+import json
+import random
+
+# Apumoduulin tuonti alustaa Djangon ennen muita tuonteja.
+# pylint: disable=wrong-import-order
+from testit.vertailu import kanava, pyynto, suorita
+
+from pistoke.protokolla import WebsocketProtokolla
+
+
+async def _vertailu(paivityksia, avaimia, yhdista):
+  sanomia = tavuja = 0
+  async def kasittele(sanoma):
+    nonlocal sanomia, tavuja
+    if sanoma['type'] == 'websocket.send':
+      await asyncio.sleep(0.001)
+      sanomia += 1
+      tavuja += len(sanoma['text'])
+  __, receive, send = kanava(kasittele)
+
+  enimmillaan = 0
+  @WebsocketProtokolla(lahtevia_enintaan=paivityksia)
+  async def nakyma(request):
+    nonlocal enimmillaan
+    satunnainen = random.Random(0)
+    for i in range(paivityksia):
+      avain = satunnainen.randrange(avaimia)
+      await request.send(
+        json.dumps({'kohde': avain, 'arvo': i, 'tila': 'kunnossa'}),
+        avain=avain if yhdista else None,
+      )
+      if i % 10 == 9:
+        await asyncio.sleep(0.001)
+    enimmillaan = request.mittarit['lahete.enimmillaan']
+
+  await nakyma(pyynto(receive, send))
+  return sanomia, tavuja, enimmillaan
+  # async def _vertailu
+
+
+def main(paivityksia=5000, avaimia=50):
+  for nimi, yhdista in (('jono', False), ('yhdistetty', True)):
+    sanomia, tavuja, enimmillaan = asyncio.run(
+      _vertailu(paivityksia, avaimia, yhdista)
+    )
+    print(
+      f'{nimi:>10}: {sanomia} sanomaa, {tavuja // 1024} KiB,'
+      f' puskurissa enintään {enimmillaan} sanomaa'
+    )
+  # def main
+
+
+if __name__ == '__main__':
+  suorita(main)